@@ -4,11 +4,19 @@ from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import precision_score
 from utils import status_calc
+import datastore
+import instrumentation
+import portfolio
+import feature_schema
+from price_matrix import PriceMatrix
+from feature_store import FeatureStore
+from config import OUTPERFORMANCE, N_JOBS, configure_logging
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Set WALK_FORWARD=0 for the original backtest on a random train/test split
+WALK_FORWARD = os.getenv("WALK_FORWARD", "1") == "1"
 
 def load_data(file_path):
     """
@@ -17,8 +25,12 @@ def load_data(file_path):
     :return: DataFrame with data
     """
     try:
-        data_df = pd.read_csv(file_path, index_col="Date")
-        data_df.dropna(axis=0, how="any", inplace=True)
+        with instrumentation.stage("load_data"):
+            data_df = datastore.read_csv(file_path, index_col="Date")
+            rows = len(data_df)
+            data_df.dropna(axis=0, how="any", inplace=True)
+        instrumentation.count("load_data", "bytes_read", os.path.getsize(file_path))
+        instrumentation.count("load_data", "dropped_missing_values", rows - len(data_df))
         return data_df
     except Exception as e:
         logging.error(f"Error loading data from {file_path}: {str(e)}")
@@ -31,11 +43,21 @@ def split_data(data_df, test_size=0.2):
     :param test_size: Proportion of the dataset to include in the test split
     :return: Split datasets (X_train, X_test, y_train, y_test, z_train, z_test)
     """
-    features = data_df.columns[6:]
-    X = data_df[features].values
-    y = list(status_calc(data_df["stock_p_change"], data_df["SP500_p_change"], outperformance=10))
-    z = np.array(data_df[["stock_p_change", "SP500_p_change"]])
-    return train_test_split(X, y, z, test_size=test_size, random_state=0)
+    with instrumentation.stage("split_data"):
+        X = feature_schema.feature_matrix(data_df, feature_schema.feature_columns(data_df.columns), np.float64)
+        y = list(status_calc(data_df["stock_p_change"], data_df["SP500_p_change"], outperformance=OUTPERFORMANCE))
+        z = np.array(data_df[["stock_p_change", "SP500_p_change"]])
+        return train_test_split(X, y, z, test_size=test_size, random_state=0)
+
+def split_arrays(arrays, test_size=0.2):
+    """
+    Split arrays which are already built into train and test sets, in the same way as split_data
+    :param arrays: dict with X, y and z, as returned by datastore.read_training_arrays
+    :param test_size: Proportion of the dataset to include in the test split
+    :return: Split datasets (X_train, X_test, y_train, y_test, z_train, z_test)
+    """
+    with instrumentation.stage("split_data"):
+        return train_test_split(arrays["X"], list(arrays["y"]), arrays["z"], test_size=test_size, random_state=0)
 
 def train_model(X_train, y_train):
     """
@@ -45,7 +67,9 @@ def train_model(X_train, y_train):
     :return: Trained model
     """
     clf = RandomForestClassifier(n_estimators=100, random_state=0)
-    clf.fit(X_train, y_train)
+    with instrumentation.stage("fit"):
+        clf.fit(X_train, y_train)
+    instrumentation.count("fit", "rows", len(X_train))
     return clf
 
 def evaluate_model(clf, X_test, y_test):
@@ -56,7 +80,9 @@ def evaluate_model(clf, X_test, y_test):
     :param y_test: Test data labels
     :return: Predicted labels and evaluation metrics
     """
-    y_pred = clf.predict(X_test)
+    with instrumentation.stage("predict"):
+        y_pred = clf.predict(X_test)
+    instrumentation.count("predict", "rows", len(X_test))
     accuracy = clf.score(X_test, y_test)
     precision = precision_score(y_test, y_pred)
     return y_pred, accuracy, precision
@@ -68,15 +94,13 @@ def calculate_returns(y_pred, z_test):
     :param z_test: Test data returns
     :return: Stock and market returns, and performance metrics
     """
-    num_positive_predictions = sum(y_pred)
+    y_pred = np.asarray(y_pred, dtype=bool)
+    num_positive_predictions = int(np.count_nonzero(y_pred))
     if num_positive_predictions <= 0:
         logging.warning("No stocks predicted!")
-        return 0, 0, 0
+        return 0, 0, 0, 0
 
-    stock_returns = 1 + z_test[y_pred, 0] / 100
-    market_returns = 1 + z_test[y_pred, 1] / 100
-    avg_predicted_stock_growth = sum(stock_returns) / num_positive_predictions
-    index_growth = sum(market_returns) / num_positive_predictions
+    avg_predicted_stock_growth, index_growth = (1 + z_test[y_pred] / 100).mean(axis=0)
     percentage_stock_returns = 100 * (avg_predicted_stock_growth - 1)
     percentage_market_returns = 100 * (index_growth - 1)
     total_outperformance = percentage_stock_returns - percentage_market_returns
@@ -89,12 +113,17 @@ def backtest():
     :return: None
     """
     logging.info("Starting backtest...")
-    data_df = load_data("keystats.csv")
-    if data_df.empty:
+    try:
+        with instrumentation.stage("load_data"):
+            arrays = datastore.read_training_arrays("keystats.csv", OUTPERFORMANCE)
+    except Exception as e:
+        logging.error(f"Error loading data from keystats.csv: {str(e)}")
+        arrays = None
+    if arrays is None or not len(arrays["X"]):
         logging.error("Data loading failed. Exiting backtest.")
         return
 
-    X_train, X_test, y_train, y_test, z_train, z_test = split_data(data_df)
+    X_train, X_test, y_train, y_test, z_train, z_test = split_arrays(arrays)
     clf = train_model(X_train, y_train)
     y_pred, accuracy, precision = evaluate_model(clf, X_test, y_test)
 
@@ -110,5 +139,201 @@ def backtest():
     logging.info(f"Average market return in the same period: {percentage_market_returns:.1f}%")
     logging.info(f"Compared to the index, our strategy earns {total_outperformance:.1f} percentage points more")
 
+def prepare_arrays(data_df, outperformance=OUTPERFORMANCE):
+    """
+    Precompute the feature, label and return arrays once, sorted by date, so that every walk-forward
+    step can use contiguous slices instead of re-slicing the DataFrame. The arrays are built by a
+    FeatureStore of the data, labelled with the returns in its stock_p_change and SP500_p_change columns.
+    :param data_df: DataFrame with data, indexed by Date
+    :param outperformance: Percentage by which a stock has to beat the S&P500 to be labelled 1
+    :return: dict with dates (datetime64[D]), X, y, z and tickers, all sorted by date (rows with a missing
+             value are left out)
+    """
+    return FeatureStore.from_keystats(data_df).training_arrays(outperformance)
+
+def load_arrays(file_path, outperformance=OUTPERFORMANCE):
+    """
+    Stream a CSV into the same sorted arrays as prepare_arrays, without building the full DataFrame
+    :param file_path: Path to the CSV file
+    :param outperformance: Percentage by which a stock has to beat the S&P500 to be labelled 1
+    :return: dict with dates (datetime64[D]), X, y, z and tickers, all sorted by date
+    """
+    arrays = datastore.stream_training_arrays(file_path, outperformance)
+    dates = arrays["dates"].astype("datetime64[D]")
+    order = np.argsort(dates, kind="stable")
+    if np.all(order[1:] > order[:-1]):
+        return dict(arrays, dates=dates)
+    return {name: array[order] for name, array in dict(arrays, dates=dates).items()}
+
+def walk_forward_folds(dates, min_train_days=730, test_days=182, train_days=None, embargo_days=365):
+    """
+    Split a sorted date array into walk-forward folds. Each fold tests on the next test_days and trains only on
+    snapshots whose one-year label was already known at the start of the test period (hence the embargo).
+    :param dates: sorted datetime64[D] array
+    :param min_train_days: Length of history required before the first test period
+    :param test_days: Length of each test period (and the step between folds)
+    :param train_days: Length of a sliding training window, or None for an expanding window
+    :param embargo_days: Gap between the end of training and the start of testing (the label horizon)
+    :return: list of (train_start, train_end, test_start, test_end) index bounds into dates
+    """
+    if len(dates) == 0:
+        return []
+    folds = []
+    test_start_date = dates[0] + np.timedelta64(min_train_days + embargo_days, "D")
+    while test_start_date <= dates[-1]:
+        test_end_date = test_start_date + np.timedelta64(test_days, "D")
+        train_end_date = test_start_date - np.timedelta64(embargo_days, "D")
+        train_start_date = dates[0] if train_days is None else train_end_date - np.timedelta64(train_days, "D")
+
+        train_start, train_end, test_start, test_end = np.searchsorted(
+            dates, [train_start_date, train_end_date, test_start_date, test_end_date]
+        )
+        if train_end > train_start and test_end > test_start:
+            folds.append((int(train_start), int(train_end), int(test_start), int(test_end)))
+        test_start_date = test_end_date
+    return folds
+
+# Arrays shared by the walk-forward worker processes, set once per process by _init_worker
+_shared_arrays = {}
+
+def _init_worker(arrays):
+    _shared_arrays.update(arrays)
+
+def run_fold(fold, n_estimators=100):
+    """
+    Train on one fold's training window and evaluate on its test period
+    :param fold: (train_start, train_end, test_start, test_end) index bounds into the shared arrays
+    :param n_estimators: Number of trees in the forest
+    :return: dict of results for the period
+    """
+    train_start, train_end, test_start, test_end = fold
+    arrays = _shared_arrays
+    X_train, y_train = arrays["X"][train_start:train_end], arrays["y"][train_start:train_end]
+    X_test, y_test = arrays["X"][test_start:test_end], arrays["y"][test_start:test_end]
+    z_test = arrays["z"][test_start:test_end]
+
+    clf = RandomForestClassifier(n_estimators=n_estimators, random_state=0)
+    with instrumentation.stage("fit"):
+        clf.fit(X_train, y_train)
+    with instrumentation.stage("predict"):
+        y_pred = clf.predict(X_test).astype(bool)
+    instrumentation.count("fit", "rows", train_end - train_start)
+    instrumentation.count("predict", "rows", test_end - test_start)
+
+    num_positive_predictions = int(y_pred.sum())
+    if num_positive_predictions:
+        _, stock_return, market_return, outperformance = calculate_returns(y_pred, z_test)
+    else:
+        stock_return = market_return = outperformance = np.nan
+    return {
+        "period_start": arrays["dates"][test_start],
+        "period_end": arrays["dates"][test_end - 1],
+        "n_train": train_end - train_start,
+        "n_test": test_end - test_start,
+        "trades": num_positive_predictions,
+        "accuracy": float((y_pred == y_test).mean()),
+        "precision": float(y_test[y_pred].mean()) if num_positive_predictions else np.nan,
+        "stock_return": stock_return,
+        "spy_return": market_return,
+        "outperformance": outperformance,
+        "tickers": " ".join(arrays["tickers"][test_start:test_end][y_pred]),
+        "signal_rows": test_start + np.flatnonzero(y_pred),
+    }
+
+def walk_forward_backtest(arrays, n_jobs=N_JOBS, n_estimators=100, **fold_kwargs):
+    """
+    Walk-forward backtest: retrain the classifier at each step on data available at the time,
+    then trade the following period. Folds are independent, so they run in parallel across processes.
+    :param arrays: The date-sorted arrays returned by prepare_arrays or load_arrays
+    :param n_jobs: Number of worker processes
+    :param n_estimators: Number of trees in the forest
+    :param fold_kwargs: Passed to walk_forward_folds
+    :return: DataFrame with one row per test period
+    """
+    folds = walk_forward_folds(arrays["dates"], **fold_kwargs)
+    logging.info(f"Walk-forward backtest over {len(folds)} periods...")
+
+    if n_jobs <= 1:
+        _init_worker(arrays)
+        results = [run_fold(fold, n_estimators) for fold in folds]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(arrays,)) as executor:
+            results = list(
+                instrumentation.map_collected(executor.map, run_fold, folds, [n_estimators] * len(folds))
+            )
+    return pd.DataFrame(results)
+
+def report_walk_forward(results):
+    """
+    Log the per-period results and the totals over all periods
+    :param results: DataFrame returned by walk_forward_backtest
+    :return: None
+    """
+    if results.empty:
+        logging.warning("Not enough data for a walk-forward backtest.")
+        return
+
+    logging.info("\nWalk-forward performance by period\n%s\n%s", "=" * 40,
+                 results.drop(columns=["tickers", "signal_rows"]).to_string(index=False, float_format="%.2f"))
+
+    traded = results[results["trades"] > 0]
+    weights = traded["trades"] / traded["trades"].sum()
+    stock_return = (traded["stock_return"] * weights).sum()
+    spy_return = (traded["spy_return"] * weights).sum()
+    logging.info(f"Total Trades: {int(results['trades'].sum())}")
+    logging.info(f"Average return for stock predictions: {stock_return:.1f}%")
+    logging.info(f"Average SPY return in the same periods: {spy_return:.1f}%")
+    logging.info(f"Compared to the index, our strategy earns {stock_return - spy_return:.1f} percentage points more")
+
+def report_portfolio(results, arrays, prices):
+    """
+    Simulate a portfolio which buys every stock predicted by the walk-forward backtest, and log its performance
+    :param results: DataFrame returned by walk_forward_backtest
+    :param arrays: The arrays the backtest was run on
+    :param prices: PriceMatrix
+    :return: dict returned by portfolio.simulate
+    """
+    rows = np.concatenate(list(results["signal_rows"]))
+    result = portfolio.simulate(prices, arrays["dates"][rows], arrays["tickers"][rows])
+    logging.info("\nPortfolio simulation (%d slots, %.0f bps costs)\n%s", portfolio.MAX_POSITIONS,
+                 portfolio.COST_BPS, "=" * 40)
+    logging.info(f"Trades: {result['trades']} ({result['skipped']} skipped for lack of capital, "
+                 f"{result['untradable']} without prices)")
+    logging.info(f"Total return: {100 * result['total_return']:.1f}% (SPY: {100 * result['spy_return']:.1f}%)")
+    logging.info(f"Alpha: {100 * result['alpha']:.1f}% a year, beta: {result['beta']:.2f}")
+    logging.info(f"Max drawdown: {100 * result['max_drawdown']:.1f}%, turnover: {result['turnover']:.2f}x a year")
+    return result
+
+def main(walk_forward=WALK_FORWARD, n_jobs=N_JOBS):
+    """
+    Run the walk-forward backtest and the portfolio simulation of its trades, or the original backtest
+    :param walk_forward: Run the walk-forward backtest rather than the backtest on a random train/test split
+    :param n_jobs: Number of worker processes for the walk-forward periods
+    :return: None
+    """
+    if not walk_forward:
+        backtest()
+        return
+    if datastore.STREAMING:
+        arrays = load_arrays("keystats.csv")
+    else:
+        data_df = load_data("keystats.csv")
+        arrays = None if data_df.empty else prepare_arrays(data_df)
+    if arrays is None:
+        logging.error("Data loading failed. Exiting backtest.")
+        return
+    results = walk_forward_backtest(arrays, n_jobs)
+    report_walk_forward(results)
+    if results.empty:
+        return
+    try:
+        prices = PriceMatrix.load()
+    except Exception as e:
+        logging.error(f"Could not load the price data for the portfolio simulation: {str(e)}")
+    else:
+        report_portfolio(results, arrays, prices)
+
 if __name__ == "__main__":
-    backtest()
\ No newline at end of file
+    configure_logging()
+    instrumentation.configure()
+    main()
@@ -0,0 +1,172 @@
+"""
+Benchmarks for the hot paths of the pipeline, run on a synthetic dataset of configurable size.
+
+    python benchmarks/run_benchmarks.py --tickers 50 --snapshots 40 --label my-change
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/baseline.json benchmarks/results/my-change.json
+
+Each benchmark records the best wall time over --repeat runs, a throughput and the peak memory allocated
+by python (measured with tracemalloc in a separate run, so it does not slow down the timings).
+Results are written to benchmarks/results/<label>.json so that versions can be compared offline.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backtesting  # noqa: E402
+import datastore  # noqa: E402
+import parse_cache  # noqa: E402
+import parsing_keystats  # noqa: E402
+from benchmarks.synthetic import make_dataset  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def measure(fn, repeat, setup=None):
+    """
+    Time a function and measure its peak memory
+    :param fn: function to benchmark, called with the result of setup
+    :param repeat: number of timed runs
+    :param setup: optional function run (untimed) before every call
+    :return: (best time in seconds, peak memory in MB, return value of the last call)
+    """
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        result = fn(arg)
+        times.append(time.perf_counter() - start)
+
+    arg = setup() if setup else None
+    tracemalloc.start()
+    fn(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak / 1e6, result
+
+
+def run_benchmarks(n_tickers, n_snapshots, repeat):
+    """
+    Generate the synthetic dataset and run every benchmark
+    :return: dict of results by benchmark name
+    """
+    results = {}
+
+    def record(name, seconds, peak_mb, count, unit):
+        results[name] = {"seconds": seconds, "peak_mb": peak_mb, "count": count,
+                         "throughput": count / seconds if seconds else None, "unit": unit}
+        logging.info(f"{name:<22} {seconds * 1000:10.1f} ms {count / seconds:12.1f} {unit} {peak_mb:8.1f} MB")
+
+    workdir = tempfile.mkdtemp(prefix="mls-bench-")
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        statspath = make_dataset(workdir, parsing_keystats.features, n_tickers, n_snapshots)
+        parsing_keystats.statspath = statspath
+        datastore.CACHE_DIR = os.path.join(workdir, "cache")
+        html_files = [os.path.join(d, f) for d, _, files in os.walk(statspath) for f in files]
+        parse_all = lambda _: [parsing_keystats.parse_html_file(f, parsing_keystats.features) for f in html_files]  # noqa: E731
+
+        parse_cache.PARSE_CACHE = ""
+        seconds, peak, _ = measure(parse_all, repeat)
+        record("parse_html_file", seconds, peak, len(html_files), "files/s")
+
+        parse_cache.PARSE_CACHE = os.path.join(workdir, "cache", "parse_cache.sqlite")
+        parse_all(None)
+        seconds, peak, _ = measure(parse_all, repeat)
+        record("parse_html_file (cached)", seconds, peak, len(html_files), "files/s")
+        # The remaining benchmarks measure the uncached parse, so that they stay comparable between versions
+        parse_cache.PARSE_CACHE = ""
+
+        seconds, peak, prices = measure(lambda _: parsing_keystats.preprocess_price_data(), repeat)
+        record("preprocess_price_data", seconds, peak, len(prices), "rows/s")
+
+        seconds, peak, keystats_df = measure(lambda _: parsing_keystats.parse_keystats(prices), repeat)
+        record("parse_keystats", seconds, peak, len(html_files), "files/s")
+        keystats_df.to_csv("keystats.csv", index=False)
+
+        clear_cache = lambda: shutil.rmtree(datastore.CACHE_DIR, ignore_errors=True)  # noqa: E731
+        seconds, peak, data_df = measure(lambda _: backtesting.load_data("keystats.csv"), repeat, setup=clear_cache)
+        record("load_data (cold)", seconds, peak, len(keystats_df), "rows/s")
+        seconds, peak, data_df = measure(lambda _: backtesting.load_data("keystats.csv"), repeat)
+        record("load_data (cached)", seconds, peak, len(keystats_df), "rows/s")
+
+        seconds, peak, splits = measure(lambda _: backtesting.split_data(data_df), repeat)
+        record("split_data", seconds, peak, len(data_df), "rows/s")
+        X_train, X_test, y_train, y_test, z_train, z_test = splits
+
+        seconds, peak, clf = measure(lambda _: backtesting.train_model(X_train, y_train), repeat)
+        record("train_model", seconds, peak, len(X_train), "rows/s")
+
+        y_pred = clf.predict(X_test).astype(bool)
+        seconds, peak, _ = measure(lambda _: backtesting.calculate_returns(y_pred, z_test), repeat)
+        record("calculate_returns", seconds, peak, len(y_pred), "rows/s")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(baseline_path, candidate_path):
+    """
+    Print the ratio of candidate to baseline time for every benchmark in both files
+    """
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    with open(candidate_path) as file:
+        candidate = json.load(file)
+
+    print(f"{'benchmark':<22} {'baseline ms':>12} {'candidate ms':>12} {'ratio':>8} {'peak MB':>16}")
+    for name, result in candidate["results"].items():
+        if name not in baseline["results"]:
+            continue
+        old = baseline["results"][name]
+        ratio = result["seconds"] / old["seconds"]
+        flag = "  slower" if ratio > 1.1 else ""
+        print(f"{name:<22} {old['seconds'] * 1000:12.1f} {result['seconds'] * 1000:12.1f} {ratio:8.2f} "
+              f"{old['peak_mb']:7.1f} -> {result['peak_mb']:5.1f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickers", type=int, default=20, help="number of synthetic tickers")
+    parser.add_argument("--snapshots", type=int, default=20, help="number of html snapshots per ticker")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed runs per benchmark")
+    parser.add_argument("--label", default=datetime.now().strftime("%Y%m%d-%H%M%S"), help="name of the results file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="compare two results files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s", force=True)
+    logging.getLogger().setLevel(logging.INFO)
+    results = run_benchmarks(args.tickers, args.snapshots, args.repeat)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = {
+        "label": args.label,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "params": {"tickers": args.tickers, "snapshots": args.snapshots, "repeat": args.repeat},
+        "results": results,
+    }
+    output_path = os.path.join(RESULTS_DIR, f"{args.label}.json")
+    with open(output_path, "w") as file:
+        json.dump(output, file, indent=2)
+    logging.info(f"Results written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Generates a synthetic intraQuarter/_KeyStats tree and price CSVs for benchmarking.
+The html imitates the layout of the Yahoo Finance key statistics tables that the parser expects.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+START_DATE = "2003-08-01"
+END_DATE = "2015-01-01"
+
+
+def _random_value(rng):
+    # Missing values are rare, so that most rows survive the dropna in load_data
+    if rng.rand() < 0.002:
+        return "N/A"
+    kind = rng.randint(1, 6)
+    if kind == 1:
+        return f"{rng.uniform(-100, 100):.2f}%"
+    if kind == 2:
+        return f"{rng.uniform(0, 900):.2f}{'KMB'[rng.randint(0, 3)]}"
+    if kind == 3:
+        return f"{rng.randint(1, 999)},{rng.randint(100, 999)},{rng.randint(100, 999)}"
+    if kind == 4:
+        return f"{rng.uniform(0, 50):.3f}"
+    return ">0"
+
+
+def snapshot_html(features, rng, padding=200):
+    """
+    :param features: feature labels to include
+    :param rng: numpy RandomState
+    :param padding: number of filler rows, which make the documents a realistic size
+    :return: html string
+    """
+    rows = [f'<tr><td class="yfnc_tablehead1">Filler {i}</td><td>text</td></tr>' for i in range(padding)]
+    for feature in features:
+        if rng.rand() < 0.001:
+            continue
+        rows.append(
+            f'<tr><td class="yfnc_tablehead1" width="74%">{feature}<font size="-1"><sup>1</sup></font>:</td>'
+            f'<td class="yfnc_tabledata1">{_random_value(rng)}</td></tr>'
+        )
+    return "<html><body><table>" + "\n".join(rows) + "</table></body></html>"
+
+
+def make_dataset(root, features, n_tickers=20, n_snapshots=20, seed=0):
+    """
+    Write a synthetic _KeyStats tree, stock_prices.csv and sp500_index.csv under root
+    :param root: output directory
+    :param features: feature labels to include in the html
+    :param n_tickers: number of ticker directories
+    :param n_snapshots: number of html snapshots per ticker
+    :param seed: random seed
+    :return: path of the _KeyStats directory
+    """
+    rng = np.random.RandomState(seed)
+    statspath = os.path.join(root, "intraQuarter", "_KeyStats") + os.sep
+    tickers = [f"t{i:04d}" for i in range(n_tickers)]
+    snapshot_dates = pd.date_range("2004-01-01", "2013-06-01", freq="h")
+
+    for ticker in tickers:
+        os.makedirs(statspath + ticker, exist_ok=True)
+        for date in snapshot_dates[rng.choice(len(snapshot_dates), n_snapshots, replace=False)]:
+            with open(os.path.join(statspath + ticker, date.strftime("%Y%m%d%H%M%S.html")), "w") as file:
+                file.write(snapshot_html(features, rng))
+
+    dates = pd.bdate_range(START_DATE, END_DATE, name="Date")
+    returns = rng.normal(0.0003, 0.02, (len(dates), n_tickers))
+    prices = pd.DataFrame(50 * np.exp(np.cumsum(returns, axis=0)), index=dates,
+                          columns=[ticker.upper() for ticker in tickers])
+    prices.to_csv(os.path.join(root, "stock_prices.csv"))
+
+    spy = 100 * np.exp(np.cumsum(rng.normal(0.0002, 0.01, len(dates))))
+    sp500 = pd.DataFrame({"Open": spy, "High": spy, "Low": spy, "Close": spy, "Adj Close": spy,
+                          "Volume": 1000000}, index=dates)
+    sp500.to_csv(os.path.join(root, "sp500_index.csv"))
+    return statspath
@@ -0,0 +1,112 @@
+"""
+Command line interface to the whole pipeline.
+
+    python cli.py download                  # stock and S&P500 prices (download_historical_prices.py)
+    python cli.py parse --jobs 8            # keystats.csv from the html snapshots (parsing_keystats.py)
+    python cli.py forward --incremental     # forward_sample.csv from the current pages (current_data.py)
+    python cli.py backtest                  # walk-forward backtest and portfolio simulation (backtesting.py)
+    python cli.py predict                   # stocks predicted to outperform (stock_prediction.py)
+    python cli.py serve --port 8765         # local prediction server (prediction_server.py)
+    python cli.py sweep --jobs 4            # parameter sweep (sweep.py)
+
+Each command only imports the modules it needs, so --help and the commands which fail early do not pay for
+pandas, numpy or sklearn. The instrumentation flags (--instrument, --profile-stage, ...) work with every command.
+"""
+import argparse
+import config
+import instrumentation
+
+
+def run_parse(args):
+    import parsing_keystats
+    parsing_keystats.main(incremental=args.incremental, use_hash=args.hash, n_jobs=args.jobs)
+
+
+def run_download(args):
+    import download_historical_prices
+    download_historical_prices.main()
+
+
+def run_forward(args):
+    import current_data
+    current_data.main(download=not args.no_download, incremental=args.incremental, use_hash=args.hash)
+
+
+def run_backtest(args):
+    import backtesting
+    backtesting.main(walk_forward=not args.random_split, n_jobs=args.jobs)
+
+
+def run_predict(args):
+    import stock_prediction
+    stock_prediction.main()
+
+
+def run_serve(args):
+    import prediction_server
+    prediction_server.main(args.extra)
+
+
+def run_sweep(args):
+    import sweep
+    sweep.main(args.extra)
+
+
+def make_parser():
+    """
+    :return: ArgumentParser with one subcommand per script
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    incremental = argparse.ArgumentParser(add_help=False)
+    incremental.add_argument("--incremental", action="store_true", default=config.INCREMENTAL,
+                             help="only parse the files which are new or have changed since the last run")
+    incremental.add_argument("--hash", action="store_true", default=config.MANIFEST_HASH,
+                             help="compare file contents rather than size and modification time")
+
+    command = commands.add_parser("parse", parents=[incremental], help="build keystats.csv")
+    command.add_argument("--jobs", type=int, default=config.N_JOBS, help="number of worker processes")
+    command.set_defaults(run=run_parse)
+
+    command = commands.add_parser("download", help="download the stock and S&P500 prices")
+    command.set_defaults(run=run_download)
+
+    command = commands.add_parser("forward", parents=[incremental], help="build forward_sample.csv")
+    command.add_argument("--no-download", action="store_true",
+                         help=f"only parse the pages already in {config.forwardpath}")
+    command.set_defaults(run=run_forward)
+
+    command = commands.add_parser("backtest", help="backtest the strategy")
+    command.add_argument("--random-split", action="store_true",
+                         help="the original backtest on a random train/test split, rather than walk-forward")
+    command.add_argument("--jobs", type=int, default=config.N_JOBS, help="number of worker processes")
+    command.set_defaults(run=run_backtest)
+
+    command = commands.add_parser("predict", help="predict the stocks which will outperform the S&P500")
+    command.set_defaults(run=run_predict)
+
+    # These scripts have their own arguments, which are passed on to them
+    command = commands.add_parser("serve", add_help=False, help="run the local prediction server")
+    command.set_defaults(run=run_serve, passthrough=True)
+    command = commands.add_parser("sweep", add_help=False, help="sweep the thresholds and model parameters")
+    command.set_defaults(run=run_sweep, passthrough=True)
+    return parser
+
+
+def main(argv=None):
+    """
+    :param argv: Command line arguments (defaults to sys.argv[1:])
+    """
+    parser = make_parser()
+    args, extra = parser.parse_known_args(instrumentation.configure(argv))
+    if extra and not getattr(args, "passthrough", False):
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    args.extra = extra
+    config.configure_logging()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
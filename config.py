@@ -0,0 +1,44 @@
+"""
+Settings shared by the pipeline scripts. This module does not import pandas, numpy or sklearn (nor does
+feature_schema), so that the settings can be read cheaply, e.g by the command line interface or the tests.
+
+Every setting can be overridden with the environment variable of the same name.
+"""
+import logging
+import os
+import feature_schema
+
+# The directory where individual html files are stored
+statspath = os.getenv("STATSPATH", "intraQuarter/_KeyStats/")
+# The directory where the current html pages are downloaded
+forwardpath = os.getenv("FORWARDPATH", "forward/")
+
+# The percentage by which a stock has to beat the S&P500 to be labelled 1
+OUTPERFORMANCE = int(os.getenv("OUTPERFORMANCE", 10))
+
+# The number of worker processes used to parse the html files, or to run the walk-forward periods
+N_JOBS = int(os.getenv("N_JOBS", 1))
+
+# Set INCREMENTAL=1 to only parse the files which are new or have changed since the last run.
+# MANIFEST_HASH=1 compares file contents rather than size and modification time.
+INCREMENTAL = os.getenv("INCREMENTAL", "0") == "1"
+MANIFEST_HASH = os.getenv("MANIFEST_HASH", "0") == "1"
+
+# The labels of the features in the historical html files (which are also the column names),
+# and in the current Yahoo Finance pages. See feature_schema.py.
+features = feature_schema.labels("keystats")
+forward_features = feature_schema.labels("forward")
+
+# Older snapshots label the average volume differently
+FALLBACK_LABELS = feature_schema.fallbacks("keystats")
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+def configure_logging(level=logging.INFO):
+    """
+    Configure logging for a script. This is done when a script starts rather than when a module is imported,
+    so that importing a module does not change the logging of the program that imports it.
+    :param level: Logging level
+    """
+    logging.basicConfig(level=level, format=LOG_FORMAT)
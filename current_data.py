@@ -1,33 +1,26 @@
-import pandas as pd
 import os
-import re
-import time
-import requests
-import numpy as np
+import pandas as pd
 from tqdm import tqdm
-from utils import data_string_to_float
+from feature_extractor import read_document
+from fetcher import Fetcher
+from manifest import file_fingerprint, fingerprint_changed, load_manifest, save_manifest
+import instrumentation
+import parse_cache
+import feature_schema
+from row_buffer import RowBuffer
+from config import statspath, forwardpath, INCREMENTAL, MANIFEST_HASH, configure_logging
+from config import forward_features as features
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# The path to your fundamental data
-statspath = os.getenv("STATSPATH", "intraQuarter/_KeyStats/")
-forwardpath = os.getenv("FORWARDPATH", "forward/")
-
-# These are the features that will be parsed
-features = [
-    "Market Cap", "Enterprise Value", "Trailing P/E", "Forward P/E", "PEG Ratio",
-    "Price/Sales", "Price/Book", "Enterprise Value/Revenue", "Enterprise Value/EBITDA",
-    "Profit Margin", "Operating Margin", "Return on Assets", "Return on Equity",
-    "Revenue", "Revenue Per Share", "Quarterly Revenue Growth", "Gross Profit",
-    "EBITDA", "Net Income Avi to Common", "Diluted EPS", "Quarterly Earnings Growth",
-    "Total Cash", "Total Cash Per Share", "Total Debt", "Total Debt/Equity",
-    "Current Ratio", "Book Value Per Share", "Operating Cash Flow", "Levered Free Cash Flow",
-    "Beta", "50-Day Moving Average", "200-Day Moving Average", "Avg Vol (3 month)",
-    "Shares Outstanding", "Float", "% Held by Insiders", "% Held by Institutions",
-    "Shares Short", "Short Ratio", "Short % of Float", "Shares Short (prior month)"
-]
+# Download settings for the current data
+YAHOO_URL = os.getenv("YAHOO_URL", "http://finance.yahoo.com/quote/{ticker}/key-statistics")
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", 8))
+DOWNLOAD_RATE = float(os.getenv("DOWNLOAD_RATE", 5))
+# ETag/Last-Modified headers of the downloaded pages (kept outside forwardpath, which must only hold html files)
+VALIDATORS_PATH = os.getenv("VALIDATORS_PATH", "forward_validators.json")
+
+# Precompiled extractor for the forward features, whose values are written under the canonical feature names
+EXTRACTOR = feature_schema.get_extractor("forward")
 
 def get_ticker_list(statspath):
     """
@@ -40,82 +33,176 @@ def get_ticker_list(statspath):
         ticker_list.remove(".DS_Store")
     return ticker_list
 
-def download_html(ticker):
+def yahoo_url(ticker, url_template=YAHOO_URL):
     """
-    Downloads the HTML file for a given ticker from Yahoo Finance.
     :param ticker: Stock ticker symbol
+    :param url_template: url with a {ticker} placeholder
+    :return: url of the key statistics page for the ticker
     """
-    try:
-        link = f"http://finance.yahoo.com/quote/{ticker.upper()}/key-statistics"
-        resp = requests.get(link)
-        save_path = os.path.join(forwardpath, f"{ticker}.html")
-        with open(save_path, "w") as file:
-            file.write(resp.text)
-    except Exception as e:
-        logging.error(f"Error downloading data for {ticker}: {str(e)}")
-        time.sleep(2)
+    return url_template.format(ticker=ticker.upper())
 
-def check_yahoo():
+def check_yahoo(concurrency=DOWNLOAD_CONCURRENCY, rate=DOWNLOAD_RATE, url_template=YAHOO_URL):
     """
-    Retrieves the stock ticker from the _KeyStats directory, then downloads the HTML file from Yahoo Finance.
-    :return: None
+    Retrieves the stock ticker from the _KeyStats directory, then downloads the HTML files from Yahoo Finance
+    concurrently. Pages which have not changed since the last run are not downloaded again.
+    :param concurrency: Maximum number of downloads in flight
+    :param rate: Maximum number of requests per second
+    :param url_template: url with a {ticker} placeholder
+    :return: dict mapping each result ("downloaded", "unchanged", "failed") to its number of tickers
     """
     if not os.path.exists(forwardpath):
         os.makedirs(forwardpath)
 
     ticker_list = get_ticker_list(statspath)
+    fetcher = Fetcher(concurrency=concurrency, rate=rate, validators_path=VALIDATORS_PATH)
+    jobs = [
+        (ticker, yahoo_url(ticker, url_template), os.path.join(forwardpath, f"{ticker}.html"))
+        for ticker in ticker_list
+    ]
 
-    for ticker in tqdm(ticker_list, desc="Download progress:", unit="tickers"):
-        download_html(ticker)
+    summary = {"downloaded": 0, "unchanged": 0, "failed": 0}
+    with instrumentation.stage("download"):
+        for ticker, result in tqdm(fetcher.fetch_all(jobs), total=len(jobs), desc="Download progress:",
+                                   unit="tickers"):
+            summary[result] += 1
+            instrumentation.count("download", result)
+            if result == "failed":
+                logging.error(f"Error downloading data for {ticker}")
+        fetcher.save_validators()
+    logging.info(f"Download summary: {summary}")
+    return summary
 
 def parse_html(tickerfile):
     """
-    Parses the HTML file to extract feature values.
+    Parses the HTML file to extract feature values. Pages which have not changed since they were last
+    parsed are looked up in the parse cache instead.
     :param tickerfile: HTML file for a ticker
     :return: List of feature values
     """
+    cache = parse_cache.get_cache()
     try:
-        with open(os.path.join(forwardpath, tickerfile)) as file:
-            source = file.read().replace(",", "")
-            
-        value_list = []
-        for variable in features:
-            regex = (
-                r">" + re.escape(variable) + r".*?(\-?\d+\.*\d*K?M?B?|N/A[\\n|\s]*|>0|NaN)%?"
-                r"(</td>|</span>)"
-            )
-            match = re.search(regex, source, flags=re.DOTALL)
-            value = match.group(1) if match else "N/A"
-            value_list.append(data_string_to_float(value))
-        return value_list
+        if cache is not None:
+            return cache.extract_file(os.path.join(forwardpath, tickerfile), EXTRACTOR)
+        with instrumentation.stage("read_html"):
+            source = read_document(os.path.join(forwardpath, tickerfile))
+        instrumentation.count("read_html", "bytes_read", len(source))
+        return EXTRACTOR.extract(source)
     except Exception as e:
         logging.error(f"Error parsing file {tickerfile}: {str(e)}")
         return ["N/A"] * len(features)
 
-def forward():
+def list_forward_files():
     """
-    Creates the forward sample by parsing the current data HTML files that we downloaded in check_yahoo().
-    :return: pandas DataFrame containing all of the current data for each ticker.
+    :return: List of the html files in forwardpath, in directory listing order
     """
-    df_columns = [
-        "Date", "Unix", "Ticker", "Price", "stock_p_change", "SP500", "SP500_p_change"
-    ] + features
-
-    df = pd.DataFrame(columns=df_columns)
     tickerfile_list = os.listdir(forwardpath)
-
     if ".DS_Store" in tickerfile_list:
         tickerfile_list.remove(".DS_Store")
+    return tickerfile_list
 
+def file_ticker(tickerfile):
+    """
+    :param tickerfile: HTML file for a ticker, e.g "aapl.html"
+    :return: the ticker, in upper case
+    """
+    return tickerfile.split(".html")[0].upper()
+
+def parse_forward_files(tickerfile_list):
+    """
+    Parse the current data HTML files of some tickers
+    :param tickerfile_list: HTML files to parse
+    :return: pandas DataFrame with one row per file
+    """
+    df_columns = ["Date"] + feature_schema.INDEX_COLUMNS + feature_schema.names()
+
+    rows = RowBuffer(df_columns, float_columns=feature_schema.names())
     for tickerfile in tqdm(tickerfile_list, desc="Parsing progress:", unit="tickers"):
-        ticker = tickerfile.split(".html")[0].upper()
+        ticker = file_ticker(tickerfile)
         value_list = parse_html(tickerfile)
-        new_df_row = [0, 0, ticker, 0, 0, 0, 0] + value_list
-        df = df.append(dict(zip(df_columns, new_df_row)), ignore_index=True)
+        with instrumentation.stage("build_rows"):
+            rows.append([0, 0, ticker, 0, 0, 0, 0] + value_list)
+    return rows.to_frame()
 
-    return df.replace("N/A", np.nan)
+def forward():
+    """
+    Creates the forward sample by parsing the current data HTML files that we downloaded in check_yahoo().
+    :return: pandas DataFrame containing all of the current data for each ticker.
+    """
+    df = parse_forward_files(list_forward_files())
+
+    cache = parse_cache.get_cache()
+    if cache is not None:
+        cache.close()
+    return df
+
+def scan_forward(use_hash=False, manifest=None):
+    """
+    Fingerprint every page in forwardpath
+    :param use_hash: Whether to hash file contents
+    :param manifest: Previous manifest, used to skip rehashing unchanged files
+    :return: dict mapping each html file to a fingerprint, in directory listing order
+    """
+    manifest = manifest or {}
+    return {
+        tickerfile: file_fingerprint(os.path.join(forwardpath, tickerfile), use_hash, manifest.get(tickerfile))
+        for tickerfile in list_forward_files()
+    }
+
+def update_forward(sample_path="forward_sample.csv", manifest_path=None, use_hash=False):
+    """
+    Incrementally update the forward sample: only the pages which are new or have changed since the last run
+    are parsed, and the rows of deleted pages are dropped. Falls back to a full parse if there is no manifest.
+    :param sample_path: Path to the existing forward sample csv
+    :param manifest_path: Path to the manifest (defaults to a json file next to sample_path)
+    :param use_hash: Whether to compare file contents (sha1) rather than only size and mtime
+    :return: (DataFrame of the full forward sample, in the same order as forward(), new manifest)
+    """
+    manifest_path = manifest_path or os.path.splitext(sample_path)[0] + "_manifest.json"
+    manifest = load_manifest(manifest_path)
+    current = scan_forward(use_hash, manifest)
+
+    if not manifest or not os.path.exists(sample_path):
+        logging.info("No manifest found, parsing all pages.")
+        return forward(), current
+
+    changed = [tickerfile for tickerfile, fingerprint in current.items()
+               if fingerprint_changed(manifest.get(tickerfile), fingerprint)]
+    deleted = set(manifest) - set(current)
+    logging.info(f"{len(changed)} new or changed pages, {len(deleted)} deleted.")
+
+    # Samples written before the forward features were renamed to the canonical names have the page labels
+    existing_df = pd.read_csv(sample_path).rename(columns=feature_schema.canonical_name)
+    stale = {file_ticker(tickerfile) for tickerfile in set(changed) | deleted}
+    existing_df = existing_df[~existing_df["Ticker"].isin(stale)]
+    if changed:
+        new_df = parse_forward_files(changed)
+        cache = parse_cache.get_cache()
+        if cache is not None:
+            cache.close()
+        existing_df = pd.concat([existing_df, new_df], ignore_index=True)
+
+    positions = pd.Index(existing_df["Ticker"]).get_indexer([file_ticker(tickerfile) for tickerfile in current])
+    return existing_df.iloc[positions[positions >= 0]].reset_index(drop=True), current
+
+def main(download=True, incremental=INCREMENTAL, use_hash=MANIFEST_HASH):
+    """
+    Download the current pages and build forward_sample.csv from them
+    :param download: Download the pages first, rather than only parsing the pages already in forwardpath
+    :param incremental: Only parse the pages which are new or have changed since the last run
+    :param use_hash: Compare file contents rather than size and modification time
+    :return: None
+    """
+    if download:
+        check_yahoo()
+    if incremental:
+        current_df, manifest = update_forward("forward_sample.csv", use_hash=use_hash)
+    else:
+        current_df = forward()
+        manifest = scan_forward(use_hash)
+    current_df.to_csv("forward_sample.csv", index=False)
+    save_manifest("forward_sample_manifest.json", manifest)
 
 if __name__ == "__main__":
-    check_yahoo()
-    current_df = forward()
-    current_df.to_csv("forward_sample.csv", index=False)
\ No newline at end of file
+    configure_logging()
+    instrumentation.configure()
+    main()
\ No newline at end of file
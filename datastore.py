@@ -0,0 +1,227 @@
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+from utils import status_calc
+import feature_schema
+
+# Directory for the binary copies of the CSV datasets. Set DATA_CACHE to an empty string to disable caching.
+CACHE_DIR = os.getenv("DATA_CACHE", ".cache/")
+CACHE_VERSION = 2
+# Rows per chunk when streaming a CSV. Set CHUNKSIZE to train from CSVs which are too big to load at once.
+CHUNKSIZE = int(os.getenv("CHUNKSIZE", 0)) or 100000
+STREAMING = int(os.getenv("CHUNKSIZE", 0)) > 0
+
+
+def _cache_base(file_path, read_kwargs):
+    """
+    The path prefix of the cache files for a CSV read with particular arguments
+    :param file_path: Path to the CSV file
+    :param read_kwargs: keyword arguments passed to pd.read_csv
+    :return: path prefix within CACHE_DIR
+    """
+    key = repr((os.path.abspath(file_path), sorted(read_kwargs.items())))
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(CACHE_DIR, f"{name}-{digest}")
+
+
+def _source_signature(file_path):
+    """
+    :param file_path: Path to the CSV file
+    :return: dict which changes whenever the CSV is rewritten
+    """
+    stat = os.stat(file_path)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "version": CACHE_VERSION,
+        "pandas": pd.__version__,
+    }
+
+
+def _load_meta(base):
+    try:
+        with open(base + ".json") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cache(base, df, signature):
+    """
+    Write the frame as a pickle and its numeric columns as a float64 .npy matrix, then the metadata.
+    Each file is written under a temporary name and moved into place, and the metadata is written last,
+    so a concurrent reader never sees a partial cache.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Integer columns are included too, since a feature column can be read as integers
+    numeric_columns = [column for column in df.columns if df[column].dtype.kind in "fiub"]
+
+    tmp_suffix = f".{os.getpid()}.tmp"
+    df.to_pickle(base + ".pkl" + tmp_suffix, protocol=-1)
+    os.replace(base + ".pkl" + tmp_suffix, base + ".pkl")
+    with open(base + ".npy" + tmp_suffix, "wb") as file:
+        np.save(file, np.ascontiguousarray(df[numeric_columns].to_numpy(dtype=np.float64)))
+    os.replace(base + ".npy" + tmp_suffix, base + ".npy")
+    with open(base + ".json" + tmp_suffix, "w") as file:
+        json.dump(dict(signature, numeric_columns=numeric_columns), file)
+    os.replace(base + ".json" + tmp_suffix, base + ".json")
+
+
+def _ensure_cache(file_path, read_kwargs):
+    """
+    Make sure that an up to date cache exists for the CSV
+    :return: (cache path prefix, metadata, DataFrame if it had to be read from the CSV else None)
+    """
+    base = _cache_base(file_path, read_kwargs)
+    signature = _source_signature(file_path)
+    meta = _load_meta(base)
+    if meta is not None and all(meta.get(k) == v for k, v in signature.items()):
+        return base, meta, None
+
+    df = pd.read_csv(file_path, **read_kwargs)
+    try:
+        _write_cache(base, df, signature)
+    except OSError as e:
+        logging.warning(f"Could not write the cache for {file_path}: {str(e)}")
+        return base, None, df
+    return base, _load_meta(base), df
+
+
+def read_csv(file_path, **read_kwargs):
+    """
+    Read a CSV file through the binary cache. The first read parses the CSV and writes the cache;
+    later reads load the cached frame, until the CSV's size or modification time changes.
+    :param file_path: Path to the CSV file
+    :param read_kwargs: keyword arguments passed to pd.read_csv
+    :return: DataFrame
+    """
+    if not CACHE_DIR:
+        return pd.read_csv(file_path, **read_kwargs)
+
+    base, meta, df = _ensure_cache(file_path, read_kwargs)
+    if df is not None:
+        return df
+    return pd.read_pickle(base + ".pkl")
+
+
+def read_array(file_path, columns=None, **read_kwargs):
+    """
+    Memory-map the numeric columns of a CSV file (as float64) from the binary cache, without copying.
+    :param file_path: Path to the CSV file
+    :param columns: Names of the columns to return. A contiguous run of columns is returned as a view
+                    of the memory map; other selections are copied.
+    :param read_kwargs: keyword arguments passed to pd.read_csv
+    :return: (2D float64 array with one row per CSV row, list of column names)
+    """
+    if not CACHE_DIR:
+        df = pd.read_csv(file_path, **read_kwargs)
+        columns = columns or [c for c in df.columns if df[c].dtype.kind in "fiub"]
+        return df[columns].to_numpy(dtype=np.float64), list(columns)
+
+    base, meta, df = _ensure_cache(file_path, read_kwargs)
+    if meta is None:
+        columns = columns or [c for c in df.columns if df[c].dtype.kind in "fiub"]
+        return df[columns].to_numpy(dtype=np.float64), list(columns)
+
+    matrix = np.load(base + ".npy", mmap_mode="r")
+    numeric_columns = meta["numeric_columns"]
+    if columns is None:
+        return matrix, numeric_columns
+
+    columns = list(columns)
+    missing = set(columns) - set(numeric_columns)
+    if missing:
+        raise KeyError(f"Columns are not numeric columns of {file_path}: {sorted(missing)}")
+    positions = [numeric_columns.index(column) for column in columns]
+    if positions and positions == list(range(positions[0], positions[0] + len(positions))):
+        return matrix[:, positions[0]:positions[-1] + 1], columns
+    return matrix[:, positions], columns
+
+
+def read_training_arrays(file_path, outperformance):
+    """
+    The features, labels and returns of a keystats-style CSV, taken from the memory-mapped matrix of the cache
+    rather than from a DataFrame. Rows with a missing value in a numeric column are dropped. Unlike load_data,
+    which drops rows with a missing value in any column, the text columns (Ticker) are not checked, since they
+    are not in the matrix and are not used for training. If no row is dropped, the feature matrix is a view of
+    the memory map.
+    :param file_path: Path to the CSV file
+    :param outperformance: Percentage by which a stock has to beat the S&P500 to be labelled 1
+    :return: dict with X (float64 features), y (bool labels) and z (stock and SP500 percentage changes),
+             in CSV row order
+    """
+    matrix, columns = read_array(file_path, index_col="Date")
+    features = feature_schema.feature_columns(columns)
+    positions = [columns.index(column) for column in features]
+    if positions == list(range(positions[0], positions[0] + len(positions))):
+        X = matrix[:, positions[0]:positions[-1] + 1]
+    else:
+        X = matrix[:, positions]
+    z = matrix[:, [columns.index("stock_p_change"), columns.index("SP500_p_change")]]
+
+    complete = ~np.isnan(matrix).any(axis=1)
+    if not complete.all():
+        X, z = X[complete], z[complete]
+    return {"X": X, "y": np.asarray(status_calc(z[:, 0], z[:, 1], outperformance), dtype=bool), "z": z}
+
+
+def count_lines(file_path, block_size=1 << 20):
+    """
+    Count the lines of a file in fixed-size blocks, without holding it in memory
+    :param file_path: Path to the file
+    :return: number of newline characters (plus one if the last line is not terminated)
+    """
+    n_lines = 0
+    last_block = b""
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            n_lines += block.count(b"\n")
+            last_block = block
+    if last_block and not last_block.endswith(b"\n"):
+        n_lines += 1
+    return n_lines
+
+
+def stream_training_arrays(file_path, outperformance, chunksize=CHUNKSIZE, dtype=np.float32, memmap_path=None):
+    """
+    Read a keystats-style CSV in chunks straight into preallocated arrays, so that peak memory is one chunk
+    plus the final arrays. Rows with any missing value are dropped chunk by chunk (as load_data does),
+    and the features (every column which is not an index column, see feature_schema) are copied into X.
+    :param file_path: Path to the CSV file
+    :param outperformance: Percentage by which a stock has to beat the S&P500 to be labelled 1
+    :param chunksize: Number of rows per chunk
+    :param dtype: dtype of the feature matrix
+    :param memmap_path: If given, the feature matrix is a memory-mapped .npy file at this path rather than in RAM
+    :return: dict with X (features), y (bool labels), z (stock and SP500 percentage changes),
+             dates (datetime64[s]) and tickers, one row per complete CSV row
+    """
+    n_rows = max(count_lines(file_path) - 1, 0)
+    header = pd.read_csv(file_path, index_col="Date", nrows=0)
+    features = feature_schema.feature_columns(header.columns)
+    n_features = len(features)
+
+    if memmap_path:
+        X = np.lib.format.open_memmap(memmap_path, mode="w+", dtype=dtype, shape=(n_rows, n_features))
+    else:
+        X = np.empty((n_rows, n_features), dtype=dtype)
+    y = np.empty(n_rows, dtype=bool)
+    z = np.empty((n_rows, 2), dtype=np.float64)
+    dates = np.empty(n_rows, dtype="datetime64[s]")
+    tickers = np.empty(n_rows, dtype=object)
+
+    pos = 0
+    for chunk in pd.read_csv(file_path, index_col="Date", chunksize=chunksize):
+        chunk = chunk.dropna(axis=0, how="any")
+        end = pos + len(chunk)
+        feature_schema.feature_matrix(chunk, features, out=X[pos:end])
+        y[pos:end] = status_calc(chunk["stock_p_change"], chunk["SP500_p_change"], outperformance)
+        z[pos:end] = chunk[["stock_p_change", "SP500_p_change"]].to_numpy(dtype=np.float64)
+        dates[pos:end] = pd.to_datetime(chunk.index).values
+        tickers[pos:end] = chunk["Ticker"].to_numpy()
+        pos = end
+
+    return {"X": X[:pos], "y": y[:pos], "z": z[:pos], "dates": dates[:pos], "tickers": tickers[:pos]}
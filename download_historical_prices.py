@@ -1,8 +1,13 @@
 import os
+import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pandas_datareader import data as pdr
 import pandas as pd
 import fix_yahoo_finance as yf
+import instrumentation
+from config import statspath, configure_logging
 
 # Override Yahoo Finance API
 yf.pdr_override()
@@ -11,8 +16,10 @@ yf.pdr_override()
 START_DATE = os.getenv("START_DATE", "2003-08-01")
 END_DATE = os.getenv("END_DATE", "2015-01-01")
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Prices are downloaded in batches of tickers, several batches at a time, into a per-ticker store
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 50))
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 4))
+PRICE_STORE = os.getenv("PRICE_STORE", "price_store/")
 
 def get_ticker_list(statspath):
     """
@@ -26,36 +33,213 @@ def get_ticker_list(statspath):
         ticker_list.remove(".DS_Store")
     return ticker_list
 
-def download_data(ticker_list, start, end):
+def yahoo_source(tickers, start, end):
     """
-    Downloads stock data for the given tickers between the specified dates.
-    :param ticker_list: List of tickers
+    The default price source: downloads adjusted close prices from Yahoo Finance.
+    :param tickers: List of tickers
     :param start: Start date
     :param end: End date
-    :return: DataFrame of stock data
+    :return: DataFrame of adjusted close prices, with one column per ticker
     """
+    all_data = pdr.get_data_yahoo(tickers, start, end)
+    adj_close = all_data["Adj Close"]
+    if isinstance(adj_close, pd.Series):
+        adj_close = adj_close.to_frame(tickers[0])
+    return adj_close
+
+def _store_paths(ticker, store_path):
+    return os.path.join(store_path, f"{ticker}.csv"), os.path.join(store_path, f"{ticker}.json")
+
+def load_stored_prices(ticker, store_path=PRICE_STORE):
+    """
+    Load the prices and the downloaded date ranges of a ticker from the local store
+    :param ticker: Ticker (upper case)
+    :param store_path: Directory of the per-ticker store
+    :return: (Series of adjusted close prices or None, coverage dict (see merge_coverage) or None)
+    """
+    csv_path, coverage_path = _store_paths(ticker, store_path)
     try:
-        all_data = pdr.get_data_yahoo(ticker_list, start, end)
-        stock_data = all_data["Adj Close"]
+        with open(coverage_path) as file:
+            coverage = json.load(file)
+        prices = pd.read_csv(csv_path, index_col="Date", parse_dates=True)[ticker]
+        return prices, coverage
+    except (OSError, ValueError, KeyError):
+        return None, None
+
+def save_stored_prices(ticker, prices, coverage, store_path=PRICE_STORE):
+    """
+    Write the prices of a ticker to the local store. The coverage file is written last, so an interrupted
+    write is simply downloaded again on the next run.
+    :param ticker: Ticker (upper case)
+    :param prices: Series of adjusted close prices
+    :param coverage: dict with the date ranges that have been downloaded (see merge_coverage)
+    :param store_path: Directory of the per-ticker store
+    """
+    csv_path, coverage_path = _store_paths(ticker, store_path)
+    prices.rename(ticker).rename_axis("Date").to_csv(csv_path + ".tmp", header=True)
+    os.replace(csv_path + ".tmp", csv_path)
+    with open(coverage_path + ".tmp", "w") as file:
+        json.dump(coverage, file)
+    os.replace(coverage_path + ".tmp", coverage_path)
+
+def _covered_ranges(coverage):
+    """
+    :param coverage: coverage dict, or None
+    :return: sorted list of (start, end) Timestamps which have been downloaded
+    """
+    if coverage is None:
+        return []
+    # Stores written before the coverage was a list of ranges have a single "start" and "end"
+    ranges = coverage.get("ranges", [[coverage["start"], coverage["end"]]] if "start" in coverage else [])
+    return sorted((pd.Timestamp(s), pd.Timestamp(e)) for s, e in ranges)
+
+def merge_coverage(coverage, start, end):
+    """
+    Add a downloaded date range to the coverage of a ticker. Ranges which overlap or touch are merged, but
+    a gap between two downloads stays uncovered, so that it is downloaded later.
+    :param coverage: dict with the "ranges" already downloaded, as a list of [start, end] date strings, or None
+    :param start: Start date of the new range
+    :param end: End date of the new range
+    :return: new coverage dict
+    """
+    merged = []
+    for s, e in sorted(_covered_ranges(coverage) + [(pd.Timestamp(start), pd.Timestamp(end))]):
+        if merged and s <= merged[-1][1] + pd.Timedelta(days=1):
+            merged[-1][1] = max(merged[-1][1], e)
+        else:
+            merged.append([s, e])
+    return {"ranges": [[s.strftime("%Y-%m-%d"), e.strftime("%Y-%m-%d")] for s, e in merged]}
+
+def missing_ranges(coverage, start, end):
+    """
+    The date ranges within [start, end] which are not covered by a previous download
+    :param coverage: coverage dict (see merge_coverage), or None
+    :param start: Start date
+    :param end: End date
+    :return: list of (start, end) date strings
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    ranges = []
+    for covered_start, covered_end in _covered_ranges(coverage):
+        if covered_start > start:
+            ranges.append((start, min(end, covered_start - pd.Timedelta(days=1))))
+        start = max(start, covered_end + pd.Timedelta(days=1))
+    ranges.append((start, end))
+    return [(s.strftime("%Y-%m-%d"), e.strftime("%Y-%m-%d")) for s, e in ranges if s <= e]
+
+def plan_batches(ticker_list, start, end, batch_size, store_path=PRICE_STORE):
+    """
+    Work out which tickers need which date ranges, and group them into batches.
+    Tickers are only batched together if they need exactly the same range.
+    :return: list of (tickers, range_start, range_end) tuples
+    """
+    by_range = {}
+    for ticker in ticker_list:
+        _, coverage = load_stored_prices(ticker, store_path)
+        for date_range in missing_ranges(coverage, start, end):
+            by_range.setdefault(date_range, []).append(ticker)
+
+    batches = []
+    for (range_start, range_end), tickers in by_range.items():
+        for i in range(0, len(tickers), batch_size):
+            batches.append((tickers[i:i + batch_size], range_start, range_end))
+    return batches
+
+def _download_batch(batch, source, store_path, lock):
+    """
+    Download one batch and merge each ticker's prices into the local store. Tickers for which no data was
+    returned are not written to the store.
+    :return: list of tickers for which no data was returned
+    """
+    tickers, range_start, range_end = batch
+    with instrumentation.stage("download_batch"):
+        prices = source(tickers, range_start, range_end)
+    instrumentation.count("download_batch", "tickers", len(tickers))
+    instrumentation.count("download_batch", "rows", len(prices))
+    empty = []
+    for ticker in tickers:
+        new_prices = prices[ticker].dropna() if ticker in prices.columns else pd.Series(dtype=float)
+        if new_prices.empty:
+            # Not marked as covered, so the range is requested again on the next run
+            empty.append(ticker)
+            continue
+        with lock, instrumentation.stage("store_write"):
+            old_prices, coverage = load_stored_prices(ticker, store_path)
+            if old_prices is not None and not old_prices.empty:
+                new_prices = pd.concat([old_prices, new_prices])
+                new_prices = new_prices[~new_prices.index.duplicated(keep="last")].sort_index()
+            save_stored_prices(ticker, new_prices, merge_coverage(coverage, range_start, range_end), store_path)
+    return empty
+
+def update_price_store(ticker_list, start=START_DATE, end=END_DATE, batch_size=BATCH_SIZE,
+                       n_workers=DOWNLOAD_WORKERS, source=yahoo_source, store_path=PRICE_STORE):
+    """
+    Download the missing prices for each ticker in concurrent batches, persisting every ticker to the
+    local store as soon as its batch arrives. An interrupted run resumes where it stopped, and later runs
+    only fetch date ranges that have not been downloaded yet.
+    :param ticker_list: List of tickers (upper case)
+    :param start: Start date
+    :param end: End date
+    :param batch_size: Number of tickers per request
+    :param n_workers: Number of batches downloaded concurrently
+    :param source: Function (tickers, start, end) -> DataFrame of adjusted close prices
+    :param store_path: Directory of the per-ticker store
+    :return: list of batches which failed
+    """
+    os.makedirs(store_path, exist_ok=True)
+    batches = plan_batches(ticker_list, start, end, batch_size, store_path)
+    logging.info("Downloading %d batches of prices...", len(batches))
+
+    failed = []
+    lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = {executor.submit(_download_batch, batch, source, store_path, lock): batch for batch in batches}
+        for future in as_completed(futures):
+            try:
+                empty = future.result()
+                if empty:
+                    logging.warning("No data for %s", empty)
+            except Exception as e:
+                logging.error("Error downloading batch %s: %s", futures[future][0], str(e))
+                failed.append(futures[future])
+    return failed
+
+def assemble_prices(ticker_list, start=START_DATE, end=END_DATE, store_path=PRICE_STORE):
+    """
+    Build the wide price matrix from the local store with a single join
+    :param ticker_list: List of tickers (upper case)
+    :param start: Start date
+    :param end: End date
+    :return: DataFrame of stock data, with one column per ticker
+    """
+    series = []
+    with instrumentation.stage("store_read"):
+        for ticker in ticker_list:
+            prices, _ = load_stored_prices(ticker, store_path)
+            if prices is not None and not prices.empty:
+                series.append(prices)
+    if not series:
+        return pd.DataFrame()
+
+    with instrumentation.stage("assemble_prices"):
+        stock_data = pd.concat(series, axis=1).sort_index().loc[start:end]
+        stock_data.index.name = "Date"
         stock_data.dropna(how="all", axis=1, inplace=True)
         stock_data.ffill(inplace=True)
-        return stock_data
-    except Exception as e:
-        logging.error("Error downloading data: %s", str(e))
-        return pd.DataFrame()
+    return stock_data
 
-def build_stock_dataset(start=START_DATE, end=END_DATE):
+def build_stock_dataset(start=START_DATE, end=END_DATE, source=yahoo_source):
     """
     Creates the dataset containing all stock prices.
     :returns: None
     """
     logging.info("Building stock dataset...")
-    statspath = "intraQuarter/_KeyStats/"
-    ticker_list = get_ticker_list(statspath)
-    stock_data = download_data(ticker_list, start, end)
+    ticker_list = [ticker.upper() for ticker in get_ticker_list(statspath)]
+    update_price_store(ticker_list, start, end, source=source)
+    stock_data = assemble_prices(ticker_list, start, end)
     if not stock_data.empty:
         stock_data.to_csv("stock_prices.csv")
-        missing_tickers = [ticker for ticker in ticker_list if ticker.upper() not in stock_data.columns]
+        missing_tickers = [ticker for ticker in ticker_list if ticker not in stock_data.columns]
         logging.info("%d tickers are missing: %s", len(missing_tickers), missing_tickers)
     else:
         logging.warning("No stock data available.")
@@ -72,32 +256,27 @@ def build_sp500_dataset(start=START_DATE, end=END_DATE):
     except Exception as e:
         logging.error("Error downloading S&P500 data: %s", str(e))
 
-def build_dataset_iteratively(idx_start, idx_end, date_start=START_DATE, date_end=END_DATE):
+def build_dataset_iteratively(idx_start, idx_end, date_start=START_DATE, date_end=END_DATE,
+                              source=yahoo_source):
     """
-    Alternative iterative solution to building the stock dataset.
+    Alternative iterative solution to building the stock dataset, downloading one ticker per request.
     :param idx_start: Starting index of the ticker list
     :param idx_end: Ending index of the ticker list
     :param date_start: Start date for data download
     :param date_end: End date for data download
+    :param source: Function (tickers, start, end) -> DataFrame of adjusted close prices
     :returns: None
     """
     logging.info("Building stock dataset iteratively...")
-    statspath = "intraQuarter/_KeyStats/"
-    ticker_list = get_ticker_list(statspath)[idx_start:idx_end]
-    df = pd.DataFrame()
-    for ticker in ticker_list:
-        ticker = ticker.upper()
-        try:
-            stock_ohlc = pdr.get_data_yahoo(ticker, start=date_start, end=date_end)
-            if stock_ohlc.empty:
-                logging.warning("No data for %s", ticker)
-                continue
-            adj_close = stock_ohlc["Adj Close"].rename(ticker)
-            df = pd.concat([df, adj_close], axis=1)
-        except Exception as e:
-            logging.error("Error downloading data for %s: %s", ticker, str(e))
-    df.to_csv("stock_prices.csv")
+    ticker_list = [ticker.upper() for ticker in get_ticker_list(statspath)[idx_start:idx_end]]
+    update_price_store(ticker_list, date_start, date_end, batch_size=1, source=source)
+    assemble_prices(ticker_list, date_start, date_end).to_csv("stock_prices.csv")
 
-if __name__ == "__main__":
+def main():
     build_stock_dataset()
-    build_sp500_dataset()
\ No newline at end of file
+    build_sp500_dataset()
+
+if __name__ == "__main__":
+    configure_logging()
+    instrumentation.configure()
+    main()
\ No newline at end of file
@@ -0,0 +1,155 @@
+import hashlib
+import os
+import re
+from bisect import bisect_right
+import instrumentation
+from utils import data_string_to_float
+
+# The pattern for a value following a feature label. This is the pattern that used to be appended to every
+# label in a separate lazy DOTALL search, except that it matches bytes and allows thousands separators
+# inside numbers (they used to be removed from the whole document before the search). The lookahead skips
+# positions where no value can start, and the optional decimal part keeps the two runs of digits from
+# backtracking against each other.
+VALUE_REGEX = rb"(?=[\-\dN>])(\-?\d[\d,]*(?:\.+[\d,]*)?K?M?B?|N/A[\\n|\s,]*|>0|NaN),*%?,*(</td>|</span>)"
+# The old "Average Volume (3 month)" fallback search did not accept NaN as a value
+FALLBACK_VALUE_REGEX = rb"(?=[\-\dN>])(\-?\d[\d,]*(?:\.+[\d,]*)?K?M?B?|N/A[\\n|\s,]*|>0),*%?,*(</td>|</span>)"
+# Bump when the extraction logic changes, so that cached parse results are not reused
+EXTRACTOR_VERSION = 2
+
+# Buffer which read_document reuses for every file, grown as needed
+_read_buffer = bytearray(1 << 18)
+
+
+def read_document(file_path):
+    """
+    Read a file into a buffer which is reused for every file read by this process, so that reading many
+    documents does not allocate (and page in) a new block of memory for each one.
+    :param file_path: Path to the file
+    :return: memoryview of the contents, which is only valid until the next call
+    """
+    global _read_buffer
+    with open(file_path, "rb", buffering=0) as file:
+        size = os.fstat(file.fileno()).st_size
+        if size >= len(_read_buffer):
+            # Replace rather than resize the buffer, since a previous view of it may still be alive
+            _read_buffer = bytearray(max(size + 1, 2 * len(_read_buffer)))
+        view = memoryview(_read_buffer)
+        n_read = 0
+        # Read one byte more than the expected size to notice a file which has grown since the stat
+        while n_read <= size:
+            n = file.readinto(view[n_read:size + 1])
+            if not n:
+                break
+            n_read += n
+        if n_read > size:
+            return memoryview(bytes(view[:n_read]) + file.read())
+        return view[:n_read]
+
+
+class FeatureExtractor:
+    """
+    Precompiled extractor which finds the values of many features with a single scan of the document.
+
+    All labels are combined into one alternation (longest first), so that one pass over the html finds
+    the first occurrence of every label. Labels that are prefixes of a longer label (e.g 'Total Cash' and
+    'Total Cash Per Share') are recorded at the same position. The value for a label is then the first
+    value match after the label, which is exactly what the old `>label.*?value` search returned.
+    """
+
+    def __init__(self, features, fallbacks=None):
+        """
+        :param features: list of feature labels, in output order
+        :param fallbacks: dict mapping a feature to an alternative label that is tried if the feature
+                          label does not yield a value
+        """
+        self.features = list(features)
+        self.fallbacks = dict(fallbacks or {})
+
+        labels = sorted(set(self.features) | set(self.fallbacks.values()), key=len, reverse=True)
+        self._label_regex = re.compile(b">(" + b"|".join(re.escape(label.encode()) for label in labels) + b")")
+        # Every label that is a prefix of a longer label also occurs wherever the longer label matches
+        self._prefixes = {
+            label.encode(): [(other, len(other.encode())) for other in labels if label.startswith(other)]
+            for label in labels
+        }
+        self._value_regex = re.compile(VALUE_REGEX)
+        self._fallback_value_regex = re.compile(FALLBACK_VALUE_REGEX)
+
+        # Identifies everything that determines the output for a document
+        spec = (EXTRACTOR_VERSION, self.features, sorted(self.fallbacks.items()), VALUE_REGEX, FALLBACK_VALUE_REGEX)
+        self.version = hashlib.sha1(repr(spec).encode()).hexdigest()[:16]
+
+    def _label_positions(self, source):
+        """
+        Single pass over the document to find where each label first ends
+        :param source: html bytes
+        :return: dict mapping label to the index just after its first occurrence
+        """
+        positions = {}
+        for match in self._label_regex.finditer(source):
+            start = match.start(1)
+            for label, length in self._prefixes[match.group(1)]:
+                if label not in positions:
+                    positions[label] = start + length
+        return positions
+
+    @staticmethod
+    def _first_value(regex, matches, starts, source, pos):
+        """
+        Find the first value match starting at or after pos.
+        :param regex: compiled value regex
+        :param matches: all non-overlapping matches of regex in source
+        :param starts: start indices of matches
+        :param source: html bytes
+        :param pos: position to search from
+        :return: the matched value bytes, or None
+        """
+        i = bisect_right(starts, pos) - 1
+        # pos may fall inside a match, in which case a shorter (overlapping) match could start at pos
+        if i >= 0 and matches[i].end() > pos and matches[i].start() < pos:
+            match = regex.search(source, pos)
+            return match.group(1) if match else None
+        i = i if i >= 0 and matches[i].start() == pos else i + 1
+        return matches[i].group(1) if i < len(matches) else None
+
+    def extract_tokens(self, source):
+        """
+        Find the raw value string for every feature
+        :param source: html bytes (any bytes-like object, e.g the view returned by read_document), or a string
+        :return: list of value strings without thousands separators (None where no value was found)
+        """
+        if isinstance(source, str):
+            source = source.encode()
+        positions = self._label_positions(source)
+        value_matches = list(self._value_regex.finditer(source))
+        value_starts = [m.start() for m in value_matches]
+        fallback_matches = None
+
+        tokens = []
+        for variable in self.features:
+            token = None
+            if variable in positions:
+                token = self._first_value(
+                    self._value_regex, value_matches, value_starts, source, positions[variable]
+                )
+            if token is None and self.fallbacks.get(variable) in positions:
+                if fallback_matches is None:
+                    fallback_matches = list(self._fallback_value_regex.finditer(source))
+                    fallback_starts = [m.start() for m in fallback_matches]
+                token = self._first_value(
+                    self._fallback_value_regex, fallback_matches, fallback_starts, source,
+                    positions[self.fallbacks[variable]]
+                )
+            tokens.append(None if token is None else token.replace(b",", b"").decode("latin-1"))
+        return tokens
+
+    def extract(self, source):
+        """
+        Extract the value row for a document
+        :param source: html bytes, or a string
+        :return: list of feature values, with "N/A" where the value is missing
+        """
+        with instrumentation.stage("regex"):
+            tokens = self.extract_tokens(source)
+        with instrumentation.stage("data_string_to_float"):
+            return ["N/A" if token is None else data_string_to_float(token) for token in tokens]
@@ -0,0 +1,208 @@
+"""
+Schema of the fundamental features: one entry per feature with its canonical name, its fixed column, its unit
+and dtype, and the label which precedes its value in each kind of html page.
+
+The historical snapshots (parsing_keystats.py) and the current Yahoo Finance pages (current_data.py) label some
+features differently, e.g "Qtrly Revenue Growth" and "Quarterly Revenue Growth". Both parsers write the
+features under their canonical name (the historical label, which is the keystats.csv column), in schema order,
+so keystats.csv and forward_sample.csv have the same layout: the index columns, then feature i in column
+len(INDEX_COLUMNS) + i. Forward samples written before the columns were aligned are still read through the
+aliases.
+
+This module does not import pandas or numpy until a feature matrix is built, so config.py can use it.
+"""
+from feature_extractor import FeatureExtractor
+
+# The columns of keystats.csv and forward_sample.csv which come before the features (Date is the index)
+INDEX_COLUMNS = ["Unix", "Ticker", "Price", "stock_p_change", "SP500", "SP500_p_change"]
+# The kinds of html pages: the historical snapshots, and the current pages
+SOURCES = ("keystats", "forward")
+
+
+class Feature:
+    """
+    One fundamental feature, and how it is labelled in each source
+    """
+
+    def __init__(self, name, index, unit, labels=None, fallbacks=None, dtype="float64"):
+        """
+        :param name: canonical name, which is the column name in keystats.csv and forward_sample.csv
+        :param index: position of the feature in the feature matrix
+        :param unit: unit of the parsed values, e.g "USD" or "%"
+        :param labels: dict mapping a source to the label its pages use, where that is not the name
+        :param fallbacks: dict mapping a source to a label which is tried if the label does not yield a value
+        :param dtype: dtype of the parsed values
+        """
+        self.name = name
+        self.index = index
+        self.column = len(INDEX_COLUMNS) + index
+        self.unit = unit
+        self.labels = {source: (labels or {}).get(source, name) for source in SOURCES}
+        self.fallbacks = dict(fallbacks or {})
+        self.dtype = dtype
+        # Every name the column may have, canonical first
+        self.aliases = tuple(dict.fromkeys([name] + list(self.labels.values())))
+
+    def __repr__(self):
+        return f"Feature({self.name!r}, {self.index}, {self.unit!r})"
+
+
+# (canonical name, unit, labels in the other sources, fallback labels), in column order
+_FEATURE_TABLE = [
+    ("Market Cap", "USD", None, None),
+    ("Enterprise Value", "USD", None, None),
+    ("Trailing P/E", "ratio", None, None),
+    ("Forward P/E", "ratio", None, None),
+    ("PEG Ratio", "ratio", None, None),
+    ("Price/Sales", "ratio", None, None),
+    ("Price/Book", "ratio", None, None),
+    ("Enterprise Value/Revenue", "ratio", None, None),
+    ("Enterprise Value/EBITDA", "ratio", None, None),
+    ("Profit Margin", "%", None, None),
+    ("Operating Margin", "%", None, None),
+    ("Return on Assets", "%", None, None),
+    ("Return on Equity", "%", None, None),
+    ("Revenue", "USD", None, None),
+    ("Revenue Per Share", "USD/share", None, None),
+    ("Qtrly Revenue Growth", "%", {"forward": "Quarterly Revenue Growth"}, None),
+    ("Gross Profit", "USD", None, None),
+    ("EBITDA", "USD", None, None),
+    ("Net Income Avl to Common", "USD", {"forward": "Net Income Avi to Common"}, None),
+    ("Diluted EPS", "USD/share", None, None),
+    ("Qtrly Earnings Growth", "%", {"forward": "Quarterly Earnings Growth"}, None),
+    ("Total Cash", "USD", None, None),
+    ("Total Cash Per Share", "USD/share", None, None),
+    ("Total Debt", "USD", None, None),
+    ("Total Debt/Equity", "ratio", None, None),
+    ("Current Ratio", "ratio", None, None),
+    ("Book Value Per Share", "USD/share", None, None),
+    ("Operating Cash Flow", "USD", None, None),
+    ("Levered Free Cash Flow", "USD", None, None),
+    ("Beta", "ratio", None, None),
+    ("50-Day Moving Average", "USD/share", None, None),
+    ("200-Day Moving Average", "USD/share", None, None),
+    # Older snapshots label the average volume differently
+    ("Avg Vol (3 month)", "shares", None, {"keystats": "Average Volume (3 month)"}),
+    ("Shares Outstanding", "shares", None, None),
+    ("Float", "shares", None, None),
+    ("% Held by Insiders", "%", None, None),
+    ("% Held by Institutions", "%", None, None),
+    ("Shares Short (as of", "shares", {"forward": "Shares Short"}, None),
+    ("Short Ratio", "days", None, None),
+    ("Short % of Float", "%", None, None),
+    ("Shares Short (prior month", "shares", {"forward": "Shares Short (prior month)"}, None),
+]
+
+FEATURES = [Feature(name, i, unit, source_labels, source_fallbacks)
+            for i, (name, unit, source_labels, source_fallbacks) in enumerate(_FEATURE_TABLE)]
+_BY_ALIAS = {alias: feature for feature in FEATURES for alias in feature.aliases}
+# Extractors are built (and their patterns compiled) once per process and source
+_extractors = {}
+
+
+def names():
+    """
+    :return: list of the canonical feature names, in column order
+    """
+    return [feature.name for feature in FEATURES]
+
+
+def labels(source):
+    """
+    :param source: "keystats" or "forward"
+    :return: list of the labels of the features in the pages of a source, in column order
+    """
+    return [feature.labels[source] for feature in FEATURES]
+
+
+def fallbacks(source):
+    """
+    :param source: "keystats" or "forward"
+    :return: dict mapping a label to the label which is tried if it does not yield a value
+    """
+    return {feature.labels[source]: feature.fallbacks[source] for feature in FEATURES if source in feature.fallbacks}
+
+
+def get(name):
+    """
+    :param name: canonical name or alias of a feature
+    :return: Feature
+    """
+    return _BY_ALIAS[name]
+
+
+def canonical_name(column):
+    """
+    :param column: column name
+    :return: the canonical name if the column is a feature alias, otherwise the column unchanged
+    """
+    feature = _BY_ALIAS.get(column)
+    return column if feature is None else feature.name
+
+
+def get_extractor(source):
+    """
+    The precompiled extractor for the pages of a source, whose values come out in column order
+    :param source: "keystats" or "forward"
+    :return: FeatureExtractor
+    """
+    if source not in _extractors:
+        _extractors[source] = FeatureExtractor(labels(source), fallbacks=fallbacks(source))
+    return _extractors[source]
+
+
+def feature_columns(columns):
+    """
+    :param columns: column names of a keystats-style frame, without the Date index
+    :return: list of the feature columns, i.e every column which is not an index column
+    """
+    return [column for column in columns if column not in INDEX_COLUMNS]
+
+
+def feature_positions(columns, feature_names):
+    """
+    Find the columns of some features by name or alias. A schema feature is first looked for at its fixed
+    column, so for frames with the schema layout this takes one comparison per feature.
+    :param columns: column names of a frame, without the Date index
+    :param feature_names: names of the features (canonical names or aliases), e.g TrainedModel.features
+    :return: list of column positions, aligned with feature_names
+    """
+    columns = list(columns)
+    lookup = None
+    positions = []
+    for name in feature_names:
+        feature = _BY_ALIAS.get(name)
+        if feature is not None and feature.column < len(columns) and columns[feature.column] in feature.aliases:
+            positions.append(feature.column)
+            continue
+        if lookup is None:
+            lookup = {}
+            for i, column in enumerate(columns):
+                lookup.setdefault(column, i)
+        found = [lookup[alias] for alias in (feature.aliases if feature else (name,)) if alias in lookup]
+        if not found:
+            raise ValueError(f"Missing feature column {name!r}")
+        positions.append(found[0])
+    return positions
+
+
+def feature_matrix(df, feature_names, dtype="float32", out=None):
+    """
+    Copy the feature columns of a DataFrame into a matrix, one column at a time, which avoids building an
+    intermediate block of the whole frame. Training and scoring both build their matrices this way, so the
+    columns are in the same order whatever the names of the columns of the frame.
+    :param df: DataFrame with the features as columns
+    :param feature_names: names of the features (canonical names or aliases), in matrix column order
+    :param dtype: dtype of the matrix
+    :param out: optional preallocated array of shape (len(df), len(feature_names)) to fill, e.g a slice of a
+                memory-mapped array
+    :return: array of shape (len(df), len(feature_names))
+    """
+    import numpy as np
+
+    positions = feature_positions(df.columns, feature_names)
+    if out is None:
+        out = np.empty((len(df), len(positions)), dtype=dtype)
+    for i, position in enumerate(positions):
+        out[:, i] = df.iloc[:, position].to_numpy()
+    return out
@@ -0,0 +1,203 @@
+import logging
+import numpy as np
+import pandas as pd
+import datastore
+import feature_schema
+from price_matrix import PriceMatrix, to_days
+from utils import status_calc
+
+
+class FeatureStore:
+    """
+    Point-in-time store of fundamentals and prices, indexed by (ticker, date).
+
+    Fundamentals are sorted by (ticker, date) so that each ticker's snapshots are a contiguous block, and
+    "as-of" lookups are binary searches within that block: a query at date t only ever sees snapshots taken
+    on or before t. Prices are held in a PriceMatrix, which resolves them as-of the previous trading day.
+
+    parse_keystats labels the parsed snapshots through a store, and the walk-forward backtest builds its
+    arrays from a store of keystats.csv, whose one-year returns are kept alongside the fundamentals.
+    """
+
+    def __init__(self, tickers, days, features, feature_names, prices=None, returns=None):
+        """
+        :param tickers: ticker of each fundamentals row (lower case, as in keystats.csv)
+        :param days: int64 day number of each fundamentals row
+        :param features: 2D float array of fundamentals, aligned with tickers and days
+        :param feature_names: names of the feature columns
+        :param prices: PriceMatrix of the stock and SP500 prices, or None if only the fundamentals are queried
+        :param returns: optional 2D float array of the stock and SP500 percentage changes over the year after
+                        each row, as in keystats.csv, aligned with tickers and days
+        """
+        order = np.lexsort((days, tickers))
+        # Position of each row in the order the rows were given
+        self.rows = order
+        self.tickers = np.asarray(tickers, dtype=object)[order]
+        self.days = np.asarray(days, dtype=np.int64)[order]
+        self.features = np.ascontiguousarray(np.asarray(features, dtype=np.float64)[order])
+        self.feature_names = list(feature_names)
+        self.returns = None if returns is None else np.asarray(returns, dtype=np.float64)[order]
+
+        # Contiguous block of rows for each ticker
+        self._blocks = {}
+        boundaries = np.flatnonzero(self.tickers[1:] != self.tickers[:-1]) + 1
+        for start, end in zip(np.r_[0, boundaries], np.r_[boundaries, len(self.tickers)]):
+            if end > start:
+                self._blocks[self.tickers[start]] = (int(start), int(end))
+
+        self.prices = prices
+
+    @classmethod
+    def from_keystats(cls, keystats_df, prices=None):
+        """
+        Build a store from a keystats DataFrame (indexed by Date). The returns are taken from its
+        stock_p_change and SP500_p_change columns if it has them.
+        :param keystats_df: DataFrame of fundamentals, as in keystats.csv
+        :param prices: PriceMatrix of the stock and SP500 prices, or None
+        :return: FeatureStore
+        """
+        feature_names = feature_schema.feature_columns(keystats_df.columns)
+        returns = None
+        if "stock_p_change" in keystats_df.columns and "SP500_p_change" in keystats_df.columns:
+            returns = keystats_df[["stock_p_change", "SP500_p_change"]].to_numpy(dtype=np.float64)
+        return cls(
+            tickers=keystats_df["Ticker"].to_numpy(),
+            days=to_days(keystats_df.index),
+            features=feature_schema.feature_matrix(keystats_df, feature_names, np.float64),
+            feature_names=feature_names,
+            prices=prices,
+            returns=returns,
+        )
+
+    @classmethod
+    def from_frames(cls, keystats_df, stock_df, sp500_df):
+        """
+        Build a store from the keystats DataFrame (indexed by Date) and the raw (trading day) price frames
+        :param keystats_df: DataFrame of fundamentals, as in keystats.csv
+        :param stock_df: DataFrame of stock prices, indexed by trading day
+        :param sp500_df: DataFrame of SP500 prices, indexed by trading day
+        :return: FeatureStore
+        """
+        return cls.from_keystats(keystats_df, PriceMatrix.from_frames(stock_df, sp500_df))
+
+    @classmethod
+    def load(cls, keystats_path="keystats.csv", stock_path="stock_prices.csv", sp500_path="sp500_index.csv"):
+        """
+        Build a store from the CSV datasets (read through the binary cache)
+        :return: FeatureStore
+        """
+        keystats_df = datastore.read_csv(keystats_path, index_col="Date")
+        stock_df = datastore.read_csv(stock_path, index_col="Date", parse_dates=True)
+        sp500_df = datastore.read_csv(sp500_path, index_col="Date", parse_dates=True)
+        return cls.from_frames(keystats_df, stock_df, sp500_df)
+
+    def asof(self, ticker, date):
+        """
+        The latest fundamentals of a ticker known on a date
+        :param ticker: ticker (lower case, as in keystats.csv)
+        :param date: query date
+        :return: (snapshot date, Series of features), or None if there is no snapshot on or before the date
+        """
+        if ticker not in self._blocks:
+            return None
+        start, end = self._blocks[ticker]
+        i = start + np.searchsorted(self.days[start:end], to_days([date])[0], side="right") - 1
+        if i < start:
+            return None
+        return np.datetime64(int(self.days[i]), "D"), pd.Series(self.features[i], index=self.feature_names)
+
+    def cross_section(self, date, tickers=None):
+        """
+        The latest fundamentals of every ticker known on a date, e.g to build a historical forward sample
+        :param date: query date
+        :param tickers: tickers to include (defaults to all)
+        :return: DataFrame indexed by ticker, with the snapshot date and the features
+        """
+        day = to_days([date])[0]
+        rows, names, snapshot_days = [], [], []
+        for ticker in tickers if tickers is not None else self._blocks:
+            if ticker not in self._blocks:
+                continue
+            start, end = self._blocks[ticker]
+            i = start + np.searchsorted(self.days[start:end], day, side="right") - 1
+            if i >= start:
+                rows.append(i)
+                names.append(ticker)
+                snapshot_days.append(self.days[i])
+        df = pd.DataFrame(self.features[rows], index=pd.Index(names, name="Ticker"), columns=self.feature_names)
+        df.insert(0, "Date", np.array(snapshot_days, dtype="datetime64[D]"))
+        return df
+
+    def price_changes(self, tickers, dates, horizon_days=365):
+        """
+        Prices of each (ticker, date) pair and of the SP500 at the date and horizon_days later, in bulk
+        :param tickers: array-like of tickers (any case)
+        :param dates: array-like of dates, aligned with tickers
+        :param horizon_days: number of calendar days to look ahead
+        :return: (dict of label arrays as in parsing_keystats.compute_labels, boolean keep array,
+                  dict of drop counts by reason)
+        """
+        return self.prices.price_changes(tickers, dates, horizon_days)
+
+    def label_rows(self, horizon_days=365):
+        """
+        Prices of every stored snapshot and of the SP500 on its date and horizon_days later, in bulk
+        :param horizon_days: number of calendar days to look ahead
+        :return: (dict of label arrays, boolean keep array, dict of drop counts by reason), with the arrays in
+                 the order the rows were given to the store
+        """
+        labels, keep, drop_counts = self.price_changes(self.tickers, self.days.astype("datetime64[D]"), horizon_days)
+        unsort = np.empty_like(self.rows)
+        unsort[self.rows] = np.arange(len(self.rows))
+        return {name: values[unsort] for name, values in labels.items()}, keep[unsort], drop_counts
+
+    def query(self, ticker, date, horizon_days=365):
+        """
+        Everything known about a ticker on a date, plus the prices horizon_days later
+        :param ticker: ticker (lower case, as in keystats.csv)
+        :param date: query date
+        :param horizon_days: number of calendar days to look ahead for the future prices
+        :return: dict with the snapshot date, features, price, future price, SP500 price and future SP500 price
+        """
+        snapshot = self.asof(ticker, date)
+        day = to_days([date])[0]
+        current_pos, later_pos = self.prices.positions([day, day + horizon_days])
+        row = self.prices.ticker_rows([ticker])[0]
+        prices, index_prices = self.prices.prices, self.prices.index_prices
+        return {
+            "snapshot_date": snapshot[0] if snapshot else None,
+            "features": snapshot[1] if snapshot else None,
+            "price": float(prices[row, current_pos]) if current_pos >= 0 and row >= 0 else np.nan,
+            "future_price": float(prices[row, later_pos]) if later_pos >= 0 and row >= 0 else np.nan,
+            "sp500": float(index_prices[current_pos]) if current_pos >= 0 else np.nan,
+            "future_sp500": float(index_prices[later_pos]) if later_pos >= 0 else np.nan,
+        }
+
+    def training_arrays(self, outperformance, horizon_days=365):
+        """
+        Features, labels and returns for every snapshot with complete data, sorted by date (and in the order
+        the rows were given within a day) so that they can be used by the walk-forward backtest. The returns
+        given to the store are used if there are any, otherwise the snapshots are labelled from its prices.
+        :param outperformance: Percentage by which a stock has to beat the S&P500 to be labelled 1
+        :param horizon_days: number of calendar days over which returns are measured, if they are computed
+        :return: dict with dates, X, y, z and tickers
+        """
+        if self.returns is not None:
+            z, keep = self.returns, np.ones(len(self.days), dtype=bool)
+        else:
+            labels, keep, drop_counts = self.price_changes(self.tickers, self.days.astype("datetime64[D]"),
+                                                           horizon_days)
+            z = np.column_stack([labels["stock_p_change"], labels["SP500_p_change"]])
+            if not keep.all():
+                logging.info(f"{int((~keep).sum())} snapshots without price data: {drop_counts}")
+        keep = keep & ~np.isnan(self.features).any(axis=1) & ~np.isnan(z).any(axis=1)
+
+        order = np.lexsort((self.rows[keep], self.days[keep]))
+        z = z[keep][order]
+        return {
+            "dates": self.days[keep][order].astype("datetime64[D]"),
+            "X": self.features[keep][order],
+            "y": np.asarray(status_calc(z[:, 0], z[:, 1], outperformance), dtype=bool),
+            "z": z,
+            "tickers": self.tickers[keep][order],
+        }
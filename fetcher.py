@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+
+# Responses which are worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter: on average at most `rate` acquisitions per second,
+    with bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: tokens added per second (a rate of 0 or less disables limiting)
+        :param capacity: maximum number of tokens held, which defaults to one second's worth
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, sleeping until one is available
+        """
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Fetcher:
+    """
+    Concurrent page downloader over a pooled requests session, with a concurrency limit, a token-bucket
+    rate limit, retries with exponential backoff and jitter, and conditional requests (ETag/Last-Modified)
+    so that pages which have not changed since the last download are skipped.
+    """
+
+    def __init__(self, concurrency=8, rate=5.0, max_retries=3, backoff=1.0, timeout=10, validators_path=None):
+        """
+        :param concurrency: maximum number of requests in flight
+        :param rate: maximum number of requests per second (0 for no limit)
+        :param max_retries: number of retries after a failed request
+        :param backoff: base delay in seconds, doubled after every failed attempt
+        :param timeout: request timeout in seconds
+        :param validators_path: json file used to remember ETag/Last-Modified headers between runs
+        """
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = TokenBucket(rate)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.validators_path = validators_path
+        self.validators = self._load_validators()
+        self._lock = threading.Lock()
+
+    def _load_validators(self):
+        if not self.validators_path:
+            return {}
+        try:
+            with open(self.validators_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def save_validators(self):
+        """
+        Persist the ETag/Last-Modified headers seen so far
+        """
+        if not self.validators_path:
+            return
+        tmp_path = self.validators_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.validators, file)
+        os.replace(tmp_path, self.validators_path)
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter avoids retrying every failed request at the same moment
+        time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def fetch(self, url, save_path):
+        """
+        Download a url to a file, skipping the download if the server reports that the page is unchanged.
+        :param url: url to download
+        :param save_path: file to write the page to
+        :return: "downloaded", "unchanged" or "failed"
+        """
+        headers = {}
+        validators = self.validators.get(url, {}) if os.path.exists(save_path) else {}
+        if "etag" in validators:
+            headers["If-None-Match"] = validators["etag"]
+        if "last_modified" in validators:
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                resp = self.session.get(url, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                logging.warning(f"Error downloading {url} (attempt {attempt + 1}): {str(e)}")
+            else:
+                if resp.status_code == 304:
+                    return "unchanged"
+                if resp.status_code not in RETRY_STATUSES:
+                    break
+                logging.warning(f"Status {resp.status_code} from {url} (attempt {attempt + 1})")
+            if attempt < self.max_retries:
+                self._sleep_before_retry(attempt)
+        else:
+            return "failed"
+
+        with open(save_path, "w") as file:
+            file.write(resp.text)
+
+        new_validators = {}
+        if resp.headers.get("ETag"):
+            new_validators["etag"] = resp.headers["ETag"]
+        if resp.headers.get("Last-Modified"):
+            new_validators["last_modified"] = resp.headers["Last-Modified"]
+        with self._lock:
+            if new_validators:
+                self.validators[url] = new_validators
+            else:
+                self.validators.pop(url, None)
+        return "downloaded"
+
+    def fetch_all(self, jobs):
+        """
+        Download many pages concurrently
+        :param jobs: list of (key, url, save_path) tuples
+        :return: generator of (key, result) pairs, in completion order
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(self.fetch, url, save_path): key for key, url, save_path in jobs}
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    yield key, future.result()
+                except OSError as e:
+                    logging.error(f"Error saving data for {key}: {str(e)}")
+                    yield key, "failed"
@@ -0,0 +1,304 @@
+"""
+Per-stage timers and counters for the pipeline scripts.
+
+Instrumentation is off by default. Enable it with INSTRUMENT=1 or by passing --instrument to any of the
+scripts, e.g
+
+    python parsing_keystats.py --instrument --profile-stage regex
+
+Every stage records its wall time and number of calls, plus counters such as bytes read or rows dropped
+by reason. The summary is logged and written as JSON to INSTRUMENT_OUTPUT when the script exits.
+PROFILE_STAGE (or --profile-stage) also runs cProfile or tracemalloc (PROFILE_MODE) whenever that stage runs.
+Stage times include any stages nested inside them.
+
+When instrumentation is disabled, stage() returns a shared no-op context manager and count() returns
+immediately, so the hooks can stay in the hot paths.
+"""
+import argparse
+import atexit
+import cProfile
+import contextlib
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+ENABLED = os.getenv("INSTRUMENT", "0") == "1"
+OUTPUT = os.getenv("INSTRUMENT_OUTPUT", "instrumentation.json")
+PROFILE_STAGE = os.getenv("PROFILE_STAGE", "")
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile")
+
+_NULL_STAGE = contextlib.nullcontext()
+_stats = {}
+_profile = {}
+_atexit_registered = False
+
+
+def _stage_stats(name):
+    if name not in _stats:
+        _stats[name] = {"seconds": 0.0, "calls": 0, "counters": {}}
+    return _stats[name]
+
+
+class _Stage:
+    """
+    Times one run of a stage, and profiles it if it is the PROFILE_STAGE
+    """
+    __slots__ = ("name", "start", "profiled")
+
+    def __init__(self, name):
+        self.name = name
+        self.profiled = name == PROFILE_STAGE
+
+    def __enter__(self):
+        if self.profiled:
+            _start_profile()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        if self.profiled:
+            _stop_profile(self.name)
+        stats = _stage_stats(self.name)
+        stats["seconds"] += elapsed
+        stats["calls"] += 1
+        return False
+
+
+def stage(name):
+    """
+    Context manager which records the wall time of a stage
+    :param name: Name of the stage
+    :return: context manager
+    """
+    if not ENABLED:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def count(name, counter, n=1):
+    """
+    Add to a counter of a stage
+    :param name: Name of the stage
+    :param counter: Name of the counter, e.g "bytes_read"
+    :param n: Amount to add
+    """
+    if not ENABLED:
+        return
+    counters = _stage_stats(name)["counters"]
+    counters[counter] = counters.get(counter, 0) + n
+
+
+def record_drops(name, drop_counts):
+    """
+    Count the rows dropped by a stage for each reason
+    :param name: Name of the stage
+    :param drop_counts: dict mapping a reason to a number of rows
+    """
+    if not ENABLED:
+        return
+    for reason, n in drop_counts.items():
+        count(name, f"dropped_{reason}", int(n))
+
+
+def _start_profile():
+    if PROFILE_MODE == "tracemalloc":
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+    else:
+        if "profiler" not in _profile:
+            _profile["profiler"] = cProfile.Profile()
+        _profile["profiler"].enable()
+
+
+def _stop_profile(name):
+    if PROFILE_MODE == "tracemalloc":
+        _, peak = tracemalloc.get_traced_memory()
+        counters = _stage_stats(name)["counters"]
+        counters["peak_bytes"] = max(counters.get("peak_bytes", 0), peak)
+        top = tracemalloc.take_snapshot().statistics("lineno")[:10]
+        _profile["top_allocations"] = [str(line) for line in top]
+        tracemalloc.stop()
+    else:
+        _profile["profiler"].disable()
+
+
+def _profile_stats():
+    """
+    :return: pstats.Stats of this process and of the worker processes, or None
+    """
+    stats = None
+    if "profiler" in _profile:
+        stats = pstats.Stats(_profile["profiler"])
+    for worker_stats in _profile.get("worker_stats", []):
+        other = pstats.Stats()
+        other.stats = worker_stats
+        other.get_top_level_stats()
+        if stats is None:
+            stats = other
+        else:
+            stats.add(other)
+    return stats
+
+
+def summary():
+    """
+    :return: dict of the stats of every stage, plus the profile of PROFILE_STAGE if there is one
+    """
+    result = {"script": os.path.basename(sys.argv[0]), "stages": _stats}
+    if PROFILE_STAGE and _profile:
+        profile = {"stage": PROFILE_STAGE, "mode": PROFILE_MODE}
+        stats = _profile_stats()
+        if stats is not None:
+            profile["path"] = os.path.splitext(OUTPUT)[0] + ".prof"
+            stats.dump_stats(profile["path"])
+            text = io.StringIO()
+            stats.stream = text
+            stats.sort_stats("cumulative").print_stats(25)
+            profile["top_functions"] = text.getvalue()
+        if "top_allocations" in _profile:
+            profile["top_allocations"] = _profile["top_allocations"]
+        result["profile"] = profile
+    return result
+
+
+def write_summary(path=None):
+    """
+    Log the per-stage summary and write it as JSON
+    :param path: Output path (defaults to INSTRUMENT_OUTPUT)
+    """
+    if not _stats:
+        return
+    path = path or OUTPUT
+    result = summary()
+    with open(path, "w") as file:
+        json.dump(result, file, indent=2)
+
+    lines = [f"{'stage':<24} {'seconds':>10} {'calls':>10}  counters"]
+    for name, stats in sorted(_stats.items(), key=lambda item: -item[1]["seconds"]):
+        counters = " ".join(f"{k}={v}" for k, v in stats["counters"].items())
+        lines.append(f"{name:<24} {stats['seconds']:10.3f} {stats['calls']:10d}  {counters}")
+    logging.info("Instrumentation summary (written to %s)\n%s", path, "\n".join(lines))
+
+
+def enable(output=None, profile_stage=None, profile_mode=None):
+    """
+    Turn instrumentation on, and write the summary when the process exits
+    :param output: Path of the JSON summary
+    :param profile_stage: Name of a stage to profile
+    :param profile_mode: "cprofile" or "tracemalloc"
+    """
+    global ENABLED, OUTPUT, PROFILE_STAGE, PROFILE_MODE, _atexit_registered
+    ENABLED = True
+    OUTPUT = output or OUTPUT
+    PROFILE_STAGE = profile_stage if profile_stage is not None else PROFILE_STAGE
+    PROFILE_MODE = profile_mode or PROFILE_MODE
+    if not _atexit_registered:
+        atexit.register(write_summary)
+        _atexit_registered = True
+
+
+def configure(argv=None):
+    """
+    Enable instrumentation from the environment or the command line flags
+    (--instrument, --instrument-output, --profile-stage, --profile-mode)
+    :param argv: Command line arguments (defaults to sys.argv[1:])
+    :return: the arguments which are not instrumentation flags
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--instrument", action="store_true")
+    parser.add_argument("--instrument-output")
+    parser.add_argument("--profile-stage")
+    parser.add_argument("--profile-mode", choices=["cprofile", "tracemalloc"])
+    args, remaining = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+    if ENABLED or PROFILE_STAGE or args.instrument or args.profile_stage:
+        enable(args.instrument_output, args.profile_stage, args.profile_mode)
+    return remaining
+
+
+def reset():
+    _stats.clear()
+    _profile.clear()
+
+
+def drain():
+    """
+    Return the stats recorded so far and start again, e.g to send them from a worker process to the parent
+    :return: dict of stage stats, and the profile data under "profile" if the profiled stage has run
+    """
+    stats = {"stages": {name: dict(s, counters=dict(s["counters"])) for name, s in _stats.items()}}
+    if "profiler" in _profile:
+        stats["profile"] = {"worker_stats": [pstats.Stats(_profile["profiler"]).stats]}
+    elif "top_allocations" in _profile:
+        stats["profile"] = {"top_allocations": _profile["top_allocations"]}
+    reset()
+    return stats
+
+
+def merge(stats):
+    """
+    Add stats recorded in another process
+    :param stats: dict returned by drain
+    """
+    for key, value in stats.get("profile", {}).items():
+        if key == "worker_stats":
+            _profile.setdefault("worker_stats", []).extend(value)
+        else:
+            _profile[key] = value
+    for name, other in stats["stages"].items():
+        mine = _stage_stats(name)
+        mine["seconds"] += other["seconds"]
+        mine["calls"] += other["calls"]
+        for counter, n in other["counters"].items():
+            if counter == "peak_bytes":
+                mine["counters"][counter] = max(mine["counters"].get(counter, 0), n)
+            else:
+                mine["counters"][counter] = mine["counters"].get(counter, 0) + n
+
+
+class Collected:
+    """
+    Wraps a function run in a worker process so that it also returns the stats it recorded,
+    which the parent adds to its own with merge(). Use it only when instrumentation is enabled.
+    The function records into stats of its own, so a call never changes the stats (or the settings) of the
+    process it runs in.
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.profile_stage = PROFILE_STAGE
+        self.profile_mode = PROFILE_MODE
+
+    def __call__(self, *args):
+        global ENABLED, PROFILE_STAGE, PROFILE_MODE, _stats, _profile
+        saved = ENABLED, PROFILE_STAGE, PROFILE_MODE, _stats, _profile
+        # Workers started with spawn do not inherit settings made from the command line
+        ENABLED, PROFILE_STAGE, PROFILE_MODE = True, self.profile_stage, self.profile_mode
+        _stats, _profile = {}, {}
+        try:
+            result = self.fn(*args)
+            return result, drain()
+        finally:
+            ENABLED, PROFILE_STAGE, PROFILE_MODE, _stats, _profile = saved
+
+
+def map_collected(map_fn, fn, *iterables, **kwargs):
+    """
+    Map a function with an executor's map and merge the stats recorded by the workers. With the builtin map,
+    the function runs in this process and records its stats directly.
+    :param map_fn: executor.map or map
+    :param fn: Function to apply
+    :return: generator of results, in order
+    """
+    if not ENABLED or map_fn is map:
+        yield from map_fn(fn, *iterables, **kwargs)
+        return
+    for result, stats in map_fn(Collected(fn), *iterables, **kwargs):
+        merge(stats)
+        yield result
@@ -0,0 +1,67 @@
+"""
+Manifests of parsed files, so that incremental runs only parse the files which are new or have changed.
+A manifest maps a key for each file to its fingerprint: its size and mtime, and optionally a hash of its contents.
+"""
+import hashlib
+import json
+import os
+
+MANIFEST_VERSION = 1
+
+
+def file_fingerprint(file_path, use_hash=False, previous=None):
+    """
+    Describe a file so that changes can be detected on the next run
+    :param file_path: Path to the file
+    :param use_hash: Whether to also store a hash of the file contents
+    :param previous: The fingerprint from the last run, if any
+    :return: dict with the size, mtime and (optionally) sha1 of the file
+    """
+    stat = os.stat(file_path)
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if use_hash:
+        # Only rehash files whose size or mtime have changed
+        if previous and all(previous.get(k) == fingerprint[k] for k in fingerprint) and "sha1" in previous:
+            fingerprint["sha1"] = previous["sha1"]
+        else:
+            with open(file_path, "rb") as file:
+                fingerprint["sha1"] = hashlib.sha1(file.read()).hexdigest()
+    return fingerprint
+
+
+def fingerprint_changed(previous, current):
+    """
+    :param previous: Fingerprint from the manifest (or None for a new file)
+    :param current: Fingerprint of the file on disk
+    :return: True if the file needs to be parsed again
+    """
+    if previous is None:
+        return True
+    if "sha1" in previous and "sha1" in current:
+        return previous["sha1"] != current["sha1"]
+    return previous["size"] != current["size"] or previous["mtime_ns"] != current["mtime_ns"]
+
+
+def load_manifest(manifest_path):
+    """
+    Load the manifest of parsed files written by the last run
+    :param manifest_path: Path to the manifest json
+    :return: dict mapping a file key to a fingerprint (empty if there is no manifest)
+    """
+    try:
+        with open(manifest_path) as file:
+            return json.load(file)["files"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def save_manifest(manifest_path, files):
+    """
+    Write the manifest of parsed files
+    :param manifest_path: Path to the manifest json
+    :param files: dict mapping a file key to a fingerprint
+    """
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump({"version": MANIFEST_VERSION, "files": files}, file)
+    os.replace(tmp_path, manifest_path)
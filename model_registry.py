@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import numpy as np
+import feature_schema
+
+# Directory where fitted models are stored
+MODEL_DIR = os.getenv("MODEL_DIR", "models/")
+REGISTRY_VERSION = 1
+
+
+def data_fingerprint(file_path, previous=None):
+    """
+    Fingerprint the training data. The file is only hashed if its size or mtime differ from the previous
+    fingerprint, so checking an unchanged file costs a single stat.
+    :param file_path: Path to the training data
+    :param previous: Fingerprint stored with a model, if any
+    :return: dict with the size, mtime and sha1 of the file
+    """
+    stat = os.stat(file_path)
+    if previous and previous.get("size") == stat.st_size and previous.get("mtime_ns") == stat.st_mtime_ns:
+        return dict(previous)
+
+    sha1 = hashlib.sha1()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha1.update(block)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": sha1.hexdigest()}
+
+
+class TrainedModel:
+    """
+    A fitted classifier together with everything needed to check that it is still valid and to score new data:
+    the feature list, the OUTPERFORMANCE threshold, the training parameters and a fingerprint of the training data.
+    """
+
+    def __init__(self, clf, features, outperformance, fingerprint, params=None):
+        self.clf = clf
+        self.features = list(features)
+        self.outperformance = outperformance
+        self.fingerprint = fingerprint
+        self.params = dict(params or {})
+
+    def metadata(self):
+        """
+        :return: json-serialisable description of the model
+        """
+        return {
+            "version": REGISTRY_VERSION,
+            "features": self.features,
+            "outperformance": self.outperformance,
+            "params": self.params,
+            "fingerprint": self.fingerprint,
+        }
+
+    def identity(self):
+        """
+        :return: short hash of the metadata, which changes whenever the model is retrained differently
+                 (the mtime of the training data is left out, since it does not change the model)
+        """
+        meta = dict(self.metadata(), fingerprint=self.fingerprint.get("sha1"))
+        return hashlib.sha1(json.dumps(meta, sort_keys=True).encode()).hexdigest()[:16]
+
+    def feature_matrix(self, df, out=None):
+        """
+        Copy the features the model was trained on into a float32 matrix, in training order. Columns are
+        found by name or by any alias in the feature schema, so older forward samples, which spell some
+        feature names differently to keystats.csv, can still be scored.
+        :param df: DataFrame with the features as columns
+        :param out: optional preallocated float32 array of shape (len(df), n_features) to fill
+        :return: float32 array of shape (len(df), n_features)
+        """
+        return feature_schema.feature_matrix(df, self.features, np.float32, out)
+
+    def predict(self, X):
+        """
+        Predict which rows will outperform
+        :param X: feature matrix (a float32 matrix avoids a conversion inside the forest)
+        :return: boolean array
+        """
+        return self.clf.predict(np.asarray(X, dtype=np.float32)).astype(bool)
+
+    def predict_proba(self, X):
+        """
+        :param X: feature matrix
+        :return: the probability of outperforming, for each row
+        """
+        X = np.asarray(X, dtype=np.float32)
+        classes = list(self.clf.classes_)
+        if True not in classes:
+            return np.zeros(len(X))
+        return self.clf.predict_proba(X)[:, classes.index(True)]
+
+
+def _model_paths(name):
+    return os.path.join(MODEL_DIR, f"{name}.pkl"), os.path.join(MODEL_DIR, f"{name}.json")
+
+
+def save_model(model, name="random_forest"):
+    """
+    Save a model and its metadata. The metadata is written last, so a reader never sees metadata for a
+    model file that is still being written.
+    :param model: TrainedModel
+    :param name: Name of the model in the registry
+    """
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    model_path, meta_path = _model_paths(name)
+    with open(model_path + ".tmp", "wb") as file:
+        pickle.dump(model, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(model_path + ".tmp", model_path)
+    with open(meta_path + ".tmp", "w") as file:
+        json.dump(model.metadata(), file)
+    os.replace(meta_path + ".tmp", meta_path)
+
+
+def load_model(name="random_forest"):
+    """
+    :param name: Name of the model in the registry
+    :return: TrainedModel, or None if there is no saved model
+    """
+    model_path, _ = _model_paths(name)
+    try:
+        with open(model_path, "rb") as file:
+            return pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+        logging.warning(f"Could not load model {name}: {str(e)}")
+        return None
+
+
+def load_metadata(name="random_forest"):
+    """
+    :param name: Name of the model in the registry
+    :return: the metadata of the saved model, or None
+    """
+    _, meta_path = _model_paths(name)
+    try:
+        with open(meta_path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def load_or_train(train_fn, file_path, outperformance, params=None, name="random_forest"):
+    """
+    Return the saved model if it was trained on the same data with the same threshold and parameters,
+    otherwise train a new one and save it. The check only reads the small metadata file (and stats the
+    training data), so an unchanged model is reloaded without touching the training data.
+    :param train_fn: Function (file_path, outperformance, **params) -> (fitted classifier, feature list)
+    :param file_path: Path to the training data
+    :param outperformance: The OUTPERFORMANCE threshold used for the labels
+    :param params: Training parameters passed to train_fn
+    :param name: Name of the model in the registry
+    :return: TrainedModel
+    """
+    params = dict(params or {})
+    meta = load_metadata(name)
+    previous = meta["fingerprint"] if meta else None
+    fingerprint = data_fingerprint(file_path, previous)
+
+    if (
+        meta is not None
+        and meta.get("version") == REGISTRY_VERSION
+        and meta["fingerprint"]["sha1"] == fingerprint["sha1"]
+        and meta["outperformance"] == outperformance
+        and meta["params"] == params
+    ):
+        model = load_model(name)
+        if model is not None:
+            if fingerprint != meta["fingerprint"]:
+                # Same contents with a new mtime: store the new stat so the next check does not rehash
+                model.fingerprint = fingerprint
+                save_model(model, name)
+            return model
+
+    logging.info("Training a new model...")
+    clf, features = train_fn(file_path, outperformance, **params)
+    model = TrainedModel(clf, features, outperformance, fingerprint, params)
+    save_model(model, name)
+    return model
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+import instrumentation
+from feature_extractor import read_document
+
+# Parse results of the html files, keyed by their contents. Set PARSE_CACHE to an empty string to disable it.
+PARSE_CACHE = os.getenv("PARSE_CACHE", os.path.join(os.getenv("DATA_CACHE", ".cache/"), "parse_cache.sqlite"))
+# Maximum number of documents kept in the cache; the least recently used are evicted first
+PARSE_CACHE_SIZE = int(os.getenv("PARSE_CACHE_SIZE", 500000))
+
+# Number of lookups whose access times are buffered before they are written
+_TOUCH_BATCH = 256
+# Number of inserts between two checks of the cache size
+_EVICT_INTERVAL = 1000
+
+
+class ParseCache:
+    """
+    On-disk cache of parsed value rows, keyed by a hash of the document and the extractor version.
+
+    The cache is a SQLite database in WAL mode, so any number of processes can read it while one writes, and
+    writers wait for each other (up to a timeout) rather than failing. It is only a cache: any database error
+    is logged and the document is parsed as if it were not cached. Each process opens its own connection,
+    so the same object can be used before and after forking the parsing workers.
+    """
+
+    def __init__(self, path=PARSE_CACHE, max_entries=PARSE_CACHE_SIZE, timeout=30):
+        """
+        :param path: Path to the SQLite database
+        :param max_entries: Maximum number of documents kept
+        :param timeout: Seconds to wait for a concurrent writer
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._pid = None
+        self._touched = []
+        self._inserts = 0
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS parses (key BLOB PRIMARY KEY, value_list TEXT NOT NULL, "
+                "last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS parses_last_used ON parses (last_used)")
+            self._conn, self._pid, self._touched = conn, os.getpid(), []
+        return self._conn
+
+    @staticmethod
+    def key(raw, version):
+        """
+        :param raw: contents of the document (bytes-like)
+        :param version: FeatureExtractor.version
+        :return: cache key
+        """
+        sha1 = hashlib.sha1(version.encode() + b"\0")
+        sha1.update(raw)
+        return sha1.digest()
+
+    def get(self, key):
+        """
+        :param key: cache key
+        :return: the cached value list, or None
+        """
+        try:
+            row = self._connection().execute("SELECT value_list FROM parses WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logging.debug(f"Parse cache lookup failed: {str(e)}")
+            return None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched.append(key)
+        if len(self._touched) >= _TOUCH_BATCH:
+            self.flush()
+        return json.loads(row[0])
+
+    def put(self, key, value_list):
+        """
+        Store a value list. Documents which are already cached (e.g parsed by another process) are overwritten.
+        :param key: cache key
+        :param value_list: list of parsed values
+        """
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO parses (key, value_list, last_used) VALUES (?, ?, ?)",
+                (key, json.dumps(value_list), time.time()),
+            )
+        except sqlite3.Error as e:
+            logging.debug(f"Parse cache insert failed: {str(e)}")
+            return
+        self._inserts += 1
+        if self._inserts % _EVICT_INTERVAL == 0:
+            self.evict()
+
+    def flush(self):
+        """
+        Write the access times of the cached documents that have been read, which decide what is evicted
+        """
+        if not self._touched:
+            return
+        touched, self._touched = self._touched, []
+        now = time.time()
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("UPDATE parses SET last_used = ? WHERE key = ?", [(now, key) for key in touched])
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logging.debug(f"Parse cache update failed: {str(e)}")
+            if self._conn is not None and self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+
+    def evict(self):
+        """
+        Delete the least recently used documents until at most max_entries are left
+        """
+        try:
+            conn = self._connection()
+            excess = conn.execute("SELECT COUNT(*) FROM parses").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM parses WHERE key IN (SELECT key FROM parses ORDER BY last_used LIMIT ?)", (excess,)
+                )
+        except sqlite3.Error as e:
+            logging.debug(f"Parse cache eviction failed: {str(e)}")
+
+    def close(self):
+        self.flush()
+        self.evict()
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def extract_file(self, file_path, extractor):
+        """
+        Parse an html file, or return the cached result if a document with the same contents has been parsed
+        by the same extractor before. A cached document only costs a read and a hash.
+        :param file_path: Path to the html file
+        :param extractor: FeatureExtractor
+        :return: list of feature values, as returned by extractor.extract
+        """
+        with instrumentation.stage("read_html"):
+            raw = read_document(file_path)
+        instrumentation.count("read_html", "bytes_read", len(raw))
+        with instrumentation.stage("parse_cache"):
+            key = self.key(raw, extractor.version)
+            value_list = self.get(key)
+        instrumentation.count("parse_cache", "misses" if value_list is None else "hits")
+        if value_list is None:
+            value_list = extractor.extract(raw)
+            self.put(key, value_list)
+        return value_list
+
+
+_caches = {}
+
+
+def get_cache(path=None):
+    """
+    The shared cache for a database path
+    :param path: Path to the SQLite database (defaults to PARSE_CACHE, and an empty path disables caching)
+    :return: ParseCache, or None if caching is disabled
+    """
+    path = PARSE_CACHE if path is None else path
+    if not path:
+        return None
+    if path not in _caches:
+        _caches[path] = ParseCache(path)
+    return _caches[path]
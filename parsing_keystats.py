@@ -1,31 +1,33 @@
 import pandas as pd
 import os
 import time
-import re
 from datetime import datetime
-from utils import data_string_to_float
+from feature_extractor import FeatureExtractor, read_document
+from row_buffer import RowBuffer
+from price_matrix import PriceMatrix, to_days
+from feature_store import FeatureStore
+from utils import find_duplicates
+from manifest import file_fingerprint, fingerprint_changed, load_manifest, save_manifest
+import datastore
+import instrumentation
+import parse_cache
+import feature_schema
+from config import statspath, N_JOBS, INCREMENTAL, MANIFEST_HASH, features, FALLBACK_LABELS, configure_logging
 from tqdm import tqdm
 import logging
+from concurrent.futures import ProcessPoolExecutor
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# The directory where individual html files are stored
-statspath = os.getenv("STATSPATH", "intraQuarter/_KeyStats/")
-
-# The list of features to parse from the html files
-features = [
-    "Market Cap", "Enterprise Value", "Trailing P/E", "Forward P/E", "PEG Ratio",
-    "Price/Sales", "Price/Book", "Enterprise Value/Revenue", "Enterprise Value/EBITDA",
-    "Profit Margin", "Operating Margin", "Return on Assets", "Return on Equity",
-    "Revenue", "Revenue Per Share", "Qtrly Revenue Growth", "Gross Profit",
-    "EBITDA", "Net Income Avl to Common", "Diluted EPS", "Qtrly Earnings Growth",
-    "Total Cash", "Total Cash Per Share", "Total Debt", "Total Debt/Equity",
-    "Current Ratio", "Book Value Per Share", "Operating Cash Flow", "Levered Free Cash Flow",
-    "Beta", "50-Day Moving Average", "200-Day Moving Average", "Avg Vol (3 month)",
-    "Shares Outstanding", "Float", "% Held by Insiders", "% Held by Institutions",
-    "Shares Short (as of", "Short Ratio", "Short % of Float", "Shares Short (prior month"
-]
+def get_extractor(features):
+    """
+    Get a precompiled extractor for a list of features
+    :param features: List of features to extract
+    :return: FeatureExtractor (the shared one from the feature schema for the default features)
+    """
+    if features == EXTRACTOR.features:
+        return EXTRACTOR
+    return FeatureExtractor(features, fallbacks=FALLBACK_LABELS)
+
+EXTRACTOR = feature_schema.get_extractor("keystats")
 
 def load_data(file_path):
     """
@@ -34,126 +36,258 @@ def load_data(file_path):
     :return: DataFrame with data
     """
     try:
-        data_df = pd.read_csv(file_path, index_col="Date", parse_dates=True)
+        data_df = datastore.read_csv(file_path, index_col="Date", parse_dates=True)
         data_df.dropna(axis=0, how="any", inplace=True)
         return data_df
     except Exception as e:
         logging.error(f"Error loading data from {file_path}: {str(e)}")
         return pd.DataFrame()
 
-def reindex_and_fill(df, start_date, end_date):
-    """
-    Reindex the dataframe to include all days in the date range and fill missing values
-    :param df: DataFrame to be reindexed
-    :param start_date: Start date for the reindexing
-    :param end_date: End date for the reindexing
-    :return: Reindexed DataFrame with filled missing values
-    """
-    idx = pd.date_range(start_date, end_date)
-    df = df.reindex(idx)
-    df.ffill(inplace=True)
-    return df
-
 def preprocess_price_data():
     """
-    Preprocess SP500 and stock price datasets to fill missing rows
-    :return: SP500 and stock dataframes with no missing rows
+    Load the SP500 and stock price datasets into a compact matrix of trading-day prices.
+    Calendar dates are resolved to the previous trading day when the prices are looked up,
+    so the frames are not reindexed to every day.
+    :return: PriceMatrix, or None if the price data could not be loaded
     """
     sp500_df = load_data("sp500_index.csv")
     stock_df = load_data("stock_prices.csv")
 
     if sp500_df.empty or stock_df.empty:
         logging.error("Error loading SP500 or stock data. Exiting preprocessing.")
-        return pd.DataFrame(), pd.DataFrame()
-
-    start_date = str(stock_df.index[0])
-    end_date = str(stock_df.index[-1])
-
-    sp500_df = reindex_and_fill(sp500_df, start_date, end_date)
-    stock_df = reindex_and_fill(stock_df, start_date, end_date)
+        return None
 
-    return sp500_df, stock_df
+    return PriceMatrix.from_frames(stock_df, sp500_df)
 
 def parse_html_file(file_path, features):
     """
-    Parse an HTML file to extract feature values
+    Parse an HTML file to extract feature values. Files whose contents have been parsed before are
+    looked up in the parse cache instead.
     :param file_path: Path to the HTML file
     :param features: List of features to extract
     :return: List of extracted feature values
     """
-    value_list = []
+    extractor = get_extractor(features)
+    cache = parse_cache.get_cache()
     try:
-        with open(file_path, "r") as file:
-            source = file.read().replace(",", "")
-            for variable in features:
-                try:
-                    regex = (
-                        r">" + re.escape(variable) + r".*?(\-?\d+\.*\d*K?M?B?|N/A[\\n|\s]*|>0|NaN)%?"
-                        r"(</td>|</span>)"
-                    )
-                    value = re.search(regex, source, flags=re.DOTALL).group(1)
-                    value_list.append(data_string_to_float(value))
-                except AttributeError:
-                    if variable == "Avg Vol (3 month)":
-                        try:
-                            new_variable = ">Average Volume (3 month)"
-                            regex = (
-                                re.escape(new_variable) + r".*?(\-?\d+\.*\d*K?M?B?|N/A[\\n|\s]*|>0)%?"
-                                r"(</td>|</span>)"
-                            )
-                            value = re.search(regex, source, flags=re.DOTALL).group(1)
-                            value_list.append(data_string_to_float(value))
-                        except AttributeError:
-                            value_list.append("N/A")
-                    else:
-                        value_list.append("N/A")
+        if cache is not None:
+            value_list = cache.extract_file(file_path, extractor)
+        else:
+            with instrumentation.stage("read_html"):
+                source = read_document(file_path)
+            instrumentation.count("read_html", "bytes_read", len(source))
+            value_list = extractor.extract(source)
     except Exception as e:
         logging.error(f"Error parsing HTML file {file_path}: {str(e)}")
         value_list = ["N/A"] * len(features)
     return value_list
 
-def parse_keystats(sp500_df, stock_df):
+def list_snapshot_files(stock_directory):
+    """
+    List the html snapshots in a ticker directory
+    :param stock_directory: Path to the directory of html files for one ticker
+    :return: List of file names, in directory listing order
+    """
+    keystats_html_files = os.listdir(stock_directory)
+    if ".DS_Store" in keystats_html_files:
+        keystats_html_files.remove(".DS_Store")
+    return keystats_html_files
+
+def parse_ticker_directory(stock_directory, keystats_html_files=None):
+    """
+    Parse the html snapshots for a single ticker. This is the unit of work for parallel parsing.
+    :param stock_directory: Path to the directory of html files for one ticker
+    :param keystats_html_files: File names to parse (defaults to every snapshot in the directory)
+    :return: List of (date_stamp, unix_time, ticker, value_list) tuples, in directory listing order
+    """
+    if keystats_html_files is None:
+        keystats_html_files = list_snapshot_files(stock_directory)
+
+    ticker = stock_directory.split(statspath)[1]
+
+    snapshots = []
+    for file in keystats_html_files:
+        date_stamp = datetime.strptime(file, "%Y%m%d%H%M%S.html")
+        unix_time = time.mktime(date_stamp.timetuple())
+        full_file_path = os.path.join(stock_directory, file)
+        snapshots.append((date_stamp, unix_time, ticker, parse_html_file(full_file_path, features)))
+
+    cache = parse_cache.get_cache()
+    if cache is not None:
+        cache.flush()
+    return snapshots
+
+def iter_parsed_tickers(stock_list, n_jobs=N_JOBS, file_lists=None):
+    """
+    Parse each ticker directory, optionally in a pool of worker processes.
+    Results are yielded in the order of stock_list regardless of the number of workers,
+    so the output is identical to a serial run.
+    :param stock_list: List of ticker directories
+    :param n_jobs: Number of worker processes (1 parses serially in this process)
+    :param file_lists: Optional list (aligned with stock_list) of the file names to parse in each directory
+    :return: generator of snapshot lists, one per ticker directory
+    """
+    if file_lists is None:
+        file_lists = [None] * len(stock_list)
+
+    if n_jobs <= 1:
+        yield from map(parse_ticker_directory, stock_list, file_lists)
+        return
+
+    # Small chunks keep the workers balanced, since tickers have very different numbers of snapshots
+    chunksize = max(1, len(stock_list) // (n_jobs * 8))
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        yield from instrumentation.map_collected(
+            executor.map, parse_ticker_directory, stock_list, file_lists, chunksize=chunksize
+        )
+
+def label_snapshots(parsed_tickers, prices, total=None):
+    """
+    Join parsed snapshots with the stock and SP500 price changes over the following year. The snapshots are
+    put in a FeatureStore with the prices, which looks up the prices on each snapshot date (resolved to the
+    previous trading day) and one year later. Snapshots without price data are dropped, and the number
+    dropped for each reason is logged.
+    :param parsed_tickers: iterable of snapshot lists, as yielded by iter_parsed_tickers
+    :param prices: PriceMatrix of the stock and SP500 prices
+    :param total: Number of ticker directories, for the progress bar
+    :return: DataFrame of parsed key statistics and stock performance data
+    """
+    rows = RowBuffer(["Date", "Unix", "Ticker"] + features, float_columns=["Unix"] + features)
+    for snapshots in tqdm(parsed_tickers, total=total, desc="Parsing progress:", unit="tickers"):
+        with instrumentation.stage("build_rows"):
+            for date_stamp, unix_time, ticker, value_list in snapshots:
+                rows.append([date_stamp, unix_time, ticker] + value_list)
+    with instrumentation.stage("build_rows"):
+        df = rows.to_frame()
+
+    with instrumentation.stage("price_lookup"):
+        store = FeatureStore(df["Ticker"].to_numpy(), to_days(df["Date"]), df[features].to_numpy(), features, prices)
+        labels, keep, drop_counts = store.label_rows(horizon_days=365)
+        for i, (column, values) in enumerate(labels.items()):
+            df.insert(3 + i, column, values)
+    instrumentation.count("price_lookup", "rows", len(df))
+    instrumentation.record_drops("price_lookup", drop_counts)
+
+    if not keep.all():
+        logging.warning(f"Dropped {int((~keep).sum())} snapshots without price data: {drop_counts}")
+    return df[keep].reset_index(drop=True)
+
+def parse_keystats(prices, n_jobs=N_JOBS):
     """
     Parse key statistics from HTML files and create a dataset
-    :param sp500_df: DataFrame containing SP500 prices
-    :param stock_df: DataFrame containing stock prices
+    :param prices: PriceMatrix of the stock and SP500 prices
+    :param n_jobs: Number of worker processes used to parse the html files
     :return: DataFrame of parsed key statistics and stock performance data
     """
     stock_list = [x[0] for x in os.walk(statspath)][1:]
+    parsed_tickers = iter_parsed_tickers(stock_list, n_jobs)
+    return label_snapshots(parsed_tickers, prices, total=len(stock_list))
 
-    df_columns = [
-        "Date", "Unix", "Ticker", "Price", "stock_p_change", "SP500", "SP500_p_change"
-    ] + features
-    df = pd.DataFrame(columns=df_columns)
-
-    for stock_directory in tqdm(stock_list, desc="Parsing progress:", unit="tickers"):
-        keystats_html_files = os.listdir(stock_directory)
-        if ".DS_Store" in keystats_html_files:
-            keystats_html_files.remove(".DS_Store")
+def snapshot_key(ticker, file):
+    """
+    The manifest key of a snapshot, which can also be rebuilt from a keystats row
+    """
+    return f"{ticker}/{file}"
 
+def scan_snapshots(use_hash=False, manifest=None):
+    """
+    Walk statspath and fingerprint every snapshot
+    :param use_hash: Whether to hash file contents
+    :param manifest: Previous manifest, used to skip rehashing unchanged files
+    :return: dict mapping "ticker/file.html" to a fingerprint, in walk order
+    """
+    manifest = manifest or {}
+    files = {}
+    for stock_directory in [x[0] for x in os.walk(statspath)][1:]:
         ticker = stock_directory.split(statspath)[1]
+        for file in list_snapshot_files(stock_directory):
+            key = snapshot_key(ticker, file)
+            files[key] = file_fingerprint(os.path.join(stock_directory, file), use_hash, manifest.get(key))
+    return files
+
+def update_keystats(prices, keystats_path="keystats.csv", manifest_path=None,
+                    use_hash=False, n_jobs=N_JOBS):
+    """
+    Incrementally update keystats.csv: only new or changed snapshots are parsed, and the rows of
+    changed or deleted snapshots are dropped. Falls back to a full build if there is no manifest.
+    The rows of new or changed snapshots are appended at the end, so the rows are the same as in a full build
+    but not in the same order (a full build is in directory walk order).
+    Note that existing rows are not relabelled if the price data changes: do a full build for that.
+    :param prices: PriceMatrix of the stock and SP500 prices
+    :param keystats_path: Path to the existing keystats csv
+    :param manifest_path: Path to the manifest (defaults to a json file next to keystats_path)
+    :param use_hash: Whether to compare file contents (sha1) rather than only size and mtime
+    :param n_jobs: Number of worker processes used to parse the html files
+    :return: (DataFrame of the full dataset, new manifest)
+    """
+    manifest_path = manifest_path or os.path.splitext(keystats_path)[0] + "_manifest.json"
+    manifest = load_manifest(manifest_path)
+    current = scan_snapshots(use_hash, manifest)
+
+    if not manifest or not os.path.exists(keystats_path):
+        logging.info("No manifest found, parsing all snapshots.")
+        return parse_keystats(prices, n_jobs), current
+
+    changed = [key for key, fingerprint in current.items() if fingerprint_changed(manifest.get(key), fingerprint)]
+    stale = set(changed) | (set(manifest) - set(current))
+    logging.info(f"{len(changed)} new or changed snapshots, {len(set(manifest) - set(current))} deleted.")
+
+    existing_df = pd.read_csv(keystats_path)
+    if stale:
+        # pandas writes the dates without a time when every snapshot was taken at midnight
+        existing_files = pd.to_datetime(existing_df["Date"]).dt.strftime("%Y%m%d%H%M%S.html")
+        existing_keys = [snapshot_key(ticker, file) for ticker, file in zip(existing_df["Ticker"], existing_files)]
+        existing_df = existing_df[[key not in stale for key in existing_keys]]
+
+    # Group the changed files by ticker directory, keeping the walk order
+    changed_by_ticker = {}
+    for key in changed:
+        ticker, file = key.split("/", 1)
+        changed_by_ticker.setdefault(ticker, []).append(file)
+    stock_list = [os.path.join(statspath, ticker) for ticker in changed_by_ticker]
+    parsed_tickers = iter_parsed_tickers(stock_list, n_jobs, list(changed_by_ticker.values()))
+    new_df = label_snapshots(parsed_tickers, prices, total=len(stock_list))
+
+    df = pd.concat([existing_df, new_df], ignore_index=True) if len(new_df) else existing_df
+    return df, current
+
+def main(incremental=INCREMENTAL, use_hash=MANIFEST_HASH, n_jobs=N_JOBS):
+    """
+    Build keystats.csv from the html files and the price datasets
+    :param incremental: Only parse the snapshots which are new or have changed since the last run
+    :param use_hash: Compare file contents rather than size and modification time
+    :param n_jobs: Number of worker processes
+    :return: None
+    """
+    with instrumentation.stage("load_prices"):
+        prices = preprocess_price_data()
+    if prices is None:
+        logging.error("Price data unavailable. Exiting.")
+        return
+
+    if incremental:
+        df, manifest = update_keystats(prices, "keystats.csv", use_hash=use_hash, n_jobs=n_jobs)
+    else:
+        df = parse_keystats(prices, n_jobs)
+        manifest = scan_snapshots(use_hash)
+    with instrumentation.stage("write_csv"):
+        df.to_csv("keystats.csv", index=False)
+    save_manifest("keystats_manifest.json", manifest)
+
+    with instrumentation.stage("duplicate_check"):
+        duplicates = find_duplicates(df)
+    adjacent = duplicates[duplicates["adjacent"]]
+    if len(adjacent):
+        logging.warning(
+            f"{adjacent['row'].nunique()} of {len(df)} rows have the same value in neighbouring columns, "
+            f"which may be a parsing error (see utils.find_duplicates)"
+        )
+
+    cache = parse_cache.get_cache()
+    if cache is not None:
+        cache.close()
 
-        for file in keystats_html_files:
-            date_stamp = datetime.strptime(file, "%Y%m%d%H%M%S.html")
-            unix_time = time.mktime(date_stamp.timetuple())
-            full_file_path = os.path.join(stock_directory, file)
-
-            value_list = parse_html_file(full_file_path, features)
-
-            current_date = datetime.fromtimestamp(unix_time).strftime("%Y-%m-%d")
-            one_year_later = datetime.fromtimestamp(unix_time + 31536000).strftime("%Y-%m-%d")
-
-            try:
-                sp500_price = float(sp500_df.loc[current_date, "Adj Close"])
-                sp500_1y_price = float(sp500_df.loc[one_year_later, "Adj Close"])
-                sp500_p_change = round(((sp500_1y_price - sp500_price) / sp500_price * 100), 2)
-            except KeyError:
-                logging.warning(f"SP500 data missing for {current_date} or {one_year_later}")
-                continue
-
-            try:
-                stock_price = float(stock_df.loc[current_date, ticker.upper()])
-                stock_1y_price = float(stock_df.loc[one_year_later, ticker.upper()])
-                stock_p_change = round(((stock_1y_price - stock_price) / stock_price * 100), 2)
-            except KeyError:
-                logging.warning(f"Stock data missing for {ticker}
\ No newline at end of file
+if __name__ == "__main__":
+    configure_logging()
+    instrumentation.configure()
+    main()
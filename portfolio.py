@@ -0,0 +1,193 @@
+"""
+Portfolio simulation of buy signals over the trading-day price matrix.
+
+Each buy signal (ticker, date) is a lot which is bought on the last trading day on or before the date and sold
+holding_days later, as in the labels. Capital is split into max_positions equal slots: a lot is only bought if a
+slot is free on its entry day, otherwise the signal is skipped. Costs are charged in basis points of the amount
+traded, on entry and on exit.
+
+A lot's effect on the equity curve is proportional to the capital put in it, so the equity of a whole portfolio
+is a weighted sum of the lots' paths. Many strategy variants (e.g different probability thresholds, numbers of
+positions or costs) are simulated together with one matrix product over the lots, rather than one loop per
+variant.
+"""
+import os
+import numpy as np
+import pandas as pd
+from price_matrix import to_days
+
+# Number of equal slots the capital is split into
+MAX_POSITIONS = int(os.getenv("MAX_POSITIONS", 20))
+# Transaction cost, in basis points of the amount bought or sold
+COST_BPS = float(os.getenv("COST_BPS", 10))
+TRADING_DAYS_PER_YEAR = 252
+# Number of lots whose daily paths are built at a time, which bounds the memory used to lots x days
+_LOT_CHUNK = 256
+
+
+def build_lots(prices, dates, tickers, holding_days=365):
+    """
+    Resolve buy signals to entry and exit trading days. Lots which are still held at the end of the price
+    history are valued at the last price.
+    :param prices: PriceMatrix
+    :param dates: array-like of signal dates
+    :param tickers: array-like of tickers (any case), aligned with dates
+    :param holding_days: Number of calendar days each lot is held
+    :return: dict of entry and exit positions into prices.days, price matrix rows, and a boolean array of
+             the signals which could be traded (known ticker and a price on the entry day)
+    """
+    days = to_days(dates)
+    entry = prices.positions(days)
+    exit = prices.positions(days + holding_days)
+    if len(prices):
+        exit = np.where(days + holding_days > prices.days[-1], len(prices) - 1, exit)
+    rows = prices.ticker_rows(tickers)
+
+    valid = (entry >= 0) & (rows >= 0) & (exit > entry)
+    entry_prices = prices.prices[rows.clip(0), entry.clip(0)]
+    with np.errstate(invalid="ignore"):
+        valid &= np.isfinite(entry_prices) & (entry_prices > 0)
+    return {"entry": entry, "exit": exit, "rows": rows, "valid": valid}
+
+
+def accept_signals(signals, entry, exit, max_positions):
+    """
+    Buy each signal only if one of the max_positions slots is free on its entry day. The lots are visited in
+    order of entry, and each step is vectorized over the variants.
+    :param signals: boolean array (variants x lots)
+    :param entry: entry positions of the lots, sorted
+    :param exit: exit positions of the lots, sorted as well. Every lot is held for the same time, so this holds
+                 if the lots sharing an entry day are sorted by exit (signal dates on a weekend share the entry
+                 day of the Friday before, but not its exit day)
+    :param max_positions: int, or array with one value per variant
+    :return: boolean array (variants x lots) of the lots which are bought
+    """
+    accepted = np.zeros(signals.shape, dtype=bool)
+    open_positions = np.zeros(len(signals), dtype=np.int64)
+    n_closed = 0
+    for i in range(signals.shape[1]):
+        # A slot freed by a sale can be used by a purchase on the same day
+        while exit[n_closed] <= entry[i]:
+            open_positions -= accepted[:, n_closed]
+            n_closed += 1
+        accepted[:, i] = signals[:, i] & (open_positions < max_positions)
+        open_positions += accepted[:, i]
+    return accepted
+
+
+def _lot_paths(prices, entry, exit, rows, start, n_days):
+    """
+    The daily paths of a unit of capital put in each lot, over n_days trading days from start
+    :return: (gain, traded) arrays (lots x days): the profit before costs, and the cumulative amount traded
+    """
+    offsets = np.arange(n_days)
+    held = np.clip(offsets, (entry - start)[:, None], (exit - start)[:, None]) + start
+    growth = prices.prices[rows[:, None], held].astype(np.float64) / prices.prices[rows, entry][:, None]
+    started = offsets >= (entry - start)[:, None]
+    closed = offsets >= (exit - start)[:, None]
+    gain = np.where(started, growth - 1, 0.0)
+    traded = started + closed * growth[:, -1:]
+    return gain, traded
+
+
+def performance(equity, traded, index, initial_capital=1.0):
+    """
+    Statistics of daily equity curves, compared to the S&P500 over the same days
+    :param equity: array (variants x days) of daily equity
+    :param traded: total amount traded by each variant
+    :param index: S&P500 price on each day
+    :param initial_capital: Starting equity
+    :return: dict of arrays with one value per variant (NaN if there are fewer than two days),
+             and the drawdown (variants x days)
+    """
+    n_variants, n_days = equity.shape
+    index = np.asarray(index, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        drawdown = equity / np.maximum.accumulate(equity, axis=1) - 1
+    result = {name: np.full(n_variants, np.nan) for name in
+              ["max_drawdown", "total_return", "spy_return", "excess_return", "alpha", "beta", "turnover"]}
+    result["drawdown"] = drawdown
+    if n_days < 2:
+        return result
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = equity[:, 1:] / equity[:, :-1] - 1
+        spy_returns = index[1:] / index[:-1] - 1
+        spy_deviations = spy_returns - spy_returns.mean()
+        beta = (returns - returns.mean(axis=1, keepdims=True)) @ spy_deviations / (spy_deviations ** 2).sum()
+        result["beta"] = beta
+        result["alpha"] = (returns.mean(axis=1) - beta * spy_returns.mean()) * TRADING_DAYS_PER_YEAR
+        result["turnover"] = traded / equity.mean(axis=1) / (n_days / TRADING_DAYS_PER_YEAR)
+    result["max_drawdown"] = drawdown.min(axis=1)
+    result["total_return"] = equity[:, -1] / initial_capital - 1
+    result["spy_return"][:] = index[-1] / index[0] - 1
+    result["excess_return"] = result["total_return"] - result["spy_return"]
+    return result
+
+
+def simulate(prices, dates, tickers, signals=None, holding_days=365, max_positions=MAX_POSITIONS,
+             cost_bps=COST_BPS, initial_capital=1.0):
+    """
+    Simulate the portfolios which buy the signalled stocks, for one or many strategy variants
+    :param prices: PriceMatrix
+    :param dates: array-like of signal dates
+    :param tickers: array-like of tickers, aligned with dates
+    :param signals: boolean array (n_signals,) or (variants x n_signals) of the signals each variant acts on
+                    (defaults to all of them)
+    :param holding_days: Number of calendar days each lot is held
+    :param max_positions: Number of equal slots the capital is split into (int, or one per variant)
+    :param cost_bps: Transaction cost in basis points of the amount traded (float, or one per variant)
+    :param initial_capital: Starting equity
+    :return: dict with the trading days, the daily equity and drawdown (variants x days) and, for each variant,
+             max_drawdown, total_return, spy_return, excess_return, alpha (annualised, against the S&P500),
+             beta, turnover (amount traded per year as a multiple of the average equity), trades and skipped.
+             Arrays have no variants axis if signals is 1D.
+    """
+    lots = build_lots(prices, dates, tickers, holding_days)
+    signals = np.ones(len(lots["entry"]), dtype=bool) if signals is None else np.asarray(signals, dtype=bool)
+    single = signals.ndim == 1
+    signals = np.atleast_2d(signals)
+    n_variants = len(signals)
+    max_positions = np.broadcast_to(np.asarray(max_positions, dtype=np.int64), (n_variants,))
+    cost = np.broadcast_to(np.asarray(cost_bps, dtype=np.float64), (n_variants,)) / 10000
+
+    valid = lots["valid"]
+    order = np.lexsort((lots["exit"][valid], lots["entry"][valid]))
+    entry, exit, rows = (lots[name][valid][order] for name in ("entry", "exit", "rows"))
+    signals = signals[:, valid][:, order]
+
+    accepted = accept_signals(signals, entry, exit, max_positions) if len(entry) else signals
+    weights = accepted * (initial_capital / max_positions)[:, None]
+
+    start = int(entry.min()) if len(entry) else 0
+    end = int(exit.max()) if len(entry) else -1
+    n_days = end - start + 1
+    gain = np.zeros((n_variants, n_days))
+    traded = np.zeros((n_variants, n_days))
+    for chunk in range(0, len(entry), _LOT_CHUNK):
+        lot_slice = slice(chunk, chunk + _LOT_CHUNK)
+        lot_gain, lot_traded = _lot_paths(prices, entry[lot_slice], exit[lot_slice], rows[lot_slice], start, n_days)
+        gain += weights[:, lot_slice] @ lot_gain
+        traded += weights[:, lot_slice] @ lot_traded
+    equity = initial_capital + gain - cost[:, None] * traded
+
+    total_traded = traded[:, -1] if n_days else np.zeros(n_variants)
+    result = performance(equity, total_traded, prices.index_prices[start:end + 1], initial_capital)
+    result["trades"] = accepted.sum(axis=1)
+    result["skipped"] = signals.sum(axis=1) - result["trades"]
+    result["equity"] = equity
+    if single:
+        result = {name: value[0] for name, value in result.items()}
+    result["days"] = prices.days[start:end + 1].astype("datetime64[D]")
+    result["untradable"] = int((~valid).sum())
+    return result
+
+
+def summary(result):
+    """
+    :param result: dict returned by simulate for many variants
+    :return: DataFrame with one row of statistics per variant
+    """
+    columns = ["trades", "skipped", "total_return", "spy_return", "excess_return", "alpha", "beta",
+               "max_drawdown", "turnover"]
+    return pd.DataFrame({column: np.atleast_1d(result[column]) for column in columns})
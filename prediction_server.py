@@ -0,0 +1,225 @@
+"""
+Local prediction server, which keeps the model and the scores of the forward sample in memory.
+
+    python prediction_server.py --port 8765
+
+    curl "localhost:8765/score?tickers=AAPL,MSFT"   # probability of outperforming, and the buy flag
+    curl "localhost:8765/top?n=10"                  # the best scoring tickers
+    curl "localhost:8765/status"
+    curl -X POST "localhost:8765/reload"            # reload if keystats.csv or forward_sample.csv changed
+
+The model comes from the model registry, so it is only retrained if keystats.csv, OUTPERFORMANCE or the
+parameters have changed. The whole forward sample is scored when it is loaded, so queries are lookups.
+A reload builds the new state while the old one keeps answering queries, and then swaps them.
+It only uses the standard library http.server and listens on localhost by default.
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import instrumentation
+import model_registry
+import stock_prediction
+from config import configure_logging
+
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", 8765))
+
+
+class ScoredSample:
+    """
+    The scores of every ticker of the forward sample by one model
+    """
+
+    def __init__(self, model, tickers, probability, buy, fingerprints):
+        """
+        :param model: model_registry.TrainedModel
+        :param tickers: array of tickers
+        :param probability: probability of outperforming, for each ticker
+        :param buy: predicted buy flag, for each ticker
+        :param fingerprints: dict mapping each input path to its fingerprint when it was loaded
+        """
+        self.model = model
+        self.tickers = np.asarray(tickers, dtype=object)
+        self.probability = np.asarray(probability, dtype=np.float64)
+        self.buy = np.asarray(buy, dtype=bool)
+        self.fingerprints = fingerprints
+        self.rows = {str(ticker).upper(): i for i, ticker in enumerate(self.tickers)}
+        self.ranking = np.argsort(-self.probability, kind="stable")
+        self.loaded_at = time.time()
+
+    def row(self, i):
+        return {"ticker": self.tickers[i], "probability": float(self.probability[i]), "buy": bool(self.buy[i])}
+
+
+class PredictionService:
+    """
+    Holds the current ScoredSample and answers queries from it
+    """
+
+    def __init__(self, training_path="keystats.csv", sample_path="forward_sample.csv",
+                 outperformance=stock_prediction.OUTPERFORMANCE, n_estimators=100):
+        self.training_path = training_path
+        self.sample_path = sample_path
+        self.outperformance = outperformance
+        self.n_estimators = n_estimators
+        self.state = None
+        self._reload_lock = threading.Lock()
+
+    def _fingerprints(self, previous=None):
+        previous = previous or {}
+        return {path: model_registry.data_fingerprint(path, previous.get(path))
+                for path in (self.training_path, self.sample_path)}
+
+    def _load(self, model=None):
+        fingerprints = self._fingerprints()
+        if model is None:
+            model = stock_prediction.get_model(self.training_path, self.outperformance, self.n_estimators)
+        data = stock_prediction.load_data(self.sample_path)
+        if data.empty:
+            raise ValueError(f"No forward sample in {self.sample_path}")
+        X = model.feature_matrix(data)
+        with instrumentation.stage("predict"):
+            probability, buy = model.predict_proba(X), model.predict(X)
+        instrumentation.count("predict", "rows", len(X))
+        return ScoredSample(model, data["Ticker"].to_numpy(), probability, buy, fingerprints)
+
+    def reload(self, force=False):
+        """
+        Reload the model and rescore the forward sample if the training data or the forward sample have changed
+        :param force: Reload even if nothing has changed
+        :return: dict describing what was done
+        """
+        with self._reload_lock:
+            state = self.state
+            if state is not None and not force:
+                fingerprints = self._fingerprints(state.fingerprints)
+                changed = [path for path in fingerprints
+                           if fingerprints[path]["sha1"] != state.fingerprints[path]["sha1"]]
+                if not changed:
+                    return {"reloaded": False, **self.status()}
+                # Keep the model if only the forward sample has changed
+                model = None if self.training_path in changed else state.model
+            else:
+                model = None
+            start = time.perf_counter()
+            self.state = self._load(model)
+            logging.info(f"Loaded {len(self.state.tickers)} tickers in {time.perf_counter() - start:.2f}s")
+            return {"reloaded": True, **self.status()}
+
+    def score(self, tickers):
+        """
+        :param tickers: list of tickers (any case)
+        :return: list with the score of each ticker, or None for tickers which are not in the forward sample
+        """
+        state = self.state
+        rows = [state.rows.get(ticker.upper()) for ticker in tickers]
+        return [None if i is None else state.row(i) for i in rows]
+
+    def top(self, n=10, buy_only=False):
+        """
+        :param n: Number of tickers
+        :param buy_only: Only include the tickers which are predicted to outperform
+        :return: list of the scores of the n best scoring tickers, best first
+        """
+        state = self.state
+        ranking = state.ranking[state.buy[state.ranking]] if buy_only else state.ranking
+        return [state.row(i) for i in ranking[:n]]
+
+    def status(self):
+        state = self.state
+        return {
+            "model": state.model.identity(),
+            "outperformance": state.model.outperformance,
+            "tickers": len(state.tickers),
+            "buys": int(state.buy.sum()),
+            "loaded_at": state.loaded_at,
+        }
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """
+    JSON endpoints of the server: GET /score, /top and /status, POST /reload
+    """
+    service = None
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self, routes):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path not in routes:
+            self._send(404, {"error": f"Unknown endpoint {url.path}"})
+            return
+        try:
+            self._send(200, routes[url.path](query))
+        except KeyError as e:
+            self._send(400, {"error": f"Missing parameter {e}"})
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+        except Exception as e:
+            logging.exception(f"Error handling {self.path}")
+            self._send(500, {"error": str(e)})
+
+    def do_GET(self):
+        self._handle({
+            "/score": lambda query: {"scores": self.service.score([t for t in query["tickers"].split(",") if t])},
+            "/top": lambda query: {"picks": self.service.top(int(query.get("n", 10)), query.get("buy") == "1")},
+            "/status": lambda query: self.service.status(),
+        })
+
+    def do_POST(self):
+        self._handle({"/reload": lambda query: self.service.reload(force=query.get("force") == "1")})
+
+    def log_message(self, format, *args):
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+
+def make_server(service, host=SERVER_HOST, port=SERVER_PORT):
+    """
+    :param service: PredictionService, which must already be loaded
+    :param host: Address to listen on
+    :param port: Port to listen on (0 picks a free port)
+    :return: ThreadingHTTPServer
+    """
+    handler = type("Handler", (PredictionHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    """
+    :param argv: Command line arguments (defaults to sys.argv[1:])
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--training-data", default="keystats.csv")
+    parser.add_argument("--forward-sample", default="forward_sample.csv")
+    args = parser.parse_args(instrumentation.configure(argv))
+
+    configure_logging()
+    service = PredictionService(args.training_data, args.forward_sample)
+    service.reload(force=True)
+    server = make_server(service, args.host, args.port)
+    logging.info(f"Serving predictions on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+import datastore
+
+
+def to_days(dates):
+    """
+    :param dates: array-like of dates or datetimes
+    :return: int64 array of days since the epoch (times of day are dropped)
+    """
+    return np.asarray(pd.to_datetime(dates).values.astype("datetime64[D]"), dtype=np.int64)
+
+
+def percent_change(before, after):
+    """
+    Percentage change rounded to two decimals, computed in float64 whatever the precision of the prices
+    """
+    before, after = before.astype(np.float64), after.astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.round((after - before) / before * 100, 2)
+
+
+class PriceMatrix:
+    """
+    Compact store of the stock and SP500 prices on trading days only.
+
+    Stock prices are a float32 (ticker x day) matrix, the SP500 is a single float32 row (only "Adj Close" is
+    used), and the trading days are a sorted int32 array of days since the epoch. A calendar date resolves to
+    the last trading day on or before it with a binary search, which gives the same prices as reindexing to
+    every calendar day and forward-filling, without materialising the calendar days.
+    """
+
+    def __init__(self, days, prices, tickers, index_prices):
+        """
+        :param days: sorted day numbers of the trading days
+        :param prices: 2D array (ticker x trading day) of forward-filled stock prices
+        :param tickers: ticker of each row of prices (upper case)
+        :param index_prices: SP500 price on each trading day
+        """
+        self.days = np.asarray(days, dtype=np.int32)
+        self.prices = np.ascontiguousarray(prices, dtype=np.float32)
+        self.tickers = list(tickers)
+        self.rows = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.index_prices = np.asarray(index_prices, dtype=np.float32)
+
+    @classmethod
+    def from_frames(cls, stock_df, sp500_df, index_column="Adj Close"):
+        """
+        Build the matrix from the raw price frames, which are indexed by trading day.
+        Prices are resolved on the union of the trading days of both frames within the stock price history,
+        the range that the daily reindex used to cover.
+        :param stock_df: DataFrame of stock prices, one column per ticker
+        :param sp500_df: DataFrame of SP500 prices
+        :param index_column: The SP500 column to keep
+        :return: PriceMatrix
+        """
+        index = stock_df.index.union(sp500_df.index)
+        index = index[(index >= stock_df.index[0]) & (index <= stock_df.index[-1])]
+        return cls(
+            days=to_days(index),
+            prices=stock_df.reindex(index).ffill().to_numpy(dtype=np.float32).T,
+            tickers=[str(ticker).upper() for ticker in stock_df.columns],
+            index_prices=sp500_df[index_column].reindex(index).ffill().to_numpy(dtype=np.float32),
+        )
+
+    @classmethod
+    def load(cls, stock_path="stock_prices.csv", sp500_path="sp500_index.csv"):
+        """
+        Build the matrix from the price CSVs (read through the binary cache)
+        :return: PriceMatrix
+        """
+        stock_df = datastore.read_csv(stock_path, index_col="Date", parse_dates=True)
+        sp500_df = datastore.read_csv(sp500_path, index_col="Date", parse_dates=True)
+        return cls.from_frames(stock_df, sp500_df)
+
+    def __len__(self):
+        return len(self.days)
+
+    @property
+    def nbytes(self):
+        return self.days.nbytes + self.prices.nbytes + self.index_prices.nbytes
+
+    def positions(self, days):
+        """
+        The trading day on or before each day, or -1 if the day is outside the price history
+        :param days: array of day numbers
+        :return: int64 array of positions into the trading days
+        """
+        days = np.asarray(days, dtype=np.int64)
+        if not len(self.days):
+            return np.full(days.shape, -1, dtype=np.int64)
+        positions = np.searchsorted(self.days, days, side="right") - 1
+        return np.where((positions < 0) | (days > self.days[-1]), -1, positions)
+
+    def ticker_rows(self, tickers):
+        """
+        :param tickers: array-like of tickers (any case)
+        :return: int64 array of rows of the price matrix, or -1 for unknown tickers
+        """
+        return np.array([self.rows.get(str(ticker).upper(), -1) for ticker in tickers], dtype=np.int64)
+
+    def price_changes(self, tickers, dates, horizon_days=365):
+        """
+        Look up the prices on each date and horizon_days later, and compute the percentage changes, in bulk
+        :param tickers: array-like of tickers (any case)
+        :param dates: array-like of dates, aligned with tickers
+        :param horizon_days: Number of calendar days to look ahead
+        :return: (dict of label arrays, boolean array of rows that could be labelled, dict of drop counts by reason)
+        """
+        days = to_days(dates)
+        current_pos = self.positions(days)
+        later_pos = self.positions(days + horizon_days)
+        rows = self.ticker_rows(tickers)
+
+        # Both price series cover the same days, so a date is either missing for both or for neither
+        date_missing = (current_pos < 0) | (later_pos < 0)
+        ticker_missing = ~date_missing & (rows < 0)
+        keep = ~(date_missing | ticker_missing)
+        drop_counts = {"sp500_missing": int(date_missing.sum()), "ticker_missing": int(ticker_missing.sum())}
+
+        # Missing positions are clipped to 0 and then masked out by keep
+        sp500_price = self.index_prices[current_pos.clip(0)]
+        sp500_1y_price = self.index_prices[later_pos.clip(0)]
+        stock_price = self.prices[rows.clip(0), current_pos.clip(0)]
+        stock_1y_price = self.prices[rows.clip(0), later_pos.clip(0)]
+
+        labels = {
+            "Price": stock_price,
+            "stock_p_change": percent_change(stock_price, stock_1y_price),
+            "SP500": sp500_price,
+            "SP500_p_change": percent_change(sp500_price, sp500_1y_price),
+        }
+        return labels, keep, drop_counts
@@ -0,0 +1,52 @@
+from array import array
+import numpy as np
+import pandas as pd
+
+
+class RowBuffer:
+    """
+    Collects rows into per-column buffers and builds a DataFrame once at the end.
+
+    Float columns are stored in typed float64 arrays (with NaN in place of the "N/A" sentinel), so that
+    memory and time grow linearly with the number of rows, rather than copying a DataFrame for every row.
+    All other columns are kept as python lists and their dtype is inferred by pandas when the frame is built.
+    """
+
+    def __init__(self, columns, float_columns=()):
+        """
+        :param columns: list of column names, in row order
+        :param float_columns: the columns which should be stored as float64
+        """
+        self.columns = list(columns)
+        float_columns = set(float_columns)
+        self._buffers = [array("d") if column in float_columns else [] for column in self.columns]
+        self._is_float = [column in float_columns for column in self.columns]
+        self._n_rows = 0
+
+    def __len__(self):
+        return self._n_rows
+
+    def append(self, row):
+        """
+        Add a row to the buffer
+        :param row: sequence of values, aligned with self.columns
+        """
+        if len(row) != len(self.columns):
+            raise ValueError(f"Expected {len(self.columns)} values, got {len(row)}")
+        for buffer, is_float, value in zip(self._buffers, self._is_float, row):
+            if is_float:
+                buffer.append(np.nan if value == "N/A" else float(value))
+            else:
+                buffer.append(value)
+        self._n_rows += 1
+
+    def to_frame(self):
+        """
+        Build the DataFrame from the buffered rows
+        :return: DataFrame with one column per buffer
+        """
+        data = {
+            column: np.frombuffer(buffer, dtype=np.float64).copy() if is_float else list(buffer)
+            for column, buffer, is_float in zip(self.columns, self._buffers, self._is_float)
+        }
+        return pd.DataFrame(data, columns=self.columns)
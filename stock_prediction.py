@@ -1,14 +1,17 @@
+import numpy as np
 import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
 from utils import data_string_to_float, status_calc
+import datastore
+import instrumentation
+import model_registry
+import feature_schema
+from config import OUTPERFORMANCE, configure_logging
 import logging
 import os
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# The percentage by which a stock has to beat the S&P500 to be considered a 'buy'
-OUTPERFORMANCE = int(os.getenv("OUTPERFORMANCE", 10))
+# The scores of the forward sample. Rows whose features and model are unchanged since the last run are not rescored.
+PREDICTIONS_PATH = os.getenv("PREDICTIONS_PATH", "forward_predictions.csv")
 
 def load_data(file_path):
     """
@@ -17,26 +20,155 @@ def load_data(file_path):
     :return: DataFrame with data
     """
     try:
-        data_df = pd.read_csv(file_path, index_col="Date")
-        data_df.dropna(axis=0, how="any", inplace=True)
+        with instrumentation.stage("load_data"):
+            data_df = datastore.read_csv(file_path, index_col="Date")
+            rows = len(data_df)
+            data_df.dropna(axis=0, how="any", inplace=True)
+        instrumentation.count("load_data", "bytes_read", os.path.getsize(file_path))
+        instrumentation.count("load_data", "dropped_missing_values", rows - len(data_df))
         return data_df
     except Exception as e:
         logging.error(f"Error loading data from {file_path}: {str(e)}")
         return pd.DataFrame()
 
-def build_data_set():
+def build_data_set(file_path="keystats.csv", outperformance=OUTPERFORMANCE):
     """
-    Reads the keystats.csv file and prepares it for scikit-learn
+    Reads the keystats.csv file and prepares it for scikit-learn. The features are read from the memory-mapped
+    matrix of the data cache. If CHUNKSIZE is set, the file is streamed in chunks into a float32 matrix instead.
+    :param file_path: Path to the training data
+    :param outperformance: Percentage by which a stock has to beat the S&P500 to be labelled 1
     :return: X_train and y_train numpy arrays
     """
-    training_data = load_data("keystats.csv")
-    if training_data.empty:
+    if datastore.STREAMING:
+        arrays = datastore.stream_training_arrays(file_path, outperformance)
+        return arrays["X"], list(arrays["y"])
+
+    try:
+        with instrumentation.stage("load_data"):
+            arrays = datastore.read_training_arrays(file_path, outperformance)
+    except Exception as e:
+        logging.error(f"Error loading data from {file_path}: {str(e)}")
+        arrays = None
+    if arrays is None or not len(arrays["X"]):
         logging.error("Training data loading failed. Exiting build_data_set.")
         return None, None
-    
-    features = training_data.columns[6:]
-    X_train = training_data[features].values
-    y_train = list(
-        status_calc(
-            training_data["stock_p_change"],
-            training_data["
\ No newline at end of file
+    return arrays["X"], list(arrays["y"])
+
+def train_classifier(file_path="keystats.csv", outperformance=OUTPERFORMANCE, n_estimators=100):
+    """
+    Train a RandomForestClassifier on the training data
+    :param file_path: Path to the training data
+    :param outperformance: Percentage by which a stock has to beat the S&P500 to be labelled 1
+    :param n_estimators: Number of trees in the forest
+    :return: fitted classifier and the list of features it was trained on
+    """
+    with instrumentation.stage("build_data_set"):
+        X_train, y_train = build_data_set(file_path, outperformance)
+    if X_train is None:
+        raise ValueError(f"No training data in {file_path}")
+    clf = RandomForestClassifier(n_estimators=n_estimators, random_state=0)
+    with instrumentation.stage("fit"):
+        clf.fit(X_train, y_train)
+    instrumentation.count("fit", "rows", len(X_train))
+    header = pd.read_csv(file_path, index_col="Date", nrows=0)
+    return clf, feature_schema.feature_columns(header.columns)
+
+def get_model(file_path="keystats.csv", outperformance=OUTPERFORMANCE, n_estimators=100):
+    """
+    Load the saved model if it is still valid for the training data and threshold, otherwise retrain it
+    :return: model_registry.TrainedModel
+    """
+    return model_registry.load_or_train(
+        train_classifier, file_path, outperformance, params={"n_estimators": n_estimators}
+    )
+
+def load_predictions(predictions_path, model_id):
+    """
+    Load the scores written by the last run, if they were made by the same model
+    :param predictions_path: Path to the predictions csv
+    :param model_id: TrainedModel.identity() of the current model
+    :return: DataFrame indexed by ticker (empty if there are no usable scores)
+    """
+    try:
+        previous = pd.read_csv(predictions_path, dtype={"Ticker": str, "row_hash": np.uint64})
+        previous = previous[previous["model"] == model_id]
+        return previous.drop_duplicates("Ticker").set_index("Ticker")
+    except (OSError, ValueError, KeyError):
+        return pd.DataFrame(columns=["probability", "buy", "row_hash", "model"])
+
+def update_predictions(model, data, predictions_path=PREDICTIONS_PATH):
+    """
+    Score the forward sample, only rescoring the tickers whose features have changed since the last run
+    (or all of them if the model has changed), and write the scores to predictions_path
+    :param model: model_registry.TrainedModel
+    :param data: forward sample DataFrame, indexed by Date
+    :param predictions_path: Path to the predictions csv
+    :return: DataFrame with the Ticker, probability of outperforming, buy flag, feature hash and model of each row
+    """
+    tickers = data["Ticker"].to_numpy()
+    positions = feature_schema.feature_positions(data.columns, model.features)
+    row_hash = pd.util.hash_pandas_object(data.iloc[:, positions], index=False).to_numpy()
+    model_id = model.identity()
+
+    previous = load_predictions(predictions_path, model_id)
+    positions = previous.index.get_indexer(tickers)
+    reuse = positions >= 0
+    reuse[reuse] = previous["row_hash"].to_numpy()[positions[reuse]] == row_hash[reuse]
+
+    probability = np.zeros(len(data))
+    buy = np.zeros(len(data), dtype=bool)
+    probability[reuse] = previous["probability"].to_numpy()[positions[reuse]]
+    buy[reuse] = previous["buy"].to_numpy()[positions[reuse]]
+    if not reuse.all():
+        X_test = model.feature_matrix(data[~reuse])
+        probability[~reuse] = model.predict_proba(X_test)
+        buy[~reuse] = model.predict(X_test)
+    instrumentation.count("predict", "rows", int((~reuse).sum()))
+    logging.info(f"Scored {int((~reuse).sum())} of {len(data)} tickers ({int(reuse.sum())} unchanged).")
+
+    predictions = pd.DataFrame({
+        "Ticker": tickers, "probability": probability, "buy": buy, "row_hash": row_hash, "model": model_id
+    })
+    predictions.to_csv(predictions_path + ".tmp", index=False)
+    os.replace(predictions_path + ".tmp", predictions_path)
+    return predictions
+
+def predict_stocks():
+    """
+    Uses the saved (or a freshly trained) RandomForestClassifier to predict which stocks in forward_sample.csv
+    will outperform the S&P500
+    :return: list of tickers predicted to outperform
+    """
+    try:
+        model = get_model()
+    except ValueError as e:
+        logging.error(str(e))
+        return []
+
+    data = load_data("forward_sample.csv")
+    if data.empty:
+        logging.error("Forward sample loading failed. Exiting predict_stocks.")
+        return []
+
+    with instrumentation.stage("predict"):
+        predictions = update_predictions(model, data)
+    y_pred = predictions["buy"].to_numpy()
+    if not y_pred.any():
+        logging.warning("No stocks predicted!")
+        return []
+
+    invest_list = predictions["Ticker"][y_pred].tolist()
+    logging.info(
+        f"{len(invest_list)} stocks predicted to outperform the S&P500 by more than {OUTPERFORMANCE}%:"
+    )
+    logging.info(" ".join(invest_list))
+    return invest_list
+
+def main():
+    logging.info("Building dataset and predicting stocks...")
+    predict_stocks()
+
+if __name__ == "__main__":
+    configure_logging()
+    instrumentation.configure()
+    main()
@@ -0,0 +1,168 @@
+"""
+Parallel sweep over OUTPERFORMANCE thresholds and random forest parameters.
+
+    python sweep.py --thresholds 0 5 10 20 --n-estimators 50 100 200 --max-depth 0 10 --jobs 8
+
+The keystats feature matrix is loaded once and written to a .npy file which every worker memory-maps
+read-only, so no task copies the dataset. Labels are computed once per threshold. Each task trains on the
+older snapshots and is evaluated on the most recent ones (with a one-year gap, so no label is from the
+test period), and the accuracy, precision and returns from calculate_returns are collected in a table.
+"""
+import argparse
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from backtesting import calculate_returns, load_data
+from utils import status_calc
+import feature_schema
+from config import configure_logging
+
+# Memory-mapped arrays, opened once per worker process by _init_worker
+_shared = {}
+
+
+def time_split(dates, test_size=0.2, embargo_days=365):
+    """
+    Split date-sorted rows into a training set of older snapshots and a test set of the most recent ones.
+    Training rows must be at least embargo_days older than the first test row, so that all of their
+    one-year labels were known at the start of the test period.
+    :param dates: sorted datetime64[D] array
+    :param test_size: Fraction of rows in the test set
+    :param embargo_days: Gap between the last training row and the first test row
+    :return: (train_end, test_start) indices
+    """
+    test_start = int(len(dates) * (1 - test_size))
+    train_end = int(np.searchsorted(dates, dates[test_start] - np.timedelta64(embargo_days, "D")))
+    return train_end, test_start
+
+
+def prepare_shared_arrays(data_df, thresholds, directory):
+    """
+    Write the feature matrix, the labels for every threshold and the returns to .npy files.
+    The features are stored as C-contiguous float32, which is what the forest uses internally,
+    so fitting on the memory map does not make a copy.
+    :param data_df: DataFrame with data, indexed by Date
+    :param thresholds: list of outperformance thresholds
+    :param directory: where to write the arrays
+    :return: dict mapping array name to file path
+    """
+    dates = pd.to_datetime(data_df.index).values.astype("datetime64[D]")
+    order = np.argsort(dates, kind="stable")
+    arrays = {
+        "X": feature_schema.feature_matrix(data_df, feature_schema.feature_columns(data_df.columns))[order],
+        "labels": np.array([
+            np.asarray(status_calc(data_df["stock_p_change"], data_df["SP500_p_change"], threshold), dtype=bool)[order]
+            for threshold in thresholds
+        ]),
+        "z": np.ascontiguousarray(data_df[["stock_p_change", "SP500_p_change"]].to_numpy(dtype=np.float64)[order]),
+        "dates": dates[order],
+    }
+    paths = {}
+    for name, array in arrays.items():
+        paths[name] = os.path.join(directory, f"{name}.npy")
+        np.save(paths[name], array)
+    return paths
+
+
+def _init_worker(paths):
+    for name, path in paths.items():
+        _shared[name] = np.load(path, mmap_mode="r")
+
+
+def run_task(task, test_size=0.2):
+    """
+    Train and evaluate one (threshold, parameters) combination on the shared arrays
+    :param task: (threshold index, threshold, dict of RandomForestClassifier parameters)
+    :param test_size: Fraction of the most recent rows used for testing
+    :return: dict of results
+    """
+    threshold_idx, threshold, params = task
+    X, y, z = _shared["X"], _shared["labels"][threshold_idx], _shared["z"]
+    train_end, test_start = time_split(_shared["dates"], test_size)
+
+    clf = RandomForestClassifier(random_state=0, n_jobs=1, **params)
+    clf.fit(X[:train_end], y[:train_end])
+    y_pred = clf.predict(X[test_start:]).astype(bool)
+    y_test = y[test_start:]
+
+    trades, stock_return, market_return, outperformance = calculate_returns(y_pred, np.asarray(z[test_start:]))
+    return dict(
+        outperformance_threshold=threshold,
+        **params,
+        accuracy=float((y_pred == y_test).mean()),
+        precision=float(y_test[y_pred].mean()) if y_pred.any() else np.nan,
+        trades=int(trades),
+        stock_return=stock_return,
+        market_return=market_return,
+        outperformance=outperformance,
+    )
+
+
+def run_sweep(data_df, thresholds, param_grid, n_jobs=1, test_size=0.2):
+    """
+    Evaluate every combination of threshold and forest parameters in a pool of worker processes
+    :param data_df: DataFrame with data, indexed by Date
+    :param thresholds: list of outperformance thresholds
+    :param param_grid: dict mapping RandomForestClassifier parameter names to lists of values
+    :param n_jobs: Number of worker processes
+    :param test_size: Fraction of the most recent rows used for testing
+    :return: DataFrame with one row per combination
+    """
+    names = list(param_grid)
+    combinations = [dict(zip(names, values)) for values in itertools.product(*param_grid.values())]
+    tasks = [(i, threshold, params) for i, threshold in enumerate(thresholds) for params in combinations]
+    logging.info(f"Running {len(tasks)} sweep tasks on {n_jobs} processes...")
+
+    directory = tempfile.mkdtemp(prefix="mls-sweep-")
+    try:
+        paths = prepare_shared_arrays(data_df, thresholds, directory)
+        if n_jobs <= 1:
+            _init_worker(paths)
+            results = [run_task(task, test_size) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(paths,)) as executor:
+                results = list(executor.map(run_task, tasks, [test_size] * len(tasks)))
+    finally:
+        _shared.clear()
+        shutil.rmtree(directory, ignore_errors=True)
+    return pd.DataFrame(results)
+
+
+def main(argv=None):
+    """
+    :param argv: Command line arguments (defaults to sys.argv[1:])
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="keystats.csv", help="training data")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0, 5, 10, 15, 20])
+    parser.add_argument("--n-estimators", type=int, nargs="+", default=[100])
+    parser.add_argument("--max-depth", type=int, nargs="+", default=[0], help="0 means no limit")
+    parser.add_argument("--min-samples-leaf", type=int, nargs="+", default=[1])
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default="sweep_results.csv")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    data_df = load_data(args.data)
+    if data_df.empty:
+        logging.error("Data loading failed. Exiting sweep.")
+        return
+
+    param_grid = {
+        "n_estimators": args.n_estimators,
+        "max_depth": [depth or None for depth in args.max_depth],
+        "min_samples_leaf": args.min_samples_leaf,
+    }
+    results = run_sweep(data_df, args.thresholds, param_grid, n_jobs=args.jobs)
+    results.to_csv(args.output, index=False)
+    logging.info("\n%s", results.to_string(index=False, float_format="%.2f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import backtesting
+
+
+def test_walk_forward_folds_no_lookahead():
+    """
+    Training data must end one label horizon before each test period, and test periods must not overlap
+    """
+    dates = np.sort(np.datetime64("2004-01-01") + np.random.RandomState(0).randint(0, 3650, 2000)).astype("datetime64[D]")
+    folds = backtesting.walk_forward_folds(dates, min_train_days=730, test_days=182, embargo_days=365)
+    assert len(folds) > 5
+
+    previous_test_end = 0
+    for train_start, train_end, test_start, test_end in folds:
+        assert train_start == 0
+        assert dates[train_end - 1] <= dates[test_start] - np.timedelta64(365, "D")
+        assert test_start >= previous_test_end
+        previous_test_end = test_end
+
+    sliding = backtesting.walk_forward_folds(dates, train_days=365)
+    assert all(dates[train_end - 1] - dates[train_start] <= np.timedelta64(365, "D") for train_start, train_end, _, _ in sliding)
+
+
+def test_calculate_returns_no_predictions():
+    z_test = np.array([[10.0, 5.0], [20.0, 5.0]])
+    assert backtesting.calculate_returns(np.array([False, False]), z_test) == (0, 0, 0, 0)
+
+
+def test_prepare_arrays():
+    """
+    The arrays are sorted by date, keep the file order within a day, and leave out rows with a missing value
+    """
+    data_df = pd.DataFrame({
+        "Date": ["2006-01-02 10:00:00", "2005-01-03 09:00:00", "2006-01-02 09:00:00", "2005-06-01 00:00:00"],
+        "Unix": 0.0, "Ticker": ["msft", "aapl", "aapl", "goog"], "Price": 1.0,
+        "stock_p_change": [30.0, 5.0, 12.0, 40.0], "SP500": 1.0, "SP500_p_change": [10.0, 0.0, 0.0, 0.0],
+        "Beta": [1.0, 2.0, 3.0, np.nan], "Float": [4.0, 5.0, 6.0, 7.0],
+    }).set_index("Date")
+    arrays = backtesting.prepare_arrays(data_df, outperformance=10)
+
+    assert arrays["tickers"].tolist() == ["aapl", "msft", "aapl"]
+    assert arrays["dates"].tolist() == np.array(["2005-01-03", "2006-01-02", "2006-01-02"], dtype="datetime64[D]").tolist()
+    np.testing.assert_array_equal(arrays["X"], [[2.0, 5.0], [1.0, 4.0], [3.0, 6.0]])
+    np.testing.assert_array_equal(arrays["z"], [[5.0, 0.0], [30.0, 10.0], [12.0, 0.0]])
+    assert arrays["y"].tolist() == [False, True, True]
+
+
+def test_split_arrays_matches_split_data(tmp_path, monkeypatch):
+    """
+    Splitting the arrays read from the cache gives the same sets as splitting the loaded DataFrame
+    """
+    monkeypatch.setattr(backtesting.datastore, "CACHE_DIR", str(tmp_path / "cache"))
+    csv_path = str(tmp_path / "keystats.csv")
+    rng = np.random.RandomState(0)
+    pd.DataFrame({
+        "Date": pd.date_range("2005-01-01", periods=50).astype(str), "Unix": 0.0, "Ticker": "a", "Price": 1.0,
+        "stock_p_change": rng.normal(0, 20, 50), "SP500": 1.0, "SP500_p_change": rng.normal(0, 10, 50),
+        "Beta": rng.normal(size=50), "Float": rng.normal(size=50),
+    }).to_csv(csv_path, index=False)
+
+    arrays = backtesting.datastore.read_training_arrays(csv_path, backtesting.OUTPERFORMANCE)
+    from_arrays = backtesting.split_arrays(arrays)
+    from_frame = backtesting.split_data(backtesting.load_data(csv_path))
+    for a, b in zip(from_arrays, from_frame):
+        np.testing.assert_array_equal(np.asarray(a), np.asarray(b))
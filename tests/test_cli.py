@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+import pytest
+import cli
+
+
+def test_light_imports():
+    """
+    The settings, the command line parser and utils.status_calc do not import the scientific stack
+    """
+    code = ("import sys, cli, config, utils; cli.make_parser(); utils.status_calc(20, 5); "
+            "print(sorted({'numpy', 'pandas', 'sklearn', 'requests', 'tqdm'} & set(sys.modules)))")
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+    assert output.strip() == "[]"
+
+
+def test_arguments():
+    parser = cli.make_parser()
+    args = parser.parse_args(["parse", "--incremental", "--jobs", "3"])
+    assert args.incremental and not args.hash and args.jobs == 3
+
+    args, extra = parser.parse_known_args(["serve", "--port", "0", "--training-data", "data.csv"])
+    assert args.run is cli.run_serve
+    assert extra == ["--port", "0", "--training-data", "data.csv"]
+
+    with pytest.raises(SystemExit):
+        cli.main(["parse", "--port", "0"])
+    with pytest.raises(SystemExit):
+        cli.main([])
@@ -0,0 +1,47 @@
+import os
+import current_data
+import feature_schema
+import parse_cache
+from manifest import save_manifest
+
+PAGE = "<td>Beta</td><td>{beta}</td><td>Float</td><td>{float}</td>"
+
+
+def write_page(directory, ticker, beta, mtime):
+    path = directory / f"{ticker}.html"
+    path.write_text(PAGE.format(beta=beta, float="2M"))
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_update_forward(tmp_path, monkeypatch):
+    """
+    Only new and changed pages are parsed, and the result is the same as a full parse
+    """
+    forward_dir = tmp_path / "forward"
+    forward_dir.mkdir()
+    monkeypatch.setattr(current_data, "forwardpath", str(forward_dir) + "/")
+    monkeypatch.setattr(parse_cache, "PARSE_CACHE", "")
+    for i, ticker in enumerate(["aaa", "bbb", "ccc"]):
+        write_page(forward_dir, ticker, i, 10 ** 18)
+
+    sample_path = str(tmp_path / "forward_sample.csv")
+    df, manifest = current_data.update_forward(sample_path)
+    # The existing sample is in the older layout, with the page labels as column names
+    old_names = dict(zip(feature_schema.names(), feature_schema.labels("forward")))
+    df.rename(columns=old_names).to_csv(sample_path, index=False)
+    save_manifest(str(tmp_path / "forward_sample_manifest.json"), manifest)
+
+    write_page(forward_dir, "bbb", 5, 2 * 10 ** 18)
+    os.remove(forward_dir / "ccc.html")
+    write_page(forward_dir, "ddd", 7, 10 ** 18)
+    parsed = []
+    parse_forward_files = current_data.parse_forward_files
+    monkeypatch.setattr(current_data, "parse_forward_files", lambda files: parsed.extend(files) or parse_forward_files(files))
+
+    df, manifest = current_data.update_forward(sample_path)
+    assert sorted(parsed) == ["bbb.html", "ddd.html"]
+    assert sorted(manifest) == ["aaa.html", "bbb.html", "ddd.html"]
+    full_df = parse_forward_files(current_data.list_forward_files())
+    assert df["Ticker"].tolist() == full_df["Ticker"].tolist()
+    assert df["Beta"].tolist() == full_df["Beta"].tolist()
+    assert df.columns.tolist() == full_df.columns.tolist()
@@ -0,0 +1,74 @@
+import os
+import numpy as np
+import pandas as pd
+import datastore
+
+
+def test_read_csv_cache(tmp_path, monkeypatch):
+    """
+    The cached frame matches the CSV, float columns can be memory-mapped, and rewriting the CSV invalidates the cache
+    """
+    monkeypatch.setattr(datastore, "CACHE_DIR", str(tmp_path / "cache"))
+    csv_path = str(tmp_path / "data.csv")
+    df = pd.DataFrame({"Date": ["2010-01-01", "2010-01-02"], "Ticker": ["a", "b"],
+                       "x": [1.0, 2.0], "y": [3.0, np.nan], "z": [5.0, 6.0]})
+    df.to_csv(csv_path, index=False)
+
+    first = datastore.read_csv(csv_path, index_col="Date")
+    second = datastore.read_csv(csv_path, index_col="Date")
+    assert first.equals(second)
+    assert first.equals(pd.read_csv(csv_path, index_col="Date"))
+
+    matrix, columns = datastore.read_array(csv_path, ["y", "z"], index_col="Date")
+    assert columns == ["y", "z"]
+    assert isinstance(matrix.base, np.memmap) or isinstance(matrix, np.memmap)
+    np.testing.assert_array_equal(matrix, first[["y", "z"]].to_numpy())
+
+    df["x"] = [10.0, 20.0]
+    df.to_csv(csv_path, index=False)
+    os.utime(csv_path, ns=(0, os.stat(csv_path).st_mtime_ns + 1))
+    assert datastore.read_csv(csv_path, index_col="Date")["x"].tolist() == [10.0, 20.0]
+
+
+def test_stream_training_arrays(tmp_path):
+    """
+    Streaming in small chunks gives the same rows as loading the whole file and dropping missing values
+    """
+    csv_path = str(tmp_path / "keystats.csv")
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame({
+        "Date": pd.date_range("2005-01-01", periods=25).astype(str), "Unix": 0.0, "Ticker": "a", "Price": 1.0,
+        "stock_p_change": rng.normal(0, 20, 25), "SP500": 1.0, "SP500_p_change": rng.normal(0, 10, 25),
+        "f1": rng.normal(size=25), "f2": rng.normal(size=25),
+    })
+    df.loc[[3, 17], "f2"] = np.nan
+    df.to_csv(csv_path, index=False)
+
+    arrays = datastore.stream_training_arrays(csv_path, outperformance=10, chunksize=4)
+    expected = pd.read_csv(csv_path, index_col="Date").dropna()
+    assert arrays["X"].dtype == np.float32
+    np.testing.assert_array_equal(arrays["X"], expected[["f1", "f2"]].to_numpy(dtype=np.float32))
+    assert arrays["y"].tolist() == (expected["stock_p_change"] - expected["SP500_p_change"] >= 10).tolist()
+    assert len(arrays["dates"]) == len(arrays["tickers"]) == 23
+
+
+def test_read_training_arrays(tmp_path, monkeypatch):
+    """
+    The arrays taken from the memory-mapped matrix match the frame with missing values dropped
+    """
+    monkeypatch.setattr(datastore, "CACHE_DIR", str(tmp_path / "cache"))
+    csv_path = str(tmp_path / "keystats.csv")
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame({
+        "Date": pd.date_range("2005-01-01", periods=10).astype(str), "Unix": 0, "Ticker": "a", "Price": 1.0,
+        "stock_p_change": rng.normal(0, 20, 10), "SP500": 1.0, "SP500_p_change": rng.normal(0, 10, 10),
+        "f1": rng.normal(size=10), "f2": rng.normal(size=10),
+    })
+    df.loc[[2, 7], "f1"] = np.nan
+    df.to_csv(csv_path, index=False)
+
+    arrays = datastore.read_training_arrays(csv_path, outperformance=10)
+    expected = pd.read_csv(csv_path, index_col="Date").dropna()
+    np.testing.assert_array_equal(arrays["X"], expected[["f1", "f2"]].to_numpy())
+    np.testing.assert_array_equal(arrays["z"], expected[["stock_p_change", "SP500_p_change"]].to_numpy())
+    assert arrays["y"].tolist() == (expected["stock_p_change"] - expected["SP500_p_change"] >= 10).tolist()
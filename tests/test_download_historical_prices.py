@@ -0,0 +1,88 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("pandas_datareader")
+pytest.importorskip("fix_yahoo_finance")
+import download_historical_prices as dhp
+
+
+class FakeSource:
+    """
+    Price source which records its requests and has no data for the tickers in `empty`
+    """
+
+    def __init__(self, empty=()):
+        self.empty = set(empty)
+        self.requests = []
+
+    def __call__(self, tickers, start, end):
+        self.requests.append((sorted(tickers), start, end))
+        dates = pd.date_range(start, end, freq="D")
+        return pd.DataFrame({ticker: [float(i) for i in range(len(dates))]
+                             for ticker in tickers if ticker not in self.empty}, index=dates)
+
+
+def test_update_price_store(tmp_path):
+    """
+    A second run only fetches the range which is not covered yet, and tickers without data are retried
+    """
+    store_path = str(tmp_path / "store")
+    source = FakeSource(empty={"CCC"})
+    failed = dhp.update_price_store(["AAA", "BBB", "CCC"], "2010-01-01", "2010-01-10", batch_size=2,
+                                    n_workers=1, source=source, store_path=store_path)
+    assert failed == []
+    assert sorted(t for tickers, _, _ in source.requests for t in tickers) == ["AAA", "BBB", "CCC"]
+    assert dhp.load_stored_prices("CCC", store_path) == (None, None)
+    prices, coverage = dhp.load_stored_prices("AAA", store_path)
+    assert coverage == {"ranges": [["2010-01-01", "2010-01-10"]]}
+    assert len(prices) == 10
+
+    # Resume with a later end date: the stored tickers only fetch the new days, the empty one everything
+    source = FakeSource()
+    dhp.update_price_store(["AAA", "BBB", "CCC"], "2010-01-01", "2010-01-15", batch_size=2,
+                           n_workers=1, source=source, store_path=store_path)
+    assert sorted(source.requests) == [(["AAA", "BBB"], "2010-01-11", "2010-01-15"),
+                                       (["CCC"], "2010-01-01", "2010-01-15")]
+    prices, coverage = dhp.load_stored_prices("AAA", store_path)
+    assert coverage == {"ranges": [["2010-01-01", "2010-01-15"]]}
+    assert prices.index.is_monotonic_increasing and len(prices) == 15
+    assert dhp.load_stored_prices("CCC", store_path)[1] == {"ranges": [["2010-01-01", "2010-01-15"]]}
+
+    # Nothing is left to fetch
+    source = FakeSource()
+    dhp.update_price_store(["AAA", "BBB", "CCC"], "2010-01-01", "2010-01-15", source=source,
+                           store_path=store_path)
+    assert source.requests == []
+
+
+def test_update_price_store_after_covered_end(tmp_path):
+    """
+    A request which starts after the covered range does not mark the gap between them as covered
+    """
+    store_path = str(tmp_path / "store")
+    dhp.update_price_store(["AAA"], "2010-01-01", "2010-01-10", n_workers=1, source=FakeSource(),
+                           store_path=store_path)
+    dhp.update_price_store(["AAA"], "2010-02-01", "2010-02-10", n_workers=1, source=FakeSource(),
+                           store_path=store_path)
+    assert dhp.load_stored_prices("AAA", store_path)[1] == {
+        "ranges": [["2010-01-01", "2010-01-10"], ["2010-02-01", "2010-02-10"]]
+    }
+
+    source = FakeSource()
+    dhp.update_price_store(["AAA"], "2010-01-01", "2010-02-10", n_workers=1, source=source, store_path=store_path)
+    assert source.requests == [(["AAA"], "2010-01-11", "2010-01-31")]
+    prices, coverage = dhp.load_stored_prices("AAA", store_path)
+    assert coverage == {"ranges": [["2010-01-01", "2010-02-10"]]}
+    assert len(prices) == 41
+
+
+def test_missing_ranges():
+    coverage = {"ranges": [["2010-01-01", "2010-12-31"], ["2012-01-01", "2012-12-31"]]}
+    assert dhp.missing_ranges(coverage, "2009-07-01", "2013-06-30") == [
+        ("2009-07-01", "2009-12-31"), ("2011-01-01", "2011-12-31"), ("2013-01-01", "2013-06-30")]
+    assert dhp.missing_ranges(coverage, "2010-02-01", "2010-03-01") == []
+    # The coverage of stores written with a single range
+    assert dhp.missing_ranges({"start": "2010-01-01", "end": "2015-12-31"}, "2017-01-01", "2020-12-31") == [
+        ("2017-01-01", "2020-12-31")]
+    assert dhp.merge_coverage({"start": "2010-01-01", "end": "2015-12-31"}, "2017-01-01", "2020-12-31") == {
+        "ranges": [["2010-01-01", "2015-12-31"], ["2017-01-01", "2020-12-31"]]}
@@ -0,0 +1,87 @@
+import re
+import pytest
+from feature_extractor import FeatureExtractor, read_document
+from utils import data_string_to_float
+
+
+def reference_extract(source, features):
+    """
+    The original one-regex-per-feature search, which the extractor must reproduce
+    """
+    value_list = []
+    for variable in features:
+        regex = (
+            r">" + re.escape(variable) + r".*?(\-?\d+\.*\d*K?M?B?|N/A[\\n|\s]*|>0|NaN)%?"
+            r"(</td>|</span>)"
+        )
+        match = re.search(regex, source, flags=re.DOTALL)
+        value_list.append(data_string_to_float(match.group(1)) if match else "N/A")
+    return value_list
+
+
+def test_extract_matches_reference():
+    """
+    Overlapping labels, values inside other values and missing labels must all give the old result
+    """
+    features = ["Total Cash", "Total Cash Per Share", "Revenue", "Beta", "Float", "Missing"]
+    source = (
+        "<tr><td>Total Cash Per Share</td><td>1.52</td></tr>"
+        "<tr><td>Total Cash (mrq)</td><td>25.3B</td></tr>"
+        "<tr><td>Revenue</td><td>N/A\n</td></tr>"
+        "<tr><td>Beta</td><td>-0.5%</span>"
+        "<tr><td>Float</td><td>>0</td></tr>"
+    )
+    assert FeatureExtractor(features).extract(source) == reference_extract(source, features)
+
+    # A label directly followed by digits starts its value search inside another value match
+    source = "<td>12345</td><td>Beta123</td>"
+    assert FeatureExtractor(["Beta"]).extract(source) == reference_extract(source, ["Beta"]) == [123]
+
+
+def test_extract_fallback_label():
+    """
+    The fallback label is only used when the main label yields no value, and does not accept NaN
+    """
+    extractor = FeatureExtractor(["Avg Vol (3 month)"], fallbacks={"Avg Vol (3 month)": "Average Volume (3 month)"})
+    assert extractor.extract("<td>Average Volume (3 month)</td><td>2.5M</td>") == [2500000]
+    assert extractor.extract("<td>Avg Vol (3 month)</td><td>10K</td>") == [10000]
+    assert extractor.extract("<td>Average Volume (3 month)</td><td>NaN</td>") == ["N/A"]
+
+
+def test_extract_malformed_value():
+    """
+    Malformed values still raise, so that callers can discard the whole row as before
+    """
+    with pytest.raises(ValueError):
+        FeatureExtractor(["Beta"]).extract("<td>Beta</td><td>1..2</td>")
+
+
+def test_extract_thousands_separators():
+    """
+    Matching the raw bytes with separators allowed inside numbers gives the same result as removing every
+    comma from the document first
+    """
+    features = ["Revenue", "Total Cash", "Beta", "Float"]
+    source = (
+        "<p>Revenue, Total Cash and Beta</p>"
+        "<tr><td>Revenue</td><td>1,234,567</td></tr>"
+        "<tr><td>Total Cash</td><td>-12,345.67M</td></tr>"
+        "<tr><td>Beta</td><td>x,5,</td></tr>"
+        "<tr><td>Float</td><td>N/A, </td></tr>"
+    )
+    expected = reference_extract(source.replace(",", ""), features)
+    assert expected == [1234567, -12345670000, 5, "N/A"]
+    assert FeatureExtractor(features).extract(source.encode()) == expected
+    assert FeatureExtractor(features).extract(source) == expected
+
+
+def test_read_document(tmp_path):
+    """
+    The reused buffer grows for large files, and each view holds the contents of its file
+    """
+    small, large = tmp_path / "small.html", tmp_path / "large.html"
+    small.write_bytes(b"<td>Beta</td><td>1,5</td>")
+    large.write_bytes(b"x" * (1 << 20) + b"<td>Beta</td><td>2</td>")
+    assert bytes(read_document(small)) == small.read_bytes()
+    assert bytes(read_document(large)) == large.read_bytes()
+    assert FeatureExtractor(["Beta"]).extract(read_document(small)) == [15]
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+import config
+import feature_schema
+
+
+def test_schema_layout():
+    assert config.features == feature_schema.names()
+    assert [feature_schema.get(label).name for label in config.forward_features] == feature_schema.names()
+    feature = feature_schema.get("Quarterly Revenue Growth")
+    assert feature.aliases == ("Qtrly Revenue Growth", "Quarterly Revenue Growth")
+    # No label is an alias of two features
+    aliases = [alias for feature in feature_schema.FEATURES for alias in feature.aliases]
+    assert len(aliases) == len(set(aliases))
+    assert feature_schema.get_extractor("forward") is feature_schema.get_extractor("forward")
+
+
+def test_feature_matrix():
+    """
+    Features are found at their fixed column, by alias, or anywhere in the frame, always in the requested order
+    """
+    rng = np.random.RandomState(0)
+    values = rng.normal(size=(5, len(feature_schema.FEATURES)))
+    index = {column: 0.0 for column in feature_schema.INDEX_COLUMNS}
+    aligned = pd.DataFrame(dict(index, **dict(zip(feature_schema.names(), values.T))))
+    labelled = pd.DataFrame(dict(index, **dict(zip(feature_schema.labels("forward"), values.T))))
+    shuffled = labelled.iloc[:, rng.permutation(labelled.shape[1])]
+
+    names = feature_schema.names()
+    columns = [feature.column for feature in feature_schema.FEATURES]
+    assert feature_schema.feature_positions(aligned.columns, names) == columns
+    expected = values.astype(np.float32)
+    for df in (aligned, labelled, shuffled):
+        np.testing.assert_array_equal(feature_schema.feature_matrix(df, names), expected)
+
+    out = np.zeros((5, 2))
+    feature_schema.feature_matrix(shuffled, ["Beta", "Shares Short (as of"], out=out)
+    np.testing.assert_array_equal(out, values[:, [29, 37]])
+    with pytest.raises(ValueError):
+        feature_schema.feature_positions(aligned.columns, ["Missing"])
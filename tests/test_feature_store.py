@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import parsing_keystats
+from feature_store import FeatureStore
+
+
+def make_store():
+    rng = np.random.RandomState(0)
+    trading_days = pd.bdate_range("2005-01-03", "2007-12-31")
+    stock_df = pd.DataFrame({"AAPL": rng.uniform(10, 20, len(trading_days)),
+                             "MSFT": rng.uniform(20, 30, len(trading_days))}, index=trading_days)
+    stock_df.iloc[:5, 1] = np.nan
+    sp500_days = trading_days[trading_days != pd.Timestamp("2006-03-01")]
+    sp500_df = pd.DataFrame({"Adj Close": rng.uniform(100, 200, len(sp500_days))}, index=sp500_days)
+    keystats_df = pd.DataFrame({
+        "Date": ["2005-06-01 10:00:00", "2005-01-10 09:00:00", "2006-02-04 12:00:00", "2005-03-01 08:00:00"],
+        "Unix": 0.0, "Ticker": ["aapl", "aapl", "msft", "goog"], "Price": 0.0, "stock_p_change": 0.0,
+        "SP500": 0.0, "SP500_p_change": 0.0, "Beta": [1.0, 2.0, 3.0, 4.0], "Float": [5.0, 6.0, 7.0, 8.0],
+    }).set_index("Date")
+    return FeatureStore.from_frames(keystats_df, stock_df, sp500_df), stock_df, sp500_df
+
+
+def test_asof_has_no_lookahead():
+    store, _, _ = make_store()
+    assert store.asof("aapl", "2005-01-09") is None
+    date, features = store.asof("aapl", "2005-05-31")
+    assert date == np.datetime64("2005-01-10") and features["Beta"] == 2.0
+    assert store.asof("aapl", "2005-06-01")[1]["Beta"] == 1.0
+
+    cross_section = store.cross_section("2005-04-01")
+    assert cross_section.index.tolist() == ["aapl", "goog"]
+    assert cross_section.loc["goog", "Float"] == 8.0
+
+
+def test_price_changes_match_daily_fill():
+    """
+    As-of lookups on trading days give the same labels as reindexing to every day and forward-filling
+    """
+    store, stock_df, sp500_df = make_store()
+    idx = pd.date_range(stock_df.index[0], stock_df.index[-1])
+    daily_sp500 = sp500_df.reindex(idx).ffill()["Adj Close"].astype(np.float32)
+    daily_stock = stock_df.reindex(idx).ffill().astype(np.float32)
+
+    rng = np.random.RandomState(1)
+    dates = pd.Timestamp("2004-12-01") + pd.to_timedelta(rng.randint(0, 1200, 300), unit="D")
+    tickers = rng.choice(["aapl", "msft", "goog"], 300)
+    labels, keep, drop_counts = store.price_changes(tickers, dates)
+
+    expected_keep = []
+    for i, (ticker, date) in enumerate(zip(tickers, dates)):
+        later = date + pd.Timedelta(days=365)
+        expected_keep.append(date in idx and later in idx and ticker.upper() in daily_stock.columns)
+        if not expected_keep[-1]:
+            continue
+        assert labels["SP500"][i] == daily_sp500[date] or np.isnan(daily_sp500[date])
+        price, price_1y = float(daily_stock.loc[date, ticker.upper()]), float(daily_stock.loc[later, ticker.upper()])
+        np.testing.assert_equal(labels["Price"][i], np.float32(price))
+        np.testing.assert_equal(labels["stock_p_change"][i], np.round((price_1y - price) / price * 100, 2))
+    assert keep.tolist() == expected_keep
+    assert drop_counts["sp500_missing"] + drop_counts["ticker_missing"] == keep.size - keep.sum()
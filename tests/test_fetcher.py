@@ -0,0 +1,81 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from fetcher import Fetcher, TokenBucket
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Serves /<ticker> pages with an ETag. /flaky fails once with a 503 before succeeding.
+    """
+    requests_seen = []
+    flaky_failures = 1
+
+    def do_GET(self):
+        StubHandler.requests_seen.append((self.path, self.headers.get("If-None-Match")))
+        if self.path == "/flaky" and StubHandler.flaky_failures > 0:
+            StubHandler.flaky_failures -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+        etag = f'"{self.path}-v1"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = f"<td>Beta</td><td>1.5</td>{self.path}".encode()
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    StubHandler.requests_seen = []
+    StubHandler.flaky_failures = 1
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_all_conditional_and_retry(stub_server, tmp_path):
+    """
+    Pages are downloaded concurrently, failures are retried, and unchanged pages are skipped on the next run
+    """
+    validators_path = str(tmp_path / "validators.json")
+    jobs = [(name, f"{stub_server}/{name}", str(tmp_path / f"{name}.html")) for name in ["aapl", "msft", "flaky"]]
+
+    fetcher = Fetcher(concurrency=3, rate=0, backoff=0.01, validators_path=validators_path)
+    assert dict(fetcher.fetch_all(jobs)) == {"aapl": "downloaded", "msft": "downloaded", "flaky": "downloaded"}
+    fetcher.save_validators()
+    assert (tmp_path / "aapl.html").read_text() == "<td>Beta</td><td>1.5</td>/aapl"
+    assert sum(path == "/flaky" for path, _ in StubHandler.requests_seen) == 2
+
+    # A new fetcher reads the stored ETags and sends conditional requests
+    fetcher = Fetcher(concurrency=3, rate=0, validators_path=validators_path)
+    assert dict(fetcher.fetch_all(jobs)) == {"aapl": "unchanged", "msft": "unchanged", "flaky": "unchanged"}
+
+
+def test_fetch_gives_up(stub_server, tmp_path):
+    StubHandler.flaky_failures = 10
+    fetcher = Fetcher(rate=0, max_retries=2, backoff=0.01)
+    assert fetcher.fetch(f"{stub_server}/flaky", str(tmp_path / "flaky.html")) == "failed"
+    assert len(StubHandler.requests_seen) == 3
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=50, capacity=1)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # The first token is available immediately, the next five take 1/50 s each
+    assert time.monotonic() - start >= 0.09
@@ -0,0 +1,63 @@
+import pytest
+import instrumentation
+
+
+@pytest.fixture
+def instrumented(monkeypatch):
+    instrumentation.reset()
+    monkeypatch.setattr(instrumentation, "ENABLED", True)
+    yield
+    instrumentation.reset()
+
+
+def test_disabled_records_nothing():
+    instrumentation.reset()
+    with instrumentation.stage("regex"):
+        instrumentation.count("regex", "bytes_read", 10)
+    instrumentation.record_drops("price_lookup", {"ticker_missing": 1})
+    assert instrumentation.summary()["stages"] == {}
+
+
+def test_stages_and_counters(instrumented):
+    for _ in range(3):
+        with instrumentation.stage("read_html"):
+            instrumentation.count("read_html", "bytes_read", 100)
+    instrumentation.record_drops("price_lookup", {"sp500_missing": 2, "ticker_missing": 1})
+
+    stages = instrumentation.summary()["stages"]
+    assert stages["read_html"]["calls"] == 3
+    assert stages["read_html"]["counters"] == {"bytes_read": 300}
+    assert stages["price_lookup"]["counters"] == {"dropped_sp500_missing": 2, "dropped_ticker_missing": 1}
+
+
+def test_worker_stats_are_merged(instrumented):
+    with instrumentation.stage("fit"):
+        pass
+    worker_stats = instrumentation.Collected(lambda n: instrumentation.count("fit", "rows", n) or n)(5)
+    assert worker_stats[0] == 5
+    assert worker_stats[1]["stages"] == {"fit": {"seconds": 0.0, "calls": 0, "counters": {"rows": 5}}}
+
+    # Collected records into its own stats, so the stats of this process are left alone until merged
+    assert instrumentation.summary()["stages"]["fit"]["counters"] == {}
+    instrumentation.merge(worker_stats[1])
+    instrumentation.merge(worker_stats[1])
+    stages = instrumentation.summary()["stages"]
+    assert stages["fit"]["calls"] == 1 and stages["fit"]["counters"] == {"rows": 10}
+
+
+def test_map_collected_in_process(instrumented, monkeypatch):
+    """
+    With the builtin map the stats are recorded directly, and the settings of this process are kept
+    """
+    monkeypatch.setattr(instrumentation, "PROFILE_STAGE", "")
+    instrumentation.count("parse", "files", 1)
+    results = list(instrumentation.map_collected(map, lambda n: instrumentation.count("parse", "files", n) or n,
+                                                 [2, 3]))
+    assert results == [2, 3]
+    assert instrumentation.summary()["stages"]["parse"]["counters"] == {"files": 6}
+
+    instrumentation.Collected(lambda: None)()
+    monkeypatch.setattr(instrumentation, "ENABLED", False)
+    instrumentation.Collected(lambda: None)()
+    assert instrumentation.ENABLED is False
+    assert instrumentation.summary()["stages"]["parse"]["counters"] == {"files": 6}
@@ -0,0 +1,31 @@
+import numpy as np
+from sklearn.tree import DecisionTreeClassifier
+import model_registry
+
+
+def test_load_or_train(tmp_path, monkeypatch):
+    """
+    The model is only retrained when the training data, the threshold or the parameters change
+    """
+    monkeypatch.setattr(model_registry, "MODEL_DIR", str(tmp_path / "models"))
+    data_path = tmp_path / "keystats.csv"
+    data_path.write_text("a,b\n1,2\n")
+    calls = []
+
+    def train(file_path, outperformance, max_depth=None):
+        calls.append((outperformance, max_depth))
+        clf = DecisionTreeClassifier(max_depth=max_depth).fit([[0.0], [1.0]], [False, True])
+        return clf, ["x"]
+
+    model = model_registry.load_or_train(train, str(data_path), 10, {"max_depth": 2})
+    assert model.predict(np.array([[0.9]])).tolist() == [True]
+    model_registry.load_or_train(train, str(data_path), 10, {"max_depth": 2})
+    assert len(calls) == 1
+
+    model_registry.load_or_train(train, str(data_path), 15, {"max_depth": 2})
+    model_registry.load_or_train(train, str(data_path), 15, {"max_depth": 3})
+    assert len(calls) == 3
+
+    data_path.write_text("a,b\n1,30\n")
+    model_registry.load_or_train(train, str(data_path), 15, {"max_depth": 3})
+    assert len(calls) == 4
@@ -0,0 +1,65 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from feature_extractor import FeatureExtractor
+from parse_cache import ParseCache
+
+PAGE = "<td>Beta</td><td>1.5</td><td>Market Cap</td><td>2,500M</td>"
+
+
+def write_pages(directory, n):
+    paths = []
+    for i in range(n):
+        path = os.path.join(directory, f"{i}.html")
+        with open(path, "w") as file:
+            file.write(PAGE + f"<td>Float</td><td>{i}</td>")
+        paths.append(path)
+    return paths
+
+
+def test_cached_results_match(tmp_path):
+    extractor = FeatureExtractor(["Market Cap", "Beta", "Float"])
+    path = write_pages(str(tmp_path), 1)[0]
+    cache = ParseCache(str(tmp_path / "cache.sqlite"))
+
+    expected = extractor.extract(PAGE.replace(",", "") + "<td>Float</td><td>0</td>")
+    assert cache.extract_file(path, extractor) == expected
+    assert cache.extract_file(path, extractor) == expected
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # A different feature list is a different extractor version, so the document is parsed again
+    assert cache.extract_file(path, FeatureExtractor(["Beta"])) == [1.5]
+    assert cache.misses == 2
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    extractor = FeatureExtractor(["Float"])
+    paths = write_pages(str(tmp_path), 4)
+    cache = ParseCache(str(tmp_path / "cache.sqlite"), max_entries=3)
+    for path in paths[:3]:
+        cache.extract_file(path, extractor)
+    cache.extract_file(paths[0], extractor)
+    cache.flush()
+    cache.extract_file(paths[3], extractor)
+    cache.evict()
+
+    cache.hits = cache.misses = 0
+    for path in [paths[0], paths[2], paths[3], paths[1]]:
+        cache.extract_file(path, extractor)
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def _parse_all(args):
+    db_path, paths = args
+    cache = ParseCache(db_path)
+    values = [cache.extract_file(path, FeatureExtractor(["Float"])) for path in paths]
+    cache.close()
+    return values
+
+
+def test_concurrent_writers(tmp_path):
+    paths = write_pages(str(tmp_path), 50)
+    db_path = str(tmp_path / "cache.sqlite")
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(_parse_all, [(db_path, paths)] * 8))
+    assert all(values == [[float(i)] for i in range(50)] for values in results)
+    assert ParseCache(db_path).extract_file(paths[7], FeatureExtractor(["Float"])) == [7.0]
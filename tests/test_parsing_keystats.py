@@ -0,0 +1,87 @@
+import os
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import parsing_keystats
+from price_matrix import PriceMatrix
+
+
+def test_label_snapshots(caplog):
+    """
+    Prices are looked up on the snapshot date and 365 days later, and rows without data are counted by reason
+    """
+    idx = pd.bdate_range("2005-01-03", "2006-12-29")
+    sp500_df = pd.DataFrame({"Open": 0.0, "Adj Close": np.linspace(100, 200, len(idx))}, index=idx)
+    stock_df = pd.DataFrame({"AAPL": np.linspace(10, 40, len(idx))}, index=idx)
+    prices = PriceMatrix.from_frames(stock_df, sp500_df)
+
+    date_stamps = [
+        datetime(2005, 3, 1, 23, 30), datetime(2006, 6, 1), datetime(2005, 3, 1), datetime(2004, 1, 1),
+        datetime(2005, 3, 6),
+    ]
+    tickers = ["aapl", "aapl", "msft", "aapl", "aapl"]
+    values = [1.0] * len(parsing_keystats.features)
+    # Two ticker directories, so the snapshots are not given to the store in (ticker, date) order
+    parsed_tickers = [
+        [(date_stamps[i], 0.0, tickers[i], [float(i)] + values[1:]) for i in (0, 1, 3, 4)],
+        [(date_stamps[2], 0.0, tickers[2], [2.0] + values[1:])],
+    ]
+    df = parsing_keystats.label_snapshots(parsed_tickers, prices)
+
+    assert df["Date"].tolist() == [date_stamps[0], date_stamps[4]]
+    assert df[parsing_keystats.features[0]].tolist() == [0.0, 4.0]
+    assert "{'sp500_missing': 2, 'ticker_missing': 1}" in caplog.text
+
+    price = np.float32(stock_df.loc["2005-03-01", "AAPL"])
+    price_1y = np.float32(stock_df.loc["2006-03-01", "AAPL"])
+    assert df["Price"][0] == price
+    assert df["stock_p_change"][0] == round((float(price_1y) - float(price)) / float(price) * 100, 2)
+    assert df["SP500"][0] == np.float32(sp500_df.loc["2005-03-01", "Adj Close"])
+
+    # A Sunday resolves to the previous Friday, both for the snapshot date and a year later
+    assert df["Price"][1] == np.float32(stock_df.loc["2005-03-04", "AAPL"])
+    assert df["SP500"][1] == np.float32(sp500_df.loc["2005-03-04", "Adj Close"])
+    assert prices.prices.shape == (1, len(idx)) and prices.days.dtype == np.int32
+
+
+def write_snapshot(directory, ticker, date, beta):
+    path = directory / ticker
+    path.mkdir(exist_ok=True)
+    (path / f"{date}000000.html").write_text(f"<td>Beta</td><td>{beta}</td><td>Float</td><td>2M</td>")
+
+
+def test_update_keystats(tmp_path, monkeypatch):
+    """
+    After snapshots are added, modified and deleted, an incremental update gives the same rows as a full build
+    """
+    statspath = tmp_path / "_KeyStats"
+    statspath.mkdir()
+    monkeypatch.setattr(parsing_keystats, "statspath", str(statspath) + "/")
+    monkeypatch.setattr(parsing_keystats.parse_cache, "PARSE_CACHE", "")
+    idx = pd.bdate_range("2005-01-03", "2007-12-31")
+    sp500_df = pd.DataFrame({"Adj Close": np.linspace(100, 200, len(idx))}, index=idx)
+    stock_df = pd.DataFrame({"AAA": np.linspace(10, 40, len(idx)), "BBB": np.linspace(40, 10, len(idx))}, index=idx)
+    prices = PriceMatrix.from_frames(stock_df, sp500_df)
+    for ticker, date, beta in [("aaa", "20050301", 1), ("aaa", "20050601", 2), ("bbb", "20050301", 3)]:
+        write_snapshot(statspath, ticker, date, beta)
+
+    # Every snapshot is taken at midnight, so the dates are written without a time
+    keystats_path = str(tmp_path / "keystats.csv")
+    df, manifest = parsing_keystats.update_keystats(prices, keystats_path, n_jobs=1)
+    df.to_csv(keystats_path, index=False)
+    parsing_keystats.save_manifest(str(tmp_path / "keystats_manifest.json"), manifest)
+    assert pd.read_csv(keystats_path)["Date"][0] == "2005-03-01"
+
+    write_snapshot(statspath, "aaa", "20050901", 4)
+    write_snapshot(statspath, "bbb", "20050301", 5)
+    os.utime(statspath / "bbb" / "20050301000000.html", ns=(2 * 10 ** 18, 2 * 10 ** 18))
+    os.remove(statspath / "aaa" / "20050601000000.html")
+
+    df, manifest = parsing_keystats.update_keystats(prices, keystats_path, n_jobs=1)
+    assert sorted(manifest) == ["aaa/20050301000000.html", "aaa/20050901000000.html", "bbb/20050301000000.html"]
+    full_df = parsing_keystats.parse_keystats(prices, n_jobs=1)
+    # New rows are appended at the end, whereas a full build is in walk order
+    df = df.assign(Date=pd.to_datetime(df["Date"])).sort_values(["Ticker", "Date"]).reset_index(drop=True)
+    full_df = full_df.sort_values(["Ticker", "Date"]).reset_index(drop=True)
+    pd.testing.assert_frame_equal(df, full_df, check_dtype=False)
+    assert df["Beta"].tolist() == [1, 4, 5]
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import portfolio
+from price_matrix import PriceMatrix
+
+
+def make_prices(n_tickers=20, seed=0):
+    rng = np.random.RandomState(seed)
+    index = pd.bdate_range("2005-01-03", "2009-12-31")
+    stock_df = pd.DataFrame(
+        50 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, (len(index), n_tickers)), axis=0)),
+        index=index, columns=[f"T{i}" for i in range(n_tickers)],
+    )
+    sp500_df = pd.DataFrame({"Adj Close": 1000 * np.exp(np.cumsum(rng.normal(0.0002, 0.01, len(index))))}, index=index)
+    return PriceMatrix.from_frames(stock_df, sp500_df)
+
+
+def reference_equity(prices, lots, max_positions):
+    """
+    Day by day simulation with a cash account and a list of open lots
+    """
+    order = np.argsort(lots["entry"], kind="stable")
+    entry, exit, rows = lots["entry"][order], lots["exit"][order], lots["rows"][order]
+    size = 1 / max_positions
+    cash, held, equity = 1.0, [], []
+    for day in range(entry.min(), exit.max() + 1):
+        for lot in [lot for lot in held if exit[lot] == day]:
+            cash += size * prices.prices[rows[lot], day] / prices.prices[rows[lot], entry[lot]]
+            held.remove(lot)
+        for lot in np.flatnonzero(entry == day):
+            if len(held) < max_positions:
+                held.append(lot)
+                cash -= size
+        equity.append(cash + sum(size * prices.prices[rows[lot], day] / prices.prices[rows[lot], entry[lot]]
+                                 for lot in held))
+    return np.array(equity)
+
+
+def test_simulate_matches_daily_loop():
+    prices = make_prices()
+    rng = np.random.RandomState(1)
+    dates = pd.bdate_range("2005-01-03", "2008-06-30")[rng.randint(0, 800, 60)]
+    tickers = [f"t{i}" for i in rng.randint(0, 20, 60)]
+
+    result = portfolio.simulate(prices, dates, tickers, max_positions=5, cost_bps=0)
+    expected = reference_equity(prices, portfolio.build_lots(prices, dates, tickers), 5)
+    np.testing.assert_allclose(result["equity"], expected, rtol=1e-6)
+    assert result["trades"] + result["skipped"] == 60
+    assert result["skipped"] > 0
+    assert result["max_drawdown"] <= 0
+
+
+def test_simulate_variants():
+    """
+    Simulating many variants at once gives the same result as simulating each of them alone
+    """
+    prices = make_prices()
+    rng = np.random.RandomState(2)
+    dates = pd.bdate_range("2005-01-03", "2008-06-30")[rng.randint(0, 800, 100)]
+    tickers = [f"T{i}" for i in rng.randint(0, 20, 100)]
+    signals = rng.rand(4, 100) > 0.5
+    signals[2] = signals[1]
+    max_positions = [5, 10, 10, 20]
+    cost_bps = [0, 0, 25, 10]
+
+    batch = portfolio.simulate(prices, dates, tickers, signals, max_positions=max_positions, cost_bps=cost_bps)
+    for i in range(4):
+        single = portfolio.simulate(prices, dates, tickers, signals[i], max_positions=max_positions[i],
+                                    cost_bps=cost_bps[i])
+        assert batch["trades"][i] == single["trades"]
+        np.testing.assert_allclose(batch["equity"][i, -1], single["equity"][-1])
+
+    # The same trades with costs
+    assert batch["total_return"][2] < batch["total_return"][1]
+    assert len(portfolio.summary(batch)) == 4
+
+
+def test_simulate_costs_and_unknown_tickers():
+    prices = make_prices()
+    dates, tickers = ["2006-01-03", "2006-01-03"], ["T0", "UNKNOWN"]
+    result = portfolio.simulate(prices, dates, tickers, max_positions=1, cost_bps=100)
+    lots = portfolio.build_lots(prices, dates, tickers)
+    growth = prices.prices[0, lots["exit"][0]] / prices.prices[0, lots["entry"][0]]
+    assert result["untradable"] == 1
+    assert result["trades"] == 1
+    # 1% is paid on the amount bought and on the amount sold
+    np.testing.assert_allclose(result["equity"][-1], growth - 0.01 - 0.01 * growth, rtol=1e-6)
+
+
+def test_simulate_same_entry_different_exits():
+    """
+    A Sunday signal enters on the Friday before but exits a trading day later than the Friday signal,
+    and the slot freed by the Friday lot can be used a year later whatever the order of the signals
+    """
+    prices = make_prices()
+    dates, tickers = ["2006-01-08", "2006-01-06", "2007-01-05"], ["T0", "T1", "T2"]
+    lots = portfolio.build_lots(prices, dates, tickers)
+    assert lots["entry"][0] == lots["entry"][1] and lots["exit"][0] > lots["exit"][1]
+
+    result = portfolio.simulate(prices, dates, tickers, max_positions=2, cost_bps=0)
+    assert result["trades"] == 3
+    np.testing.assert_allclose(result["equity"], reference_equity(prices, lots, 2), rtol=1e-6)
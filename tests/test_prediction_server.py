@@ -0,0 +1,50 @@
+import json
+import threading
+import urllib.request
+import pandas as pd
+import datastore
+import model_registry
+import prediction_server
+
+
+def write_sample(path, tickers, betas, stock_p_change=0):
+    pd.DataFrame({
+        "Date": "2017-01-01", "Unix": 0, "Ticker": tickers, "Price": 0, "stock_p_change": stock_p_change,
+        "SP500": 0, "SP500_p_change": 0, "Beta": betas,
+    }).to_csv(path, index=False)
+
+
+def test_prediction_server(tmp_path, monkeypatch):
+    monkeypatch.setattr(datastore, "CACHE_DIR", "")
+    monkeypatch.setattr(model_registry, "MODEL_DIR", str(tmp_path / "models"))
+    training_path, sample_path = str(tmp_path / "keystats.csv"), str(tmp_path / "forward_sample.csv")
+    # Stocks with a high beta outperformed
+    write_sample(training_path, ["a"] * 20, [i / 10 for i in range(20)], [50 * (i >= 10) for i in range(20)])
+    write_sample(sample_path, ["AAA", "BBB", "CCC"], [0.1, 1.9, 1.5])
+
+    service = prediction_server.PredictionService(training_path, sample_path, outperformance=10, n_estimators=10)
+    service.reload(force=True)
+    server = prediction_server.make_server(service, "127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def request(path, method="GET"):
+        with urllib.request.urlopen(urllib.request.Request(url + path, method=method)) as response:
+            return json.load(response)
+
+    try:
+        scores = request("/score?tickers=aaa,BBB,ZZZ")["scores"]
+        assert [score and score["buy"] for score in scores] == [False, True, None]
+        assert [pick["ticker"] for pick in request("/top?n=2")["picks"]] == ["BBB", "CCC"]
+        assert request("/reload", "POST")["reloaded"] is False
+
+        model = service.state.model
+        write_sample(sample_path, ["AAA", "DDD"], [1.9, 0.0])
+        assert request("/reload", "POST")["reloaded"] is True
+        # Only the forward sample changed, so the model is kept
+        assert service.state.model is model
+        assert request("/status")["tickers"] == 2
+        assert request("/score?tickers=AAA")["scores"][0]["buy"] is True
+    finally:
+        server.shutdown()
+        server.server_close()
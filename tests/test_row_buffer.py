@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from row_buffer import RowBuffer
+
+
+def test_row_buffer_to_frame():
+    """
+    Float columns are float64 with NaN in place of "N/A", other columns keep their values
+    """
+    rows = RowBuffer(["Ticker", "Price", "Beta"], float_columns=["Price", "Beta"])
+    rows.append(["aapl", 100, "N/A"])
+    rows.append(["msft", 50.5, -0.2])
+    assert len(rows) == 2
+
+    df = rows.to_frame()
+    assert list(df.columns) == ["Ticker", "Price", "Beta"]
+    assert list(df["Ticker"]) == ["aapl", "msft"]
+    assert df["Price"].dtype == np.float64
+    assert df["Beta"].isnull().tolist() == [True, False]
+
+    # The buffer can keep growing after a frame has been built
+    rows.append(["goog", 1, 1])
+    assert len(rows.to_frame()) == 3
+
+
+def test_row_buffer_row_length():
+    rows = RowBuffer(["Ticker", "Price"], float_columns=["Price"])
+    with pytest.raises(ValueError):
+        rows.append(["aapl"])
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+from sklearn.tree import DecisionTreeClassifier
+import model_registry
+import stock_prediction
+
+
+def forward_sample(betas):
+    df = pd.DataFrame({
+        "Date": 0, "Unix": 0, "Ticker": [f"T{i}" for i in range(len(betas))], "Price": 0, "stock_p_change": 0,
+        "SP500": 0, "SP500_p_change": 0, "Beta": betas,
+    })
+    return df.set_index("Date")
+
+
+def test_update_predictions(tmp_path, monkeypatch):
+    """
+    Only rows whose features changed are rescored, unless the model changed
+    """
+    clf = DecisionTreeClassifier().fit([[0.0], [1.0]], [False, True])
+    model = model_registry.TrainedModel(clf, ["Beta"], 10, {"sha1": "a"})
+    predictions_path = str(tmp_path / "forward_predictions.csv")
+    scored = []
+    predict_proba = model.predict_proba
+    monkeypatch.setattr(model, "predict_proba", lambda X: scored.append(len(X)) or predict_proba(X))
+
+    first = stock_prediction.update_predictions(model, forward_sample([0.0, 1.0, 0.0]), predictions_path)
+    assert first["buy"].tolist() == [False, True, False]
+
+    second = stock_prediction.update_predictions(model, forward_sample([0.0, 1.0, 1.0, 1.0]), predictions_path)
+    assert scored == [3, 2]
+    assert second["buy"].tolist() == [False, True, True, True]
+    np.testing.assert_array_equal(second["probability"], [0, 1, 1, 1])
+
+    model.fingerprint = {"sha1": "b"}
+    stock_prediction.update_predictions(model, forward_sample([0.0, 1.0, 1.0, 1.0]), predictions_path)
+    assert scored == [3, 2, 4]
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+import sweep
+
+
+def test_run_sweep(monkeypatch):
+    """
+    One result row per threshold and parameter combination, with the labels computed once per threshold
+    """
+    rng = np.random.RandomState(0)
+    n = 400
+    data_df = pd.DataFrame({
+        "Unix": 0, "Ticker": "a", "Price": 1.0, "stock_p_change": rng.normal(5, 20, n), "SP500": 1.0,
+        "SP500_p_change": rng.normal(0, 10, n), "f1": rng.normal(size=n), "f2": rng.normal(size=n),
+    }, index=pd.Index((np.datetime64("2004-01-01") + rng.randint(0, 3650, n)).astype(str), name="Date"))
+
+    calls = []
+    status_calc = sweep.status_calc
+
+    def counting_status_calc(stock, sp500, outperformance):
+        calls.append(outperformance)
+        return status_calc(stock, sp500, outperformance)
+
+    monkeypatch.setattr(sweep, "status_calc", counting_status_calc)
+
+    thresholds = [0, 10]
+    param_grid = {"n_estimators": [5, 10], "max_depth": [None, 3]}
+    results = sweep.run_sweep(data_df, thresholds, param_grid, n_jobs=1)
+
+    assert calls == thresholds
+    assert len(results) == len(thresholds) * 4
+    assert list(results.columns) == ["outperformance_threshold", "n_estimators", "max_depth", "accuracy",
+                                     "precision", "trades", "stock_return", "market_return", "outperformance"]
+    assert sorted(results["outperformance_threshold"].unique()) == thresholds
+    assert results["accuracy"].between(0, 1).all()
@@ -1,4 +1,5 @@
 import pytest
+import numpy as np
 import utils
 
 
@@ -43,3 +44,45 @@ def test_data_string_to_float():
         utils.data_string_to_float("10k")
     with pytest.raises(ValueError):
         utils.data_string_to_float("2KB")
+
+
+def test_data_strings_to_floats():
+    """
+    The batch parser should give the same numbers as data_string_to_float, with NaN for missing values.
+    """
+    tokens = ["asdfNaN", ">N/A\n</", ">0", "-3", "4K", "2M", "0.07B", "-100.1K", "-0.1M", "-0.02B", "-0.00",
+              "0.00", "0M", "010K", "", None]
+    expected = [utils.data_string_to_float(token or "N/A") for token in tokens]
+    expected = [np.nan if value == "N/A" else value for value in expected]
+    np.testing.assert_array_equal(utils.data_strings_to_floats(tokens), expected)
+
+    # The shape of the input is kept
+    result = utils.data_strings_to_floats([["1K", None], ["N/A", "2.5"]])
+    np.testing.assert_array_equal(result, [[1000, np.nan], [np.nan, 2.5]])
+
+    for token in [">0x", "10k", "2KB"]:
+        with pytest.raises(ValueError):
+            utils.data_strings_to_floats(["1", token])
+    assert np.isnan(utils.data_strings_to_floats(["1", ">0x", "10k", "2KB"], strict=False)[1:]).all()
+
+
+def test_find_duplicates():
+    import pandas as pd
+
+    df = pd.DataFrame({
+        "Ticker": ["a", "b", "c"],
+        "Price": [5.0, 1.0, 2.0],
+        "x": [5.0, 1.0, 0.0],
+        "y": [5.0, 2.0, 0.0],
+        "z": [3.0, 1.0, np.nan],
+        "w": [3.0, 4.0, np.nan],
+    })
+    original = df.copy()
+    report = utils.find_duplicates(df)
+    # Groups are in order of value within a row. Price is ignored, zeros are not reported and NaN is never a duplicate
+    assert report.to_dict("records") == [
+        {"row": 0, "columns": ("z", "w"), "value": 3.0, "adjacent": True},
+        {"row": 0, "columns": ("x", "y"), "value": 5.0, "adjacent": True},
+        {"row": 1, "columns": ("x", "z"), "value": 1.0, "adjacent": False},
+    ]
+    pd.testing.assert_frame_equal(df, original)
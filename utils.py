@@ -1,3 +1,6 @@
+# numpy and pandas are imported by the functions which use them, so that importing utils stays cheap
+
+
 def data_string_to_float(number_string):
     """
     The result of our regex search is a number stored as a string, but we need a float.
@@ -24,39 +27,110 @@ def data_string_to_float(number_string):
         return float(number_string)
 
 
+def data_strings_to_floats(tokens, strict=True):
+    """
+    Batch version of data_string_to_float, which converts a whole column (or block) of regex tokens into a
+    float64 array in one call, with NaN for missing values instead of the "N/A" sentinel.
+    :param tokens: array-like of value strings (of any shape), with None for missing values
+    :param strict: raise a ValueError for malformed tokens such as '10k' or '2KB', as data_string_to_float does.
+                   Otherwise malformed tokens become NaN.
+    :return: float64 array of the same shape as tokens
+    """
+    import numpy as np
+
+    def to_float(token):
+        if not token:
+            return np.nan
+        try:
+            value = data_string_to_float(token)
+        except ValueError:
+            if strict:
+                raise
+            return np.nan
+        return np.nan if value == "N/A" else value
+
+    tokens = np.asarray(tokens, dtype=object)
+    return np.fromiter(map(to_float, tokens.ravel()), dtype=np.float64, count=tokens.size).reshape(tokens.shape)
+
+
+# Columns which often (correctly) have the same value as other columns
+DUPLICATE_IGNORE_COLUMNS = [
+    "Unix",
+    "Price",
+    "stock_p_change",
+    "SP500",
+    "SP500_p_change",
+    "Float",
+    "200-Day Moving Average",
+    "Short Ratio",
+    "Operating Margin",
+]
+
+
+def find_duplicates(df, ignore_columns=DUPLICATE_IGNORE_COLUMNS, ignore_values=(0,)):
+    """
+    Find values which are repeated within a row of the numeric columns, a common symptom of failed parsing.
+    Each row is sorted once, so equal values end up next to each other and every group of duplicates is a run
+    of the sorted row. The dataframe is not modified.
+    :param df: the dataframe to be checked
+    :param ignore_columns: columns which are not checked (missing ones are skipped)
+    :param ignore_values: duplicated values which are not reported. A duplicate value of zero is quite common.
+    :return: DataFrame with one row per group of duplicates: the row position, the names of the columns,
+             the value, and whether any two of the columns are next to each other (adjacent)
+    """
+    import numpy as np
+    import pandas as pd
+
+    columns = [column for column in df.select_dtypes(include=[np.number, bool]).columns
+               if column not in ignore_columns]
+    report = pd.DataFrame({"row": pd.Series(dtype=np.int64), "columns": pd.Series(dtype=object),
+                           "value": pd.Series(dtype=np.float64), "adjacent": pd.Series(dtype=bool)})
+    if len(columns) < 2 or not len(df):
+        return report
+
+    values = df[columns].to_numpy(dtype=np.float64)
+    order = np.argsort(values, axis=1, kind="stable")
+    sorted_values = np.take_along_axis(values, order, axis=1)
+    # NaN never compares equal, so missing values are not duplicates
+    equal = sorted_values[:, 1:] == sorted_values[:, :-1]
+    # The stable sort keeps equal values in column order, so neighbouring columns are one position apart
+    adjacent = equal & (np.diff(order, axis=1) == 1)
+
+    rows, pairs = np.nonzero(equal)
+    if not len(rows):
+        return report
+    run_starts = np.flatnonzero(np.r_[True, (rows[1:] != rows[:-1]) | (pairs[1:] != pairs[:-1] + 1)])
+    run_ends = np.r_[run_starts[1:], len(rows)] - 1
+    run_rows = rows[run_starts]
+    first, last = pairs[run_starts], pairs[run_ends] + 1
+    run_values = sorted_values[run_rows, first]
+    run_adjacent = np.logical_or.reduceat(adjacent[rows, pairs], run_starts)
+
+    keep = ~np.isin(run_values, np.asarray(ignore_values, dtype=np.float64))
+    names = np.asarray(columns, dtype=object)
+    return pd.DataFrame({
+        "row": run_rows[keep],
+        "columns": [tuple(names[order[row, start:end + 1]])
+                    for row, start, end in zip(run_rows[keep], first[keep], last[keep])],
+        "value": run_values[keep],
+        "adjacent": run_adjacent[keep],
+    })
+
+
 def duplicate_error_check(df):
     """
     A common symptom of failed parsing is when there are consecutive duplicate values. This function was used
     to find the duplicates and tweak the regex. Any remaining duplicates are probably coincidences.
-    :param df: the dataframe to be checked
+    :param df: the dataframe to be checked (it is not modified)
     :return: Prints out a list of the rows containing duplicates, as well as the duplicated values.
     """
-    # Some columns often (correctly) have the same value as other columns. Remove these.
-    df.drop(
-        [
-            "Unix",
-            "Price",
-            "stock_p_change",
-            "SP500",
-            "SP500_p_change",
-            "Float",
-            "200-Day Moving Average",
-            "Short Ratio",
-            "Operating Margin",
-        ],
-        axis=1,
-        inplace=True,
-    )
-
-    for i in range(len(df)):
-        # Check if there are any duplicates.
-        if pd.Series(df.iloc[i] == df.iloc[i].shift()).any():
-            duplicates = set(
-                [x for x in list(df.iloc[i]) if list(df.iloc[i]).count(x) > 1]
-            )
-            # A duplicate value of zero is quite common. We want other duplicates.
-            if duplicates != {0}:
-                print(i, df.iloc[i], duplicates, sep="\n")
+    report = find_duplicates(df, ignore_values=())
+    flagged = report.loc[report["adjacent"], "row"].unique()
+    for i, row_report in report[report["row"].isin(flagged)].groupby("row"):
+        duplicates = set(row_report["value"])
+        # A duplicate value of zero is quite common. We want other duplicates.
+        if duplicates != {0}:
+            print(i, df.iloc[i], duplicates, sep="\n")
 
 
 def status_calc(stock, sp500, outperformance=10):